@@ -1,12 +1,14 @@
 #!/usr/bin/env python
 
 from typing import List, Generator, Optional
+from contextlib import asynccontextmanager
 from dataclasses import asdict
 import os
 import json
 import jwt
 from io import BytesIO
-from fastapi import FastAPI, UploadFile, Depends, Security, HTTPException, BackgroundTasks
+from fastapi import FastAPI, UploadFile, Depends, Security, HTTPException, BackgroundTasks, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import Response, JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
@@ -18,22 +20,23 @@ import importlib.metadata
 from brontes.domain.models import Portfolio, User, Facility, Document, Device, Point, Discipline
 from brontes.application.dtos.document_dto import DocumentMetadataChunk, DocumentQuery
 from brontes.application.dtos.device_dto import DeviceCreateParams
-from brontes.application.dtos.point_dto import PointUpdates, PointCreateParams
+from brontes.application.dtos.point_dto import PointUpdates, PointCreateParams, Downsampling, ExportFormat, Fill, Resolution, StreamFormat
 
 ### Infrastructure/External Services
 from brontes.infrastructure import KnowledgeGraph, AzureBlobStore, Postgres, Timescale, OpenaiAudio, MQTTClient
+from brontes.infrastructure.db.timescale import parse_duration
+## Custom
+knowledge_graph = KnowledgeGraph()
+blob_store = AzureBlobStore()
+postgres = Postgres()
 ## Langchain
 embeddings = OpenAIEmbeddings()
 vector_store = PGVector(
   collection_name=os.environ.get("POSTGRES_EMBEDDINGS_TABLE"),
-  connection=os.environ.get("POSTGRES_CONNECTION_STRING"),
+  connection=postgres.sqlalchemy_engine(),
   embeddings=embeddings,
   use_jsonb=True
 )
-## Custom
-knowledge_graph = KnowledgeGraph()
-blob_store = AzureBlobStore()
-postgres = Postgres()
 timescale = Timescale(postgres=postgres)
 audio = OpenaiAudio()
 mqtt_client = MQTTClient()
@@ -49,19 +52,28 @@ device_repository = DeviceRepository(kg=knowledge_graph)
 ai_repository = AIRepository(postgres=postgres, kg=knowledge_graph)
 
 ### Application Services
-from brontes.application.services import PortfolioService, UserService, FacilityService, DocumentService, CobieToGraphService, DeviceService, PointService, BacnetToGraphService, AIAssistantService
+from brontes.application.services import PortfolioService, UserService, FacilityService, DocumentService, CobieToGraphService, DeviceService, PointService, BacnetToGraphService, AIAssistantService, AggregationService
 portfolio_service = PortfolioService(portfolio_repository=portfolio_repository)
 user_service = UserService(user_repository=user_repository)
 facility_service = FacilityService(facility_repository=facility_repository)
 document_service = DocumentService(document_repository=document_repository, vector_store=vector_store, blob_store=blob_store)
 device_service = DeviceService(device_repository=device_repository, point_repository=point_repository)
 point_service = PointService(point_repository=point_repository, device_repository=device_repository, mqtt_client=mqtt_client)
+aggregation_service = AggregationService(portfolio_repository=portfolio_repository, point_repository=point_repository)
 ai_assistant_service = AIAssistantService(document_service=document_service, portfolio_repository=portfolio_repository, ai_repository=ai_repository, facility_repository=facility_repository)
 cobie_service = CobieToGraphService(blob_store=blob_store, kg=knowledge_graph, facility_repository=facility_repository)
 bacnet_service = BacnetToGraphService(blob_store=blob_store, kg=knowledge_graph, facility_repository=facility_repository)
 
 api_secret = os.getenv("API_TOKEN_SECRET")
-app = FastAPI(title="Brontes API", version=importlib.metadata.version("brontes"))
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+  # Routes that await the data layer use the async pool and neo4j driver, the others run in the threadpool on the sync ones
+  await postgres.open_async()
+  yield
+  await postgres.close_async()
+  await knowledge_graph.close_async()
+
+app = FastAPI(title="Brontes API", version=importlib.metadata.version("brontes"), lifespan=lifespan)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
 security = HTTPBearer(auto_error=False)
 
@@ -75,14 +87,14 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
   try:
     decoded = jwt.decode(token, api_secret, algorithms=["HS256"])
     email = decoded.get("email")  
-    user = user_service.get_user(email)
+    user = await user_service.get_user_async(email)
     return user
   except HTTPException as e:
     raise e
 
 ## AUTH ROUTES 
 @app.post("/signup", tags=["Auth"])
-async def signup(email: str, password: str, full_name: str) -> JSONResponse:
+def signup(email: str, password: str, full_name: str) -> JSONResponse:
   try:
     user_service.create_user(email, full_name, password)
     token = jwt.encode({"email": email}, api_secret, algorithm="HS256")  
@@ -93,7 +105,7 @@ async def signup(email: str, password: str, full_name: str) -> JSONResponse:
     return JSONResponse(content={"message": f"Unable to create user: {e}"}, status_code=500)
 
 @app.post("/login", tags=["Auth"])
-async def login(email: str, password: str) -> JSONResponse:
+def login(email: str, password: str) -> JSONResponse:
   try:
     verified = user_service.verify_user_password(email, password)
     if not verified:
@@ -127,7 +139,7 @@ async def chat(
     return JSONResponse(content={"message": f"Unable to chat: {e}"}, status_code=500)
 
 @app.get("/chat/sessions", tags=["AI"])
-async def get_chat_sessions(current_user: User = Security(get_current_user)) -> JSONResponse:
+def get_chat_sessions(current_user: User = Security(get_current_user)) -> JSONResponse:
   return JSONResponse(ai_assistant_service.get_user_chat_session_history(current_user))
 
 @app.post("/transcribe", tags=["AI"], response_model=str)
@@ -139,18 +151,18 @@ async def transcribe_audio(
     file_content = await file.read()
     buffer = BytesIO(file_content)
     buffer.name = file.filename
-    return Response(content=audio.transcribe(buffer))
+    return Response(content=await run_in_threadpool(audio.transcribe, buffer))
   except Exception as e:
     return JSONResponse(content={"message": f"Unable to transcribe audio: {e}"}, status_code=500)
 
 ## PORTFOLIO ROUTES
 @app.get("/portfolio/list", tags=['Portfolio'], response_model=List[Portfolio])
-async def list_portfolios(current_user: User = Security(get_current_user)) -> JSONResponse:
+def list_portfolios(current_user: User = Security(get_current_user)) -> JSONResponse:
   portfolios = portfolio_service.list(current_user.email)
   return JSONResponse([asdict(portfolio) for portfolio in portfolios])
 
 @app.post("/portfolio/create", tags=['Portfolio'], response_model=Portfolio)
-async def create_portfolio(
+def create_portfolio(
   portfolio_name: str,
   current_user: User = Security(get_current_user)
 ) -> JSONResponse:
@@ -160,13 +172,29 @@ async def create_portfolio(
   except Exception as e:
     return JSONResponse(content={"message": f"Unable to create portfolio: {e}"}, status_code=500)
 
+@app.post("/portfolio/statistics", tags=['Portfolio'])
+def get_portfolio_statistics(
+  portfolio_uri: str,
+  brick_class_uri: str,
+  start_time: str,
+  end_time: str,
+  bucket: str = "1h",
+  percentiles: List[float] = [],
+  current_user: User = Security(get_current_user)
+) -> JSONResponse:
+  try:
+    statistics = aggregation_service.get_portfolio_statistics(portfolio_uri=portfolio_uri, brick_class_uri=brick_class_uri, start_time=start_time, end_time=end_time, bucket=parse_duration(bucket), percentiles=percentiles)
+  except ValueError as e:
+    return JSONResponse(content={"message": f"Unable to aggregate portfolio: {e}"}, status_code=400)
+  return JSONResponse(statistics)
+
 ## FACILITY ROUTES
 @app.get("/facility/list", tags=['Facility'], response_model=List[Facility])
-async def list_facilities(portfolio_uri: str, current_user: User = Security(get_current_user)) -> JSONResponse:
+def list_facilities(portfolio_uri: str, current_user: User = Security(get_current_user)) -> JSONResponse:
   return JSONResponse([asdict(facility) for facility in facility_service.list_facilities_for_portfolio(portfolio_uri)])    
 
 @app.post("/facility/create", tags=['Facility'], response_model=Facility)
-async def create_facility(
+def create_facility(
   portfolio_uri: str,
   facility_name: str,
   current_user: User = Security(get_current_user)
@@ -186,7 +214,7 @@ async def import_cobie_spreadsheet(
 ):
   try:
     file_content = await file.read()
-    errors_found, errors = cobie_service.process_cobie_spreadsheet(facility_uri=facility_uri, file=file_content, validate=validate)
+    errors_found, errors = await run_in_threadpool(cobie_service.process_cobie_spreadsheet, facility_uri=facility_uri, file=file_content, validate=validate)
     if errors_found:
       return JSONResponse(content={"errors": errors}, status_code=400)
     return "COBie spreadsheet imported successfully"
@@ -201,7 +229,7 @@ async def upload_bacnet_data(
 ):
   try:
     file_content = await file.read()
-    bacnet_service.upload_bacnet_data(facility_uri=facility_uri, file=file_content)
+    await run_in_threadpool(bacnet_service.upload_bacnet_data, facility_uri=facility_uri, file=file_content)
 
     return "BACnet data uploaded successfully"
   except Exception as e:
@@ -209,7 +237,7 @@ async def upload_bacnet_data(
 
 ## DOCUMENTS ROUTES
 @app.get("/documents", tags=['Document'], response_model=List[Document])
-async def list_documents(
+def list_documents(
   facility_uri: str,
   space_uri: Optional[str] = None,
   type_uri: Optional[str] = None,
@@ -236,7 +264,7 @@ async def list_documents(
     )
   
 @app.post("/documents/search", tags=['Document'], response_model=List[DocumentMetadataChunk])
-async def search_documents(
+def search_documents(
   query: DocumentQuery,
   current_user: User = Security(get_current_user)
 ) -> JSONResponse:
@@ -272,7 +300,7 @@ async def upload_files(
     for file in files:
       try:
         file_content = await file.read()
-        document = document_service.upload_document(portfolio_uri=portfolio_uri, facility_uri=facility_uri, file_content=file_content, file_name=file.filename, discipline=discipline, background_tasks=background_tasks, space_uri = space_uri, type_uri = type_uri, component_uri = component_uri)
+        document = await run_in_threadpool(document_service.upload_document, portfolio_uri=portfolio_uri, facility_uri=facility_uri, file_content=file_content, file_name=file.filename, discipline=discipline, background_tasks=background_tasks, space_uri = space_uri, type_uri = type_uri, component_uri = component_uri)
         uploaded_files_info.append({"filename": file.filename, "uri": document.uri})
         
       except Exception as e:  
@@ -285,7 +313,7 @@ async def upload_files(
     raise e
   
 @app.put("/document/update", tags=['Document'])
-async def update_document(
+def update_document(
   document_uri: str,
   name: str,
   current_user: User = Security(get_current_user)
@@ -297,7 +325,7 @@ async def update_document(
     return JSONResponse(content={"message": f"Unable to update document: {e}"}, status_code=400)
   
 @app.delete("/document/delete", tags=['Document'])
-async def delete_document(
+def delete_document(
   document_uri: str,
   current_user: User = Security(get_current_user)
 ) -> Response:
@@ -314,7 +342,7 @@ async def delete_document(
   
 ## DEVICES ROUTES
 @app.get("/devices", tags=['Devices'], response_model=List[Device])
-async def list_devices(
+def list_devices(
   facility_uri: str,
   component_uri: str | None = None,
   current_user: User = Security(get_current_user)
@@ -332,7 +360,7 @@ async def list_devices(
     )
   
 @app.get("/device/graphic", tags=['Devices'])
-async def get_device_graphic(
+def get_device_graphic(
   facility_uri: str,
   device_uri: str,
   current_user: User = Security(get_current_user)
@@ -349,7 +377,7 @@ async def get_device_graphic(
     )
 
 @app.post("/device/create", tags=['Devices'], response_model=Device)
-async def create_device(
+def create_device(
   facility_uri: str,
   device: DeviceCreateParams,
   current_user: User = Security(get_current_user)
@@ -364,7 +392,7 @@ async def create_device(
     )
   
 @app.post("/device/link", tags=['Devices'])
-async def link_to_component(
+def link_to_component(
   device_uri: str,
   component_uri: str,
   current_user: User = Security(get_current_user)
@@ -378,7 +406,7 @@ async def link_to_component(
     )
   
 @app.put("/device/update", tags=['Devices'])
-async def update_device(
+def update_device(
   device_uri: str,
   new_details: dict,
   current_user: User = Security(get_current_user)
@@ -394,7 +422,7 @@ async def update_device(
   
 ## POINT ROUTES
 @app.get("/points", tags=['Points'], response_model=List[Point])
-async def list_points(
+def list_points(
   facility_uri: str,
   component_uri: str | None = None,
   collect_enabled: bool = True,
@@ -407,7 +435,7 @@ async def list_points(
   return JSONResponse(points)
 
 @app.get("/point", tags=['Points'], response_model=Point)
-async def get_point(
+def get_point(
   point_uri: str,
   current_user: User = Security(get_current_user)
 ) -> JSONResponse:
@@ -415,7 +443,7 @@ async def get_point(
   return JSONResponse(asdict(point))
 
 @app.post("/point/create", tags=['Points'], response_model=Point)
-async def create_point(
+def create_point(
   facility_uri: str,
   device_uri: str,
   point: PointCreateParams,
@@ -432,7 +460,7 @@ async def create_point(
     )
 
 @app.post("/point/command", tags=['Points'])
-async def command_point(
+def command_point(
   point_uri: str,
   command: str,
   current_user: User = Security(get_current_user)
@@ -451,12 +479,64 @@ async def get_points_history(
   start_time: str,
   end_time: str,
   point_uris: List[str],
+  resolution: Resolution = Resolution.RAW,
+  max_points: Optional[int] = Query(None, ge=3), # Room for the first and last point and one in between
+  downsampling: Downsampling = Downsampling.LTTB,
+  current_user: User = Security(get_current_user)
+) -> JSONResponse:
+  """
+  All the raw readings of the points in the range by default.
+  Clients opt in to lighter responses: resolution=auto reads the finest rollup with at most max_points (2000 by default) buckets, max_points downsamples what's left with downsampling.
+  """
+  return JSONResponse(await point_service.get_points_history_async(start_time=start_time, end_time=end_time, point_uris=point_uris, resolution=resolution, max_points=max_points, downsampling=downsampling))
+
+@app.post("/points/history/aligned", tags=['Points'])
+def get_aligned_points_history(
+  start_time: str,
+  end_time: str,
+  point_uris: List[str],
+  bucket: str = "15m",
+  fill: Fill = Fill.LOCF,
   current_user: User = Security(get_current_user)
 ) -> JSONResponse:
-  return JSONResponse(point_service.get_points_history(start_time=start_time, end_time=end_time, point_uris=point_uris))
+  try:
+    aligned = point_service.get_aligned_points_history(start_time=start_time, end_time=end_time, point_uris=point_uris, bucket=parse_duration(bucket), fill=fill)
+  except ValueError as e:
+    return JSONResponse(content={"message": f"Unable to align history: {e}"}, status_code=400)
+  return JSONResponse(aligned.to_dict())
+
+@app.post("/points/history/stream", tags=['Points'])
+async def stream_points_history(
+  start_time: str,
+  end_time: str,
+  point_uris: List[str],
+  format: StreamFormat = StreamFormat.NDJSON,
+  resolution: Resolution = Resolution.RAW,
+  max_points: Optional[int] = Query(None, ge=3),
+  downsampling: Downsampling = Downsampling.NONE,
+  current_user: User = Security(get_current_user)
+) -> StreamingResponse:
+  content = point_service.stream_points_history(start_time=start_time, end_time=end_time, point_uris=point_uris, format=format, resolution=resolution, max_points=max_points, downsampling=downsampling)
+  return StreamingResponse(content, media_type=format.media_type)
+
+@app.post("/points/export", tags=['Points'])
+def export_points_history(
+  start_time: str,
+  end_time: str,
+  point_uris: List[str],
+  format: ExportFormat = ExportFormat.PARQUET,
+  resolution: Resolution = Resolution.RAW,
+  current_user: User = Security(get_current_user)
+) -> Response:
+  try:
+    content = point_service.export_points_history(start_time=start_time, end_time=end_time, point_uris=point_uris, format=format, resolution=resolution)
+  except ValueError as e:
+    return JSONResponse(content={"message": f"Unable to export history: {e}"}, status_code=400)
+  extension = "arrows" if format == ExportFormat.ARROW else "parquet"
+  return StreamingResponse(content, media_type=format.media_type, headers={"Content-Disposition": f'attachment; filename="history.{extension}"'})
 
 @app.put("/point/update", tags=['Points'])
-async def update_point(
+def update_point(
   point_uri: str,
   updates: PointUpdates | None = None,
   brick_class_uri: str | None = None,
@@ -1,6 +1,10 @@
-from dataclasses import dataclass
-from typing import Optional
+from array import array
+from dataclasses import dataclass, field
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional, Sequence
 from typing_extensions import TypedDict 
+from enum import Enum
+import numpy as np
 
 @dataclass
 class PointReading: # TODO update point to use point reading
@@ -8,6 +12,160 @@ class PointReading: # TODO update point to use point reading
   value: float
   timeseriesid: str
 
+@dataclass
+class PointRollup:
+  """Aggregate of the readings in one time bucket, value is the average."""
+  ts: str
+  value: float
+  timeseriesid: str
+  min: float
+  max: float
+  last: float
+  count: int
+
+@dataclass
+class BucketStatistics:
+  """Statistics of the readings of a group of timeseries in one time bucket, percentiles are keyed like p50 or p95."""
+  ts: str
+  avg: float
+  min: float
+  max: float
+  count: int
+  percentiles: Dict[str, float] = field(default_factory=dict)
+
+class Resolution(Enum):
+  """Resolution of history queries, raw readings or one of the continuous aggregate rollups."""
+  AUTO = "auto" # The finest resolution that fits in the max points budget
+  RAW = "raw"
+  MINUTE = "1m"
+  FIFTEEN_MINUTES = "15m"
+  HOUR = "1h"
+  DAY = "1d"
+
+class Downsampling(Enum):
+  """How history queries reduce a timeseries with more than max_points values."""
+  NONE = "none"
+  LTTB = "lttb" # Largest-Triangle-Three-Buckets, keeps the visual shape of the series
+  MINMAX = "minmax" # Min and max of each bucket, keeps every peak
+
+class ExportFormat(Enum):
+  """File format of history exports."""
+  ARROW = "arrow" # Arrow IPC stream
+  PARQUET = "parquet"
+
+  @property
+  def media_type(self) -> str:
+    return {ExportFormat.ARROW: "application/vnd.apache.arrow.stream", ExportFormat.PARQUET: "application/vnd.apache.parquet"}[self]
+
+class StreamFormat(Enum):
+  """Line based formats of streamed history, one reading per line."""
+  NDJSON = "ndjson"
+  CSV = "csv"
+
+  @property
+  def media_type(self) -> str:
+    return {StreamFormat.NDJSON: "application/x-ndjson", StreamFormat.CSV: "text/csv"}[self]
+
+class Fill(Enum):
+  """How aligned history fills the buckets of a timeseries without readings."""
+  NONE = "none" # Left empty (NaN)
+  LOCF = "locf" # Last observation carried forward
+  INTERPOLATE = "interpolate" # Linear interpolation between the neighbouring buckets
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def to_datetime(ts: str | datetime) -> datetime:
+  """
+  Convert an ISO format timestamp to a timezone aware datetime.
+  Naive timestamps are interpreted as local time (which is what datetime.fromtimestamp produces).
+  """
+  if isinstance(ts, str):
+    ts = datetime.fromisoformat(ts.replace('Z', '+00:00'))
+  if ts.tzinfo is None:
+    ts = ts.astimezone()
+  return ts
+
+def to_epoch_us(ts: str | datetime) -> int:
+  return (to_datetime(ts) - EPOCH) // timedelta(microseconds=1)
+
+def from_epoch_us(ts_us: int) -> datetime:
+  return EPOCH + timedelta(microseconds=ts_us)
+
+@dataclass
+class PointReadingBatch:
+  """
+  Columnar batch of readings used on the ingest path instead of a list of PointReading.
+  - ts: epoch microseconds (int64)
+  - values: float64
+  - series: index of each reading's timeseries id in timeseriesids (int32)
+  """
+  ts: array = field(default_factory=lambda: array('q'))
+  values: array = field(default_factory=lambda: array('d'))
+  series: array = field(default_factory=lambda: array('i'))
+  timeseriesids: List[str] = field(default_factory=list)
+
+  def __len__(self) -> int:
+    return len(self.ts)
+
+  @classmethod
+  def from_columns(cls, ts: array, values: array, series: array, names: Sequence[str]) -> "PointReadingBatch":
+    """Build a batch from columns whose series index into a larger names table, keeping only the names that are used."""
+    used, inverse = np.unique(np.frombuffer(series, dtype=np.int32), return_inverse=True)
+    return cls(ts=ts, values=values, series=array('i', inverse.astype(np.int32).tobytes()), timeseriesids=[names[i] for i in used])
+
+  @classmethod
+  def from_point_readings(cls, readings: List[PointReading]) -> "PointReadingBatch":
+    batch = cls()
+    for reading in readings:
+      batch.append(reading.timeseriesid, to_epoch_us(reading.ts), reading.value)
+    return batch
+
+  def append(self, timeseriesid: str, ts_us: int, value: float) -> None:
+    """Append one reading, slower than building the columns directly, meant for small batches."""
+    try:
+      index = self.timeseriesids.index(timeseriesid)
+    except ValueError:
+      index = len(self.timeseriesids)
+      self.timeseriesids.append(timeseriesid)
+    self.ts.append(ts_us)
+    self.values.append(value)
+    self.series.append(index)
+
+  def extend(self, other: "PointReadingBatch") -> None:
+    index: Dict[str, int] = {name: i for i, name in enumerate(self.timeseriesids)}
+    remap = array('i')
+    for name in other.timeseriesids:
+      if name not in index:
+        index[name] = len(self.timeseriesids)
+        self.timeseriesids.append(name)
+      remap.append(index[name])
+    self.ts.extend(other.ts)
+    self.values.extend(other.values)
+    if len(other):
+      self.series.frombytes(np.frombuffer(remap, dtype=np.int32)[np.frombuffer(other.series, dtype=np.int32)].tobytes())
+
+  def latest(self) -> "PointReadingBatch":
+    """The most recent reading of each timeseries in the batch."""
+    if not len(self):
+      return PointReadingBatch(timeseriesids=list(self.timeseriesids))
+    ts = np.frombuffer(self.ts, dtype=np.int64)
+    series = np.frombuffer(self.series, dtype=np.int32)
+    order = np.lexsort((ts, series)) # By series then ts
+    ordered_series = series[order]
+    last = order[np.append(ordered_series[1:] != ordered_series[:-1], True)]
+    return PointReadingBatch(
+      ts=array('q', ts[last].tobytes()),
+      values=array('d', np.frombuffer(self.values, dtype=np.float64)[last].tobytes()),
+      series=array('i', series[last].tobytes()),
+      timeseriesids=list(self.timeseriesids),
+    )
+
+  def to_point_readings(self) -> List[PointReading]:
+    return [
+      PointReading(ts=from_epoch_us(ts).isoformat(), value=value, timeseriesid=self.timeseriesids[series])
+      for ts, value, series in zip(self.ts, self.values, self.series)
+    ]
+
 class PointUpdates(TypedDict, total=False):
   """This is used to update a point's properties."""
   object_name: Optional[str]
@@ -16,6 +174,9 @@ class PointUpdates(TypedDict, total=False):
   object_type: Optional[str]
   object_index: Optional[str]
   timeseriesId: Optional[str]
+  compression_mode: Optional[str]
+  compression_deviation: Optional[float]
+  compression_max_silence: Optional[float]
 
 @dataclass
 class PointCreateParams:
@@ -25,6 +186,27 @@ class PointCreateParams:
   object_type: Optional[str] = None
   object_units: Optional[str] = None
   collect_enabled: Optional[bool] = False
+  compression_mode: Optional[str] = None
+  compression_deviation: Optional[float] = None
+  compression_max_silence: Optional[float] = None
   mqtt_topic: Optional[str] = None
   object_description: Optional[str] = None
 
+@dataclass
+class AlignedTimeseries:
+  """
+  Several timeseries on a common time grid: values[i, j] is the average of timeseriesids[j] in the bucket starting at ts[i], NaN where there is none.
+  - ts: bucket starts, datetime64[us] in UTC
+  - values: float64, one row per bucket and one column per timeseries
+  """
+  ts: np.ndarray
+  timeseriesids: List[str]
+  values: np.ndarray
+
+  def to_dict(self) -> dict:
+    """JSON friendly form, ISO timestamps and None for the empty buckets."""
+    return {
+      'ts': [from_epoch_us(int(ts)).isoformat() for ts in self.ts.astype(np.int64)],
+      'timeseriesids': self.timeseriesids,
+      'values': [[None if np.isnan(value) else float(value) for value in row] for row in self.values],
+    }
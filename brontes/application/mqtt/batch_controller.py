@@ -0,0 +1,107 @@
+from threading import Lock
+from typing import Callable, Tuple
+import time
+
+BYTES_PER_READING = 8 + 8 + 4 # ts, value and series columns of a PointReadingBatch
+
+class AdaptiveBatchController:
+  """
+  Picks the batch size and linger time of the ingest writers from the observed arrival rate and commit latency.
+  - readings should be visible in the database within latency_slo seconds: linger is at most what is left of the SLO after the expected commit time
+  - within the SLO, batches only grow until the fixed commit overhead is at most overhead_share of the commit time, larger batches would add latency without saving much
+  - the batch size is what arrives during the linger time (plus any backlog), so quiet periods flush small batches within the SLO and bursts commit in large batches
+  - batches never exceed max_batch_bytes of reading columns or max_batch_size readings
+  Commit latency is modelled as a fixed cost per commit plus a cost per row, fitted by least squares over exponentially weighted averages of recent commits.
+  """
+  def __init__(
+    self,
+    received: Callable[[], int],
+    backlog: Callable[[], int],
+    latency_slo: float = 5.0,
+    max_batch_bytes: int = 64 * 1024 * 1024,
+    max_batch_size: int | None = None,
+    min_batch_size: int = 100,
+    min_linger: float = 0.05,
+    overhead_share: float = 0.1,
+    smoothing: float = 0.2,
+  ):
+    self.received = received # Total readings received by the queue so far
+    self.backlog = backlog # Readings waiting in the queue
+    self.latency_slo = latency_slo
+    self.max_batch_size = max(min(max_batch_bytes // BYTES_PER_READING, max_batch_size or max_batch_bytes), min_batch_size)
+    self.min_batch_size = min_batch_size
+    self.min_linger = min_linger
+    self.overhead_share = overhead_share
+    self.smoothing = smoothing
+    self.lock = Lock()
+    self.arrival_rate = 0.0 # Readings per second
+    self.commit_overhead = 0.0 # Seconds per commit
+    self.commit_row_cost = 0.0 # Seconds per row
+    self.commits = 0
+    self.mean_rows = 0.0 # Weighted moments of (rows, latency) for the fit
+    self.mean_latency = 0.0
+    self.mean_rows_squared = 0.0
+    self.mean_rows_latency = 0.0
+    self.last_received = received()
+    self.last_sample = time.monotonic()
+    self.batch_size = min_batch_size
+    self.linger = latency_slo
+
+  def sample_arrival_rate(self) -> None:
+    now = time.monotonic()
+    elapsed = now - self.last_sample
+    if elapsed < 0.01:
+      return
+    received = self.received()
+    rate = (received - self.last_received) / elapsed
+    self.arrival_rate += self.smoothing * (rate - self.arrival_rate)
+    self.last_received = received
+    self.last_sample = now
+
+  def commit_latency(self, rows: int) -> float:
+    return self.commit_overhead + self.commit_row_cost * rows
+
+  def next_batch(self) -> Tuple[int, float]:
+    """The (batch size, linger) the next get_batch should use."""
+    with self.lock:
+      self.sample_arrival_rate()
+      # Longest linger within the SLO: solve size = rate * linger and linger = slo - commit_latency(size)
+      linger = (self.latency_slo - self.commit_overhead) / (1 + self.arrival_rate * self.commit_row_cost)
+      if self.arrival_rate > 0 and self.commit_row_cost > 0:
+        # Size at which the overhead is overhead_share of the commit time
+        efficient_size = self.commit_overhead * (1 - self.overhead_share) / (self.overhead_share * self.commit_row_cost)
+        linger = min(linger, efficient_size / self.arrival_rate)
+      linger = max(linger, self.min_linger)
+      batch_size = max(int(self.arrival_rate * linger), self.backlog())
+      self.batch_size = min(max(batch_size, self.min_batch_size), self.max_batch_size)
+      self.linger = linger
+      return self.batch_size, self.linger
+
+  def observe_flush(self, rows: int, latency: float) -> None:
+    """Record how long a commit of rows readings took."""
+    if rows <= 0:
+      return
+    with self.lock:
+      weight = 1.0 if self.commits == 0 else self.smoothing
+      self.commits += 1
+      self.mean_rows += weight * (rows - self.mean_rows)
+      self.mean_latency += weight * (latency - self.mean_latency)
+      self.mean_rows_squared += weight * (rows * rows - self.mean_rows_squared)
+      self.mean_rows_latency += weight * (rows * latency - self.mean_rows_latency)
+      variance = self.mean_rows_squared - self.mean_rows ** 2
+      if variance > (0.05 * self.mean_rows) ** 2:
+        self.commit_row_cost = max((self.mean_rows_latency - self.mean_rows * self.mean_latency) / variance, 0.0)
+        self.commit_overhead = max(self.mean_latency - self.commit_row_cost * self.mean_rows, 0.0)
+      else:
+        # Batch sizes haven't varied enough to tell the costs apart, treat it all as overhead until the backlog varies them
+        self.commit_row_cost = 0.0
+        self.commit_overhead = self.mean_latency
+
+  def stats(self) -> dict:
+    with self.lock:
+      return {
+        "batch_size": self.batch_size,
+        "flush_interval": self.linger,
+        "arrival_rate": self.arrival_rate,
+        "estimated_commit_latency": self.commit_latency(self.batch_size),
+      }
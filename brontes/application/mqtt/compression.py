@@ -0,0 +1,136 @@
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Dict, List, Optional
+import math
+
+class CompressionMode(Enum):
+  DEADBAND = "deadband" # Store a reading when it moves more than deviation away from the last stored value
+  DEADBAND_PERCENT = "deadband_percent" # Same as deadband, deviation is a percentage of the last stored value
+  SWINGING_DOOR = "swinging_door" # Store the readings needed to reconstruct the series within deviation by linear interpolation
+
+@dataclass
+class CompressionSettings:
+  """
+  Per point compression applied at ingest time, read from the point's compression_* properties in the knowledge graph.
+  """
+  mode: CompressionMode
+  deviation: float = 0.0
+  max_silence: Optional[float] = None # Heartbeat, always store a reading if nothing was stored for this many seconds
+
+  @classmethod
+  def from_point_properties(cls, compression_mode: Optional[str], compression_deviation: Optional[float] = None, compression_max_silence: Optional[float] = None) -> Optional["CompressionSettings"]:
+    if not compression_mode:
+      return None
+    return cls(mode=CompressionMode(compression_mode), deviation=float(compression_deviation or 0.0), max_silence=compression_max_silence)
+
+class SeriesCompressor:
+  """
+  Compression state of a single series. offer() returns the items that should be stored, possibly including an earlier held item.
+  Items are opaque, the compressor only looks at the time (in seconds) and value passed along with them.
+  """
+  def __init__(self, settings: CompressionSettings):
+    self.settings = settings
+    self.last_t: Optional[float] = None # Last stored reading
+    self.last_value = 0.0
+    self.held: Optional[tuple] = None # Swinging door: most recent reading that was not stored (t, value, item)
+    self.upper_slope = float("inf")
+    self.lower_slope = float("-inf")
+
+  def offer(self, t: float, value: float, item: Any) -> List[Any]:
+    if not math.isfinite(value):
+      # NaN and infinite readings would break the slope math, store them as they are and start over from the next reading
+      stored = self.flush()
+      stored.append(item)
+      self.last_t = None
+      return stored
+    if self.last_t is None or (self.settings.max_silence is not None and t - self.last_t >= self.settings.max_silence):
+      return self._store(t, value, item)
+    if t <= self.last_t: # Out of order reading, don't let it break the slopes
+      return []
+    if self.settings.mode == CompressionMode.SWINGING_DOOR:
+      return self._swinging_door(t, value, item)
+    deviation = self.settings.deviation
+    if self.settings.mode == CompressionMode.DEADBAND_PERCENT:
+      deviation = abs(self.last_value) * self.settings.deviation / 100
+    if abs(value - self.last_value) > deviation:
+      return self._store(t, value, item)
+    return []
+
+  def _swinging_door(self, t: float, value: float, item: Any) -> List[Any]:
+    deviation = self.settings.deviation
+    dt = t - self.last_t
+    if self.lower_slope <= (value - self.last_value) / dt <= self.upper_slope:
+      # The line from the last stored reading to this one passes through the doors of every reading in between, hold it and narrow the doors
+      self.upper_slope = min(self.upper_slope, (value + deviation - self.last_value) / dt)
+      self.lower_slope = max(self.lower_slope, (value - deviation - self.last_value) / dt)
+      self.held = (t, value, item)
+      return []
+    # The doors closed, store the held reading and open new doors from it
+    held_t, held_value, held_item = self.held
+    self.last_t, self.last_value = held_t, held_value
+    dt = t - held_t
+    self.upper_slope = (value + deviation - held_value) / dt
+    self.lower_slope = (value - deviation - held_value) / dt
+    self.held = (t, value, item)
+    return [held_item]
+
+  def _store(self, t: float, value: float, item: Any) -> List[Any]:
+    stored = []
+    if self.held is not None and self.held[0] < t: # Keep the end of the previous segment
+      stored.append(self.held[2])
+    stored.append(item)
+    self.last_t, self.last_value = t, value
+    self.held = None
+    self.upper_slope = float("inf")
+    self.lower_slope = float("-inf")
+    return stored
+
+  def flush(self) -> List[Any]:
+    """Return the held reading, if any, so it isn't lost on shutdown."""
+    if self.held is None:
+      return []
+    held_item = self.held[2]
+    self.last_t, self.last_value = self.held[0], self.held[1]
+    self.held = None
+    # Doors narrowed for the held reading would send the next offer down the closing path with nothing held
+    self.upper_slope = float("inf")
+    self.lower_slope = float("-inf")
+    return [held_item]
+
+class Compressor:
+  """
+  Applies the compression settings of each series. Series without settings pass through untouched.
+  """
+  def __init__(self, settings: Dict[str, CompressionSettings] | None = None):
+    self.settings = settings or {}
+    self.series: Dict[str, SeriesCompressor] = {}
+    self.offered = 0
+    self.stored = 0
+
+  def update_settings(self, settings: Dict[str, CompressionSettings]) -> List[Any]:
+    """Replace the settings, series whose settings changed start over. Returns the readings they were holding."""
+    stored = []
+    for timeseriesid in list(self.series):
+      if settings.get(timeseriesid) != self.settings.get(timeseriesid):
+        stored.extend(self.series.pop(timeseriesid).flush())
+    self.settings = settings
+    self.stored += len(stored)
+    return stored
+
+  def offer(self, timeseriesid: str, t: float, value: float, item: Any) -> List[Any]:
+    self.offered += 1
+    compressor = self.series.get(timeseriesid)
+    if compressor is None:
+      settings = self.settings.get(timeseriesid)
+      if settings is None:
+        self.stored += 1
+        return [item]
+      compressor = self.series[timeseriesid] = SeriesCompressor(settings)
+    stored = compressor.offer(t, value, item)
+    self.stored += len(stored)
+    return stored
+
+  def flush(self) -> List[Any]:
+    stored = [item for compressor in self.series.values() for item in compressor.flush()]
+    self.stored += len(stored)
+    return stored
@@ -0,0 +1,24 @@
+from collections import OrderedDict
+from typing import Hashable
+
+class RecentKeyFilter:
+  """
+  Remembers the most recently seen keys (eg. (timeseriesid, ts)) to drop obvious duplicates, like QoS 1 redeliveries, before they reach the database.
+  It is an exact LRU rather than a bloom filter so a new reading is never dropped by a false positive.
+  Not thread safe, it is meant to be used from the MQTT network thread.
+  """
+  def __init__(self, capacity: int = 100_000):
+    self.capacity = capacity
+    self.keys: OrderedDict = OrderedDict()
+    self.duplicates = 0
+
+  def seen(self, key: Hashable) -> bool:
+    """Returns True if the key was seen recently, otherwise remembers it and returns False."""
+    if key in self.keys:
+      self.keys.move_to_end(key)
+      self.duplicates += 1
+      return True
+    self.keys[key] = None
+    if len(self.keys) > self.capacity:
+      self.keys.popitem(last=False)
+    return False
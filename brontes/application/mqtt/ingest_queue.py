@@ -0,0 +1,182 @@
+from array import array
+from enum import Enum
+from threading import Condition, Lock
+from typing import Dict, List, Tuple
+import json
+import os
+import time
+
+from brontes.application.dtos.point_dto import PointReadingBatch
+
+SPILL_BUFFER_BYTES = 1 << 20 # Write buffer of the spill file
+
+class Backpressure(Enum):
+  """What the ingest queue does when it is full."""
+  BLOCK = "block" # Block the producer (the MQTT network thread) until a writer makes room
+  DROP_OLDEST = "drop_oldest" # Evict the oldest reading to make room for the new one
+  SPILL = "spill" # Append the reading to a spill file on disk, writers drain it once the buffer is empty
+
+class SpillFile:
+  """
+  Append only JSON lines file used by the ingest queue to overflow readings to disk.
+  Readings are read back in the order they were written, the file is truncated once it has been fully drained.
+  The file stays open and appends go through a write buffer, so spilling under the queue lock doesn't wait on the disk. The buffer is flushed before reading and when the queue is closed.
+  """
+  def __init__(self, path: str, buffer_size: int = SPILL_BUFFER_BYTES):
+    self.path = path
+    self.lock = Lock()
+    self.read_offset = 0
+    self.count = 0
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if os.path.exists(path): # Pick up readings spilled by a previous run
+      with open(path, 'rb') as f:
+        self.count = sum(1 for _ in f)
+    self.writer = open(path, 'a', buffering=buffer_size)
+    self.reader = open(path, 'r')
+
+  def append(self, timeseriesid: str, ts_us: int, value: float) -> None:
+    with self.lock:
+      self.writer.write(json.dumps([timeseriesid, ts_us, value]) + "\n")
+      self.count += 1
+
+  def flush(self) -> None:
+    with self.lock:
+      self.writer.flush()
+
+  def read(self, max_items: int) -> List[Tuple[str, int, float]]:
+    with self.lock:
+      if self.count == 0:
+        return []
+      self.writer.flush()
+      readings = []
+      self.reader.seek(self.read_offset)
+      while len(readings) < max_items:
+        line = self.reader.readline()
+        if not line:
+          break
+        readings.append(tuple(json.loads(line)))
+      self.read_offset = self.reader.tell()
+      self.count -= len(readings)
+      if self.count <= 0:
+        self.count = 0
+        self.read_offset = 0
+        self.writer.truncate(0)
+      return readings
+
+class IngestQueue:
+  """
+  Bounded ring buffer that sits between the MQTT network thread and the database writer threads.
+  - put is called from the MQTT callback and never touches the database
+  - get_batch is called by the writer threads, it waits until a full batch is available or the linger time has passed
+
+  Readings are stored in preallocated columns (epoch microseconds, float64 values and the index of an interned timeseries id) instead of one object per reading.
+  """
+  def __init__(self, capacity: int = 100_000, backpressure: Backpressure = Backpressure.BLOCK, spill_path: str | None = None, max_interned: int = 100_000):
+    """
+    :param max_interned: Interned timeseries ids are forgotten once there are more than this many and the ring is empty, so ids that stopped reporting don't pile up
+    """
+    if backpressure == Backpressure.SPILL and spill_path is None:
+      raise ValueError("A spill_path is required when using the spill backpressure policy")
+    self.capacity = capacity
+    self.backpressure = backpressure
+    self.ts = array('q', bytes(8 * capacity))
+    self.values = array('d', bytes(8 * capacity))
+    self.series = array('i', bytes(4 * capacity))
+    self.head = 0 # Index of the oldest reading
+    self.count = 0
+    self.series_index: Dict[str, int] = {} # Interned timeseries ids, indices don't change while readings in the ring refer to them
+    self.max_interned = max_interned
+    self.timeseriesids: List[str] = []
+    self.lock = Lock()
+    self.not_empty = Condition(self.lock)
+    self.not_full = Condition(self.lock)
+    self.spill = SpillFile(spill_path) if backpressure == Backpressure.SPILL else None
+    self.closed = False
+    self.received = 0 # Readings accepted by put, including the ones dropped or spilled later
+    self.dropped = 0
+    self.spilled = 0
+
+  def __len__(self) -> int:
+    return self.count + (self.spill.count if self.spill else 0)
+
+  def intern(self, timeseriesid: str) -> int:
+    index = self.series_index.get(timeseriesid)
+    if index is None:
+      index = self.series_index[timeseriesid] = len(self.timeseriesids)
+      self.timeseriesids.append(timeseriesid)
+    return index
+
+  def put(self, timeseriesid: str, ts_us: int, value: float) -> bool:
+    """Add a reading to the queue. Returns False if the queue is closed."""
+    with self.lock:
+      if self.closed:
+        return False
+      self.received += 1
+      if self.count >= self.capacity or (self.spill and self.spill.count > 0):
+        if self.backpressure == Backpressure.BLOCK:
+          while self.count >= self.capacity and not self.closed:
+            self.not_full.wait()
+          if self.closed:
+            return False
+        elif self.backpressure == Backpressure.DROP_OLDEST:
+          self.head = (self.head + 1) % self.capacity
+          self.count -= 1
+          self.dropped += 1
+        elif self.backpressure == Backpressure.SPILL:
+          # Keep spilling until the file is drained so readings stay in arrival order
+          self.spill.append(timeseriesid, ts_us, value)
+          self.spilled += 1
+          self.not_empty.notify()
+          return True
+      i = (self.head + self.count) % self.capacity
+      self.ts[i] = ts_us
+      self.values[i] = value
+      self.series[i] = self.intern(timeseriesid)
+      self.count += 1
+      self.not_empty.notify()
+      return True
+
+  def get_batch(self, max_items: int, linger: float) -> PointReadingBatch:
+    """
+    Take up to max_items readings from the queue.
+    Waits up to linger seconds for a full batch, returns whatever is available after that. Returns an empty batch once the queue is closed and drained.
+    """
+    deadline = time.monotonic() + linger
+    with self.lock:
+      while len(self) < max_items and not self.closed:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          break
+        self.not_empty.wait(remaining)
+      n = min(self.count, max_items)
+      end = self.head + n
+      if end <= self.capacity:
+        ts, values, series = self.ts[self.head:end], self.values[self.head:end], self.series[self.head:end]
+      else: # Wrapped around the end of the ring
+        end -= self.capacity
+        ts = self.ts[self.head:] + self.ts[:end]
+        values = self.values[self.head:] + self.values[:end]
+        series = self.series[self.head:] + self.series[:end]
+      self.head = end % self.capacity
+      self.count -= n
+      if self.spill and n < max_items:
+        for timeseriesid, ts_us, value in self.spill.read(max_items - n):
+          ts.append(ts_us)
+          values.append(value)
+          series.append(self.intern(timeseriesid))
+      if len(ts):
+        self.not_full.notify_all()
+      batch = PointReadingBatch.from_columns(ts, values, series, self.timeseriesids)
+      if self.count == 0 and len(self.timeseriesids) > self.max_interned:
+        # No reading in the ring refers to an interned id anymore, start over
+        self.series_index, self.timeseriesids = {}, []
+      return batch
+
+  def close(self) -> None:
+    """Stop accepting readings and wake up everyone waiting on the queue."""
+    with self.lock:
+      self.closed = True
+      if self.spill:
+        self.spill.flush()
+      self.not_empty.notify_all()
+      self.not_full.notify_all()
@@ -1,135 +1,317 @@
-from brontes.infrastructure import MQTTClient, Timescale, Postgres
-from brontes.application.dtos.point_dto import PointReading
-from threading import Lock, Timer
-from typing import List
+from brontes.infrastructure import MQTTClient, Timescale, Postgres, KnowledgeGraph
+from brontes.infrastructure.repos import PointRepository
+from brontes.application.dtos.point_dto import PointReadingBatch
+from brontes.application.mqtt.ingest_queue import IngestQueue, Backpressure
+from brontes.application.mqtt.topic_registry import ParserRegistry, parser_registry
+from brontes.application.mqtt.spool import Spool, SpoolReplayer
+from brontes.application.mqtt.dedup import RecentKeyFilter
+from brontes.application.mqtt.compression import Compressor, CompressionSettings
+from brontes.application.mqtt.point_index import PointIndex
+from brontes.application.mqtt.batch_controller import AdaptiveBatchController
+import brontes.application.mqtt.shelly_parsers # Registers the Shelly parsers
+from threading import Lock, Thread, Event, get_ident
+from typing import Dict
 import atexit
-import re
+import os
+import signal
+import psycopg
 import json
-from datetime import datetime
+import time
 
 class MQTT2Timescale:
   """
   This is a application that listens to messages from the broker and stores them in the database.
-  - message processing
-  - batch processing
-  - flushing the batch to the database
+  - message processing (on the MQTT network thread, only parses and enqueues)
+  - batch processing (writer threads drain the ingest queue, in fixed batches or sized by an adaptive batch controller)
+  - flushing the batch to the database, or to the write-ahead spool when one is configured. The spool replayer then drains it into the database.
   """
-  def __init__(self, mqtt_client: MQTTClient, ts: Timescale, batch_size=100, flush_interval=30):
+  def __init__(
+    self,
+    mqtt_client: MQTTClient,
+    ts: Timescale,
+    batch_size=100,
+    flush_interval=30,
+    writer_threads=1,
+    queue_capacity=100_000,
+    backpressure: Backpressure = Backpressure.BLOCK,
+    spill_path: str | None = None,
+    stats_interval=60,
+    parsers: ParserRegistry = parser_registry,
+    spool: Spool | None = None,
+    spool_name: str = "mqtt2timescale",
+    dedup: RecentKeyFilter | None = None,
+    compression: Dict[str, CompressionSettings] | None = None,
+    point_index: PointIndex | None = None,
+    control_topic: str | None = None,
+    latency_slo: float | None = None,
+    max_batch_bytes: int = 64 * 1024 * 1024,
+  ):
     self.mqtt_client = mqtt_client
     self.ts = ts
     self.mqtt_client.client.on_message = self.on_mqtt_message
     self.batch_size = batch_size
     self.flush_interval = flush_interval
-    self.batch: List[PointReading] = []
-    self.batch_lock = Lock()
-    self.flush_timer = None
-    self.reset_flush_timer()
+    self.stats_interval = stats_interval
+    self.parsers = parsers
+    self.dedup = dedup
+    self.point_index = point_index
+    self.control_topic = control_topic
+    self.compressor = Compressor(compression) if compression or point_index is not None else None
+    self.compression_version = None
+    self.queue = IngestQueue(capacity=queue_capacity, backpressure=backpressure, spill_path=spill_path)
+    self.batch_controller = None
+    if latency_slo is not None:
+      # batch_size and flush_interval are replaced by a batch size and linger tuned to meet the latency SLO
+      self.batch_controller = AdaptiveBatchController(
+        received=lambda: self.queue.received,
+        backlog=lambda: len(self.queue),
+        latency_slo=latency_slo,
+        max_batch_bytes=max_batch_bytes,
+        max_batch_size=queue_capacity // 2, # A batch the queue can't hold would always wait out the linger
+      )
+    self.stopped = Event()
+    self.listener_done = Event() # Set while the MQTT network loop isn't running
+    self.listener_done.set()
+    self.listener_thread = None
+    self.stats_lock = Lock()
+    self.flushed_rows = 0
+    self.flush_count = 0
+    self.flush_errors = 0
+    self.last_flush_latency = 0.0
+    self.max_flush_latency = 0.0
+    self.total_flush_latency = 0.0
+    self.spool = spool
+    self.replayer = SpoolReplayer(spool, ts, name=spool_name) if spool else None
+    if self.replayer:
+      self.replayer.start()
+    if self.point_index is not None:
+      self.point_index.start()
+    self.writers = [Thread(target=self.writer_loop, name=f"mqtt2timescale-writer-{i}", daemon=True) for i in range(writer_threads)]
+    for writer in self.writers:
+      writer.start()
+    self.stats_reporter = Thread(target=self.report_stats, name="mqtt2timescale-stats", daemon=True)
+    self.stats_reporter.start()
 
   def start_message_listener(self, topic: str):
     """
     Used to start listening to messages then store them in the database.
     """
-    self.mqtt_client.connect()
-    self.mqtt_client.subscribe(topic)
-    self.mqtt_client.loop_forever()
+    self.listener_thread = get_ident()
+    self.listener_done.clear()
+    try:
+      self.mqtt_client.connect()
+      self.mqtt_client.subscribe(topic)
+      if self.control_topic:
+        # Not shared, every worker has to see the change signal
+        self.mqtt_client.subscribe(self.control_topic)
+      self.mqtt_client.loop_forever()
+    finally:
+      self.listener_done.set()
 
   def stop(self):
     """
-    Used to stop the message listener and flush the batch to the database.
+    Used to stop the message listener, the writers drain what is left in the queue before exiting.
     """
-    if self.flush_timer:
-      self.flush_timer.cancel()
-    self.flush_batch()
-    self.mqtt_client.stop()
+    self.stopped.set()
+    # Stop the network loop first, on_mqtt_message is the only user of the compressor and the queue producer
+    self.mqtt_client.disconnect()
+    if self.listener_thread != get_ident():
+      self.listener_done.wait()
+    if self.point_index is not None:
+      self.point_index.stop()
+    if self.compressor:
+      for reading in self.compressor.flush():
+        self.queue.put(*reading)
+    self.queue.close()
+    for writer in self.writers:
+      writer.join()
+    if self.replayer:
+      self.replayer.stop()
+      self.spool.close()
 
-  def reset_flush_timer(self):
+  def writer_loop(self):
     """
-    Used to reset the flush timer.
+    Runs on each writer thread. Waits for a full batch (or flush_interval seconds) then writes it to the database.
     """
-    if self.flush_timer:
-      self.flush_timer.cancel()
-    self.flush_timer = Timer(self.flush_interval, self.flush_batch)
-    self.flush_timer.start()
-
-  def flush_batch(self):
-    with self.batch_lock:
-      if self.batch:
-        # Insert the batch into the database
-        self.ts.insert_timeseries(self.batch)
-        print(f"Flushed {len(self.batch)} messages to the database.")
-        self.batch.clear()
-      self.reset_flush_timer()
+    while True:
+      if self.batch_controller:
+        batch = self.queue.get_batch(*self.batch_controller.next_batch())
+      else:
+        batch = self.queue.get_batch(self.batch_size, self.flush_interval)
+      if not batch:
+        if self.queue.closed:
+          return
+        continue
+      self.flush_batch(batch)
 
-  def on_mqtt_message(self, client, userdata, message):
+  def flush_batch(self, batch: PointReadingBatch):
     """
-    Process the message and store it in the batch.
+    Insert a batch into the database (or append it to the spool).
+    Inserts that fail because the database is unavailable are retried with backoff, meanwhile the queue fills up and the backpressure policy applies.
     """
-    topic = message.topic
-    print(f"Received message on topic {topic}")
-    print(f"Message payload: {message.payload}")
-    # shelly iot plug pattern
-    shelly_plug_pattern = r"shellyplugus.*events/rpc"
-    shelly_status_switch_pattern = r"shellyplugus.*status/switch:0"
-
-    if re.match(shelly_plug_pattern, topic):
-      # Ensure safe decoding of the message payload from bytes to str, then load as JSON
-      try:
-        data = json.loads(message.payload.decode())
-        ts = datetime.fromtimestamp(data["params"]["ts"]).isoformat() # Extract the timestamp
-        
-        # Dynamically handle extraction of other parameters if needed
-        # Iterate through each key in "params" to find "switch:X" objects
-        for key, value in data["params"].items():
-          if key.startswith("switch"):
-            # Extract the "id" and iterate over each measurement key within the switch object
-            switch_id = value["id"]
-            for measurement_key in value:
-              if measurement_key in ["current", "voltage"]:
-                # Construct the timeseries ID
-                timeseriesId = f"{data['src']}-switch-{switch_id}-{measurement_key}"
-                measurement_value = value[measurement_key]
-                point_reading = PointReading(ts=ts, value=measurement_value, timeseriesid=timeseriesId)
-                with self.batch_lock:
-                  self.batch.append(point_reading)
-                  if len(self.batch) >= self.batch_size:
-                    self.flush_batch()
-      except json.JSONDecodeError as e:
-        print(f"Error decoding JSON: {e}")
-      except KeyError as e:
-        print(f"Missing expected key in data: {e}")
-    elif re.match(shelly_status_switch_pattern, topic):
-      print("Shelly switch status message received")
+    backoff = 1
+    while True:
+      start = time.perf_counter()
       try:
-        data = json.loads(message.payload.decode())
-        # Extracting 'minute_ts' from 'aenergy' as timestamp
-        ts = data["aenergy"]["minute_ts"]
-        ts = datetime.fromtimestamp(ts).isoformat()
-        output = data["output"]
-        
-        # Construct the timeseries ID
-        timeseriesId = topic
-        point_reading = PointReading(ts=ts, value=output, timeseriesid=timeseriesId)
-        with self.batch_lock:
-          self.batch.append(point_reading)
-          if len(self.batch) >= self.batch_size:
-            self.flush_batch()
-      except json.JSONDecodeError as e:
-        print(f"Error decoding JSON: {e}")
-      except KeyError as e:
-        print(f"Missing expected key in data: {e}")
+        if self.spool:
+          self.spool.append(batch)
+        else:
+          self.ts.insert_timeseries(batch)
+      except Exception as e:
+        with self.stats_lock:
+          self.flush_errors += 1
+        print(f"Error flushing {len(batch)} messages to the database: {e}")
+        if not isinstance(e, psycopg.OperationalError) or self.stopped.is_set():
+          return
+        self.stopped.wait(backoff)
+        backoff = min(backoff * 2, 60)
+        continue
+      latency = time.perf_counter() - start
+      if self.batch_controller:
+        self.batch_controller.observe_flush(len(batch), latency)
+      with self.stats_lock:
+        self.flushed_rows += len(batch)
+        self.flush_count += 1
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+        self.total_flush_latency += latency
+      print(f"Flushed {len(batch)} messages to the database in {latency:.3f}s.")
+      return
 
+  def stats(self) -> dict:
+    """
+    Queue depth and flush latency of the ingest pipeline.
+    """
+    with self.stats_lock:
+      return {
+        "queue_depth": len(self.queue),
+        "queue_capacity": self.queue.capacity,
+        **(self.batch_controller.stats() if self.batch_controller else {"batch_size": self.batch_size, "flush_interval": self.flush_interval}),
+        "dropped": self.queue.dropped,
+        "spilled": self.queue.spilled,
+        "flushed_rows": self.flushed_rows,
+        "flush_count": self.flush_count,
+        "flush_errors": self.flush_errors,
+        "last_flush_latency": self.last_flush_latency,
+        "avg_flush_latency": self.total_flush_latency / self.flush_count if self.flush_count else 0.0,
+        "max_flush_latency": self.max_flush_latency,
+        "duplicates_dropped": self.dedup.duplicates if self.dedup else 0,
+        "compression_offered": self.compressor.offered if self.compressor else 0,
+        "compression_stored": self.compressor.stored if self.compressor else 0,
+        "unknown_points": self.point_index.unknown if self.point_index is not None else 0,
+        "disabled_points": self.point_index.disabled if self.point_index is not None else 0,
+        **({
+          "spool_backlog_bytes": self.replayer.backlog_bytes(),
+          "spool_replayed_rows": self.replayer.replayed_rows,
+          "spool_replay_latency": self.replayer.last_replay_latency,
+          "database_healthy": self.replayer.healthy,
+        } if self.replayer else {}),
+      }
 
-def start():
+  def report_stats(self):
+    while not self.stopped.wait(self.stats_interval):
+      print(f"Ingest stats: {json.dumps(self.stats())}")
+
+  def on_mqtt_message(self, client, userdata, message):
+    """
+    Parse the message with the parser registered for its topic and put the readings on the ingest queue.
+    When there is a point index, readings are stored under the timeseriesId of their point and readings for unknown or disabled points are dropped.
+    """
+    if message.topic == self.control_topic:
+      self.point_index.request_refresh()
+      return
+    if self.point_index is not None and self.point_index.version != self.compression_version:
+      # Apply compression settings changed by a refresh here, the compressor is only used from this thread
+      self.compression_version = self.point_index.version
+      for reading in self.compressor.update_settings(self.point_index.compression):
+        self.queue.put(*reading)
+    parser = self.parsers.resolve(message.topic)
+    if parser is None:
+      return
+    try:
+      readings = parser(message.topic, message.payload)
+    except json.JSONDecodeError as e:
+      print(f"Error decoding JSON: {e}")
+      return
+    except KeyError as e:
+      print(f"Missing expected key in data: {e}")
+      return
+    for reading in readings:
+      timeseriesid, ts_us, value = reading
+      if self.point_index is not None:
+        timeseriesid = self.point_index.resolve(timeseriesid)
+        if timeseriesid is None:
+          continue
+        reading = (timeseriesid, ts_us, value)
+      if self.dedup and self.dedup.seen((timeseriesid, ts_us)):
+        continue
+      if self.compressor:
+        for stored in self.compressor.offer(timeseriesid, ts_us / 1_000_000, value, reading):
+          self.queue.put(*stored)
+      else:
+        self.queue.put(timeseriesid, ts_us, value)
+
+
+def idempotent_from_environment() -> bool:
+  return os.environ.get("INGEST_IDEMPOTENT", "false").lower() == "true"
+
+def build_app(spool_dir: str | None = None, spool_name: str = "mqtt2timescale", setup_db: bool = True) -> MQTT2Timescale:
+  """
+  Create the ingest app with its own broker and database connections, configured from the environment.
+  :param setup_db: Set up the database tables, off in supervised workers since the supervisor does it once before starting them
+  """
   mqtt_client = MQTTClient()
   postgres = Postgres()
-  timescale = Timescale(postgres=postgres)
+  idempotent = idempotent_from_environment()
+  timescale = Timescale(postgres=postgres, idempotent=idempotent, setup=setup_db)
+  spool_dir = spool_dir or os.environ.get("INGEST_SPOOL_DIR")
+  # Fixed INGEST_BATCH_SIZE and INGEST_FLUSH_INTERVAL unless INGEST_LATENCY_SLO (seconds) is set, which turns on adaptive batching
+  latency_slo = float(os.environ.get("INGEST_LATENCY_SLO") or 0)
+  point_index = None
+  if os.environ.get("NEO4J_URI"):
+    point_index = PointIndex(
+      PointRepository(kg=KnowledgeGraph(), ts=timescale),
+      refresh_interval=float(os.environ.get("INGEST_POINT_INDEX_REFRESH_INTERVAL", 300)),
+      full_refresh_interval=float(os.environ.get("INGEST_POINT_INDEX_FULL_REFRESH_INTERVAL", 3600)),
+    )
+    point_index.refresh(full=True)
+    print(f"Loaded {len(point_index)} points into the point index")
+
+  return MQTT2Timescale(
+    mqtt_client=mqtt_client,
+    ts=timescale,
+    batch_size=int(os.environ.get("INGEST_BATCH_SIZE", 100)),
+    flush_interval=float(os.environ.get("INGEST_FLUSH_INTERVAL", 30)),
+    writer_threads=int(os.environ.get("INGEST_WRITER_THREADS", 1)),
+    queue_capacity=int(os.environ.get("INGEST_QUEUE_CAPACITY", 100_000)),
+    backpressure=Backpressure(os.environ.get("INGEST_BACKPRESSURE", Backpressure.BLOCK.value)),
+    spill_path=os.environ.get("INGEST_SPILL_PATH"),
+    spool=Spool(spool_dir, fsync_interval=float(os.environ.get("INGEST_SPOOL_FSYNC_INTERVAL", 1))) if spool_dir else None,
+    spool_name=spool_name,
+    dedup=RecentKeyFilter(int(os.environ.get("INGEST_DEDUP_CAPACITY", 100_000))) if idempotent else None,
+    point_index=point_index,
+    control_topic=os.environ.get("INGEST_POINT_INDEX_TOPIC") if point_index is not None else None,
+    latency_slo=latency_slo if latency_slo > 0 else None,
+    max_batch_bytes=int(os.environ.get("INGEST_MAX_BATCH_BYTES", 64 * 1024 * 1024)),
+  )
 
-  app = MQTT2Timescale(mqtt_client=mqtt_client, ts=timescale)
+def start():
+  topic = os.environ.get("INGEST_TOPIC", "#")
+  workers = int(os.environ.get("INGEST_WORKERS", 1))
+  if workers > 1:
+    # Imported here, the supervisor imports this module for its workers
+    from brontes.application.mqtt.supervisor import IngestSupervisor
+    IngestSupervisor(workers=workers, topic=topic, group=os.environ.get("INGEST_SHARE_GROUP", "mqtt2timescale")).run()
+    return
 
-  app.start_message_listener(topic="#")
+  app = build_app()
+  if app.point_index is not None:
+    # kill -HUP refreshes the point index right away
+    signal.signal(signal.SIGHUP, lambda signum, frame: app.point_index.request_refresh())
 
   def on_exit():
     app.stop()
-    mqtt_client.disconnect()
 
-  atexit.register(on_exit)
\ No newline at end of file
+  atexit.register(on_exit)
+
+  app.start_message_listener(topic=topic)
\ No newline at end of file
@@ -0,0 +1,114 @@
+from threading import Event, Lock, Thread
+from typing import Dict, Optional
+import time
+
+from brontes.domain.models import Point
+from brontes.infrastructure.repos import PointRepository
+from brontes.application.mqtt.compression import CompressionSettings
+
+class PointIndex:
+  """
+  In-memory index from the keys parsers produce to the timeseriesId of the point in the knowledge graph.
+  A point is indexed under its timeseriesId and its mqtt_topic, only points with collect_enabled resolve, readings for anything else are dropped and counted.
+  - loaded in bulk at startup
+  - refreshed with the points updated since the previous refresh every refresh_interval seconds, or right away when request_refresh is called
+  - fully reloaded every full_refresh_interval seconds to pick up deleted points and points imported without an updated_at
+  resolve is called from the MQTT network thread, refreshes swap in a new index so lookups never take a lock.
+  """
+  def __init__(self, point_repository: PointRepository, refresh_interval: float = 300, full_refresh_interval: float = 3600):
+    self.point_repository = point_repository
+    self.refresh_interval = refresh_interval
+    self.full_refresh_interval = full_refresh_interval
+    self.points: Dict[str, Point] = {} # By uri
+    self.keys: Dict[str, Optional[str]] = {} # Key -> timeseriesId, None if the point is not collect_enabled
+    self.compression: Dict[str, CompressionSettings] = {} # By timeseriesId
+    self.version = 0 # Incremented every time the index changes
+    self.updated_since: Optional[int] = None
+    self.last_full_refresh = 0.0
+    self.unknown = 0
+    self.disabled = 0
+    self.refresh_lock = Lock()
+    self.refresh_requested = Event()
+    self.stopped = Event()
+    self.thread = Thread(target=self.run, name="point-index-refresh", daemon=True)
+
+  def __len__(self) -> int:
+    return len(self.points)
+
+  def resolve(self, key: str) -> Optional[str]:
+    """The timeseriesId to store a reading under, None if the key isn't a known collect_enabled point."""
+    try:
+      timeseriesid = self.keys[key]
+    except KeyError:
+      self.unknown += 1
+      return None
+    if timeseriesid is None:
+      self.disabled += 1
+    return timeseriesid
+
+  def refresh(self, full: bool = False) -> bool:
+    """Load the points updated since the last refresh (or every point). Returns True if the index changed."""
+    with self.refresh_lock:
+      full = full or self.updated_since is None or time.monotonic() - self.last_full_refresh >= self.full_refresh_interval
+      points, now = self.point_repository.get_ingest_points(updated_since=None if full else self.updated_since)
+      if full:
+        by_uri = {point.uri: point for point in points}
+        self.last_full_refresh = time.monotonic()
+      else:
+        by_uri = {**self.points, **{point.uri: point for point in points}}
+      self.updated_since = now
+      if not full and not points:
+        return False
+      self.points = by_uri
+      self.keys = build_keys(by_uri.values())
+      self.compression = build_compression_settings(by_uri.values())
+      self.version += 1
+      return True
+
+  def request_refresh(self) -> None:
+    """Refresh as soon as possible, eg. when a point was changed in the knowledge graph."""
+    self.refresh_requested.set()
+
+  def start(self) -> None:
+    self.thread.start()
+
+  def stop(self) -> None:
+    self.stopped.set()
+    self.refresh_requested.set()
+    self.thread.join()
+
+  def run(self) -> None:
+    while not self.stopped.is_set():
+      self.refresh_requested.wait(self.refresh_interval)
+      self.refresh_requested.clear()
+      if self.stopped.is_set():
+        return
+      try:
+        if self.refresh():
+          print(f"Point index refreshed, {len(self.points)} points")
+      except Exception as e:
+        print(f"Error refreshing the point index: {e}")
+
+def build_keys(points) -> Dict[str, Optional[str]]:
+  keys: Dict[str, Optional[str]] = {}
+  for point in points:
+    timeseriesid = point.timeseriesId if point.collect_enabled else None
+    for key in (point.timeseriesId, point.mqtt_topic):
+      # An enabled point wins if a disabled one shares the key
+      if key and keys.get(key) is None:
+        keys[key] = timeseriesid
+  return keys
+
+def build_compression_settings(points) -> Dict[str, CompressionSettings]:
+  settings = {}
+  for point in points:
+    if not point.collect_enabled:
+      continue
+    try:
+      compression = CompressionSettings.from_point_properties(point.compression_mode, point.compression_deviation, point.compression_max_silence)
+    except ValueError as e:
+      print(f"Invalid compression settings for point {point.uri}: {e}")
+      continue
+    if compression:
+      settings[point.timeseriesId] = compression
+  return settings
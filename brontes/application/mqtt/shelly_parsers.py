@@ -0,0 +1,41 @@
+# Payload parsers for Shelly devices, see https://shelly-api-docs.shelly.cloud/gen2/
+from functools import lru_cache
+from typing import List
+import json
+
+from brontes.application.mqtt.topic_registry import Reading, parser_registry
+
+@lru_cache(maxsize=65536)
+def switch_timeseries_id(src: str, switch_id: int, measurement: str) -> str:
+  """Cached so every message for a switch reuses the same id string instead of formatting a new one."""
+  return f"{src}-switch-{switch_id}-{measurement}"
+
+@parser_registry.register("+/events/rpc", device_type="shellyplugus")
+def parse_shelly_plug_rpc_event(topic: str, payload: bytes) -> List[Reading]:
+  """
+  Notifications sent by the plug when its switch state changes, eg. {"src": "shellyplugus-...", "params": {"ts": 1713188492.2, "switch:0": {"id": 0, "current": 0.5, "voltage": 120.1}}}
+  """
+  data = json.loads(payload)
+  params = data["params"]
+  ts_us = round(params["ts"] * 1_000_000) # Extract the timestamp, rounded so float seconds like .123456 aren't truncated to .123455
+
+  readings = []
+  # Iterate through each key in "params" to find "switch:X" objects
+  for key, value in params.items():
+    if key.startswith("switch"):
+      # Extract the "id" and iterate over each measurement key within the switch object
+      switch_id = value["id"]
+      for measurement_key in ("current", "voltage"):
+        if measurement_key in value:
+          readings.append((switch_timeseries_id(data["src"], switch_id, measurement_key), ts_us, value[measurement_key]))
+  return readings
+
+@parser_registry.register("+/status/switch:0", device_type="shellyplugus")
+def parse_shelly_plug_switch_status(topic: str, payload: bytes) -> List[Reading]:
+  """
+  Status of the plug's switch, the output (on/off) is stored using the topic as the timeseries ID.
+  """
+  data = json.loads(payload)
+  # Extracting 'minute_ts' from 'aenergy' as timestamp
+  ts_us = round(data["aenergy"]["minute_ts"] * 1_000_000)
+  return [(topic, ts_us, data["output"])]
@@ -0,0 +1,242 @@
+from array import array
+from threading import Lock, Thread, Event
+from typing import List, NamedTuple, Optional, Tuple
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+import psycopg
+
+from brontes.application.dtos.point_dto import PointReadingBatch
+from brontes.infrastructure import Timescale
+
+# Every record is framed with the payload length and a crc32 of the payload
+RECORD_HEADER = struct.Struct("<II")
+# Payload: number of readings and number of timeseries ids, followed by the ids and the ts, values and series columns
+BATCH_HEADER = struct.Struct("<II")
+
+class SpoolPosition(NamedTuple):
+  segment: int
+  offset: int
+
+class Spool:
+  """
+  Append only write-ahead spool for ingested readings.
+  - records are appended to numbered segment files, a new segment is started when the current one is full and every time the spool is opened
+  - writes are flushed to the OS on every append and fsync'd at most every fsync_interval seconds
+  - a torn or corrupt record (eg. after a crash) ends its segment, reading continues with the next segment
+  """
+  def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024, fsync_interval: float = 1.0):
+    self.directory = directory
+    self.segment_bytes = segment_bytes
+    self.fsync_interval = fsync_interval
+    self.lock = Lock()
+    os.makedirs(directory, exist_ok=True)
+    segments = self.segments()
+    self.segment = (segments[-1] + 1) if segments else 1
+    self.file = open(self.segment_path(self.segment), "ab")
+    self.size = 0
+    self.last_fsync = time.monotonic()
+    self.dirty = False
+
+  def segment_path(self, segment: int) -> str:
+    return os.path.join(self.directory, f"{segment:020d}.seg")
+
+  def segments(self) -> List[int]:
+    """Sequence numbers of the segments on disk, oldest first."""
+    return sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith(".seg"))
+
+  def append(self, batch: PointReadingBatch) -> SpoolPosition:
+    """Append a batch of readings as one record. Returns the position after the record."""
+    payload = encode_batch(batch)
+    record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+    with self.lock:
+      if self.size > 0 and self.size + len(record) > self.segment_bytes:
+        self._rotate()
+      self.file.write(record)
+      self.file.flush()
+      self.size += len(record)
+      self.dirty = True
+      if time.monotonic() - self.last_fsync >= self.fsync_interval:
+        self._fsync()
+      return SpoolPosition(self.segment, self.size)
+
+  def sync(self) -> None:
+    """fsync the current segment if there are writes that haven't been synced yet."""
+    with self.lock:
+      if self.dirty:
+        self._fsync()
+
+  def _fsync(self) -> None:
+    os.fsync(self.file.fileno())
+    self.last_fsync = time.monotonic()
+    self.dirty = False
+
+  def _rotate(self) -> None:
+    self._fsync()
+    self.file.close()
+    self.segment += 1
+    self.file = open(self.segment_path(self.segment), "ab")
+    self.size = 0
+
+  def end(self) -> SpoolPosition:
+    with self.lock:
+      return SpoolPosition(self.segment, self.size)
+
+  def read(self, position: SpoolPosition, max_rows: int) -> Tuple[PointReadingBatch, SpoolPosition]:
+    """
+    Read records starting at position until at least max_rows readings are collected or the end of the spool is reached.
+    Returns the readings and the position after the last record read.
+    """
+    readings = PointReadingBatch()
+    end = self.end()
+    segments = [segment for segment in self.segments() if segment >= position.segment]
+    for segment in segments:
+      offset = position.offset if segment == position.segment else 0
+      limit = end.offset if segment == end.segment else None
+      with open(self.segment_path(segment), "rb") as f:
+        f.seek(offset)
+        while len(readings) < max_rows and (limit is None or offset < limit):
+          header = f.read(RECORD_HEADER.size)
+          if len(header) < RECORD_HEADER.size:
+            break
+          length, crc = RECORD_HEADER.unpack(header)
+          payload = f.read(length)
+          if len(payload) < length or zlib.crc32(payload) != crc:
+            print(f"Corrupt record in spool segment {segment} at offset {offset}, skipping the rest of the segment")
+            break
+          readings.extend(decode_batch(payload))
+          offset += RECORD_HEADER.size + length
+      position = SpoolPosition(segment, offset)
+      if len(readings) >= max_rows or segment == end.segment:
+        break
+      position = SpoolPosition(segment + 1, 0) # Finished this segment, move to the next one
+    return readings, position
+
+  def backlog_bytes(self, position: SpoolPosition) -> int:
+    """Number of bytes in the spool after position."""
+    total = 0
+    end = self.end()
+    for segment in self.segments():
+      if segment < position.segment:
+        continue
+      size = end.offset if segment == end.segment else os.path.getsize(self.segment_path(segment))
+      total += size - (position.offset if segment == position.segment else 0)
+    return max(total, 0)
+
+  def remove_before(self, position: SpoolPosition) -> None:
+    """Delete the segments that have been fully replayed."""
+    for segment in self.segments():
+      if segment >= min(position.segment, self.segment):
+        break
+      os.remove(self.segment_path(segment))
+
+  def close(self) -> None:
+    with self.lock:
+      self._fsync()
+      self.file.close()
+
+def encode_batch(batch: PointReadingBatch) -> bytes:
+  names = [name.encode() for name in batch.timeseriesids]
+  return b"".join([
+    BATCH_HEADER.pack(len(batch), len(names)),
+    *(struct.pack("<H", len(name)) + name for name in names),
+    np.frombuffer(batch.ts, dtype=np.int64).astype("<i8").tobytes(),
+    np.frombuffer(batch.values, dtype=np.float64).astype("<f8").tobytes(),
+    np.frombuffer(batch.series, dtype=np.int32).astype("<i4").tobytes(),
+  ])
+
+def decode_batch(payload: bytes) -> PointReadingBatch:
+  count, name_count = BATCH_HEADER.unpack_from(payload)
+  offset = BATCH_HEADER.size
+  names = []
+  for _ in range(name_count):
+    (length,) = struct.unpack_from("<H", payload, offset)
+    names.append(payload[offset + 2:offset + 2 + length].decode())
+    offset += 2 + length
+  columns = []
+  for dtype, native in (("<i8", np.int64), ("<f8", np.float64), ("<i4", np.int32)):
+    column = np.frombuffer(payload, dtype=dtype, count=count, offset=offset)
+    columns.append(column.astype(native).tobytes())
+    offset += column.nbytes
+  return PointReadingBatch(ts=array('q', columns[0]), values=array('d', columns[1]), series=array('i', columns[2]), timeseriesids=names)
+
+class SpoolReplayer:
+  """
+  Drains the spool into Timescale on a background thread.
+  The replay position is committed in the same transaction as the readings, so after a crash replay resumes exactly where the last commit ended and nothing is inserted twice.
+  While the database is unavailable the replayer backs off and retries, the spool keeps growing on disk.
+  """
+  def __init__(self, spool: Spool, ts: Timescale, name: str = "mqtt2timescale", batch_rows: int = 10_000, idle_interval: float = 1.0):
+    self.spool = spool
+    self.ts = ts
+    self.name = name
+    self.batch_rows = batch_rows
+    self.idle_interval = idle_interval
+    self.position: Optional[SpoolPosition] = None
+    self.healthy = False
+    self.replayed_rows = 0
+    self.last_replay_latency = 0.0
+    self.stopped = Event()
+    self.thread = Thread(target=self.run, name=f"spool-replayer-{name}", daemon=True)
+
+  def start(self) -> None:
+    self.thread.start()
+
+  def stop(self, drain_timeout: float = 30) -> None:
+    """Stop replaying. Waits up to drain_timeout seconds for the spool to be drained, whatever is left is replayed on the next start."""
+    deadline = time.monotonic() + drain_timeout
+    while self.thread.is_alive() and self.healthy and self.backlog_bytes() > 0 and time.monotonic() < deadline:
+      time.sleep(0.1)
+    self.stopped.set()
+    self.thread.join()
+
+  def load_position(self) -> SpoolPosition:
+    checkpoint = self.ts.get_ingest_checkpoint(self.name)
+    segments = self.spool.segments()
+    if checkpoint is None:
+      return SpoolPosition(segments[0], 0) if segments else self.spool.end()
+    position = SpoolPosition(*checkpoint)
+    if segments and position.segment < segments[0]: # The checkpoint's segment was fully replayed and removed
+      return SpoolPosition(segments[0], 0)
+    return position
+
+  def backlog_bytes(self) -> int:
+    return self.spool.backlog_bytes(self.position) if self.position else 0
+
+  def replay_once(self) -> int:
+    """Replay one batch from the spool. Returns the number of readings inserted."""
+    if self.position is None:
+      self.position = self.load_position()
+    readings, position = self.spool.read(self.position, self.batch_rows)
+    if position != self.position:
+      start = time.perf_counter()
+      self.ts.insert_timeseries(readings, checkpoint=(self.name, position.segment, position.offset))
+      self.last_replay_latency = time.perf_counter() - start
+      self.position = position
+      self.replayed_rows += len(readings)
+      self.spool.remove_before(position)
+    return len(readings)
+
+  def run(self) -> None:
+    backoff = 1
+    while not self.stopped.is_set():
+      try:
+        self.spool.sync()
+        replayed = self.replay_once()
+        self.healthy = True
+        backoff = 1
+        if replayed == 0:
+          self.stopped.wait(self.idle_interval)
+      except psycopg.OperationalError as e:
+        self.healthy = False
+        print(f"Database unavailable, retrying spool replay in {backoff}s: {e}")
+        self.stopped.wait(backoff)
+        backoff = min(backoff * 2, 60)
+      except Exception as e:
+        self.healthy = False
+        print(f"Error replaying spool: {e}")
+        self.stopped.wait(backoff)
+        backoff = min(backoff * 2, 60)
@@ -0,0 +1,168 @@
+from threading import Thread
+from typing import Dict, Optional
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import time
+
+from brontes.application.mqtt.mqtt2timescale import build_app, idempotent_from_environment
+from brontes.infrastructure import Postgres, Timescale
+
+def shared_topic(group: str, topic: str) -> str:
+  """MQTT v5 shared subscription, the broker delivers each message to only one subscriber in the group."""
+  return f"$share/{group}/{topic}"
+
+def run_worker(worker_id: int, topic: str, group: str, stats_queue: multiprocessing.Queue, stats_interval: float):
+  """
+  Entry point of a worker process. Each worker has its own broker connection, Timescale connection and spool.
+  """
+  spool_dir = os.environ.get("INGEST_SPOOL_DIR")
+  app = build_app(
+    spool_dir=os.path.join(spool_dir, f"worker-{worker_id}") if spool_dir else None,
+    spool_name=f"mqtt2timescale-{worker_id}",
+    setup_db=False,
+  )
+
+  def report_stats():
+    while not app.stopped.wait(stats_interval):
+      try:
+        stats_queue.put_nowait((worker_id, app.stats()))
+      except queue.Full:
+        pass
+
+  Thread(target=report_stats, name="mqtt2timescale-stats-report", daemon=True).start()
+
+  # Let SIGTERM from the supervisor unwind the MQTT loop so the queue gets flushed
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+  try:
+    app.start_message_listener(topic=shared_topic(group, topic))
+  finally:
+    app.stop()
+
+def aggregate_stats(worker_stats: Dict[int, dict]) -> dict:
+  """Combine the stats reported by each worker: counters are summed, latencies and batch parameters take the largest worker."""
+  totals: dict = {"workers": len(worker_stats)}
+  for stats in worker_stats.values():
+    for key, value in stats.items():
+      if isinstance(value, bool):
+        totals[key] = totals.get(key, True) and value
+      elif "latency" in key or key in ("batch_size", "flush_interval"):
+        totals[key] = max(totals.get(key, 0.0), value)
+      else:
+        totals[key] = totals.get(key, 0) + value
+  return totals
+
+class IngestSupervisor:
+  """
+  Runs N ingest worker processes that share the load through a shared subscription.
+  - sets up the database once before starting the workers
+  - restarts workers that die, backing off when a worker keeps crashing
+  - collects the stats each worker reports and logs the aggregate
+  """
+  def __init__(self, workers: int, topic: str = "#", group: str = "mqtt2timescale", stats_interval: float = 60, max_restart_backoff: float = 60):
+    self.workers = workers
+    self.topic = topic
+    self.group = group
+    self.stats_interval = stats_interval
+    self.max_restart_backoff = max_restart_backoff
+    self.context = multiprocessing.get_context("spawn")
+    self.stats_queue = self.context.Queue(maxsize=workers * 100)
+    self.processes: Dict[int, Optional[multiprocessing.Process]] = {}
+    self.restarts: Dict[int, int] = {i: 0 for i in range(workers)} # Consecutive quick crashes, for the backoff
+    self.total_restarts: Dict[int, int] = {i: 0 for i in range(workers)} # Every restart since the supervisor started, for the stats
+    self.next_start: Dict[int, float] = {i: 0.0 for i in range(workers)}
+    self.started_at: Dict[int, float] = {}
+    self.worker_stats: Dict[int, dict] = {}
+    self.running = False
+
+  def start_worker(self, worker_id: int) -> None:
+    process = self.context.Process(
+      target=run_worker,
+      args=(worker_id, self.topic, self.group, self.stats_queue, self.stats_interval),
+      name=f"mqtt2timescale-worker-{worker_id}",
+    )
+    process.start()
+    self.processes[worker_id] = process
+    self.started_at[worker_id] = time.monotonic()
+    print(f"Started ingest worker {worker_id} (pid {process.pid}) on {shared_topic(self.group, self.topic)}")
+
+  def check_workers(self) -> None:
+    """Restart workers that have exited."""
+    now = time.monotonic()
+    for worker_id in range(self.workers):
+      process = self.processes.get(worker_id)
+      if process is not None and process.is_alive():
+        continue
+      if process is not None:
+        print(f"Ingest worker {worker_id} exited with code {process.exitcode}")
+        self.processes[worker_id] = None
+        self.worker_stats.pop(worker_id, None)
+        self.total_restarts[worker_id] += 1
+        # Back off if the worker crashed shortly after starting, otherwise restart right away
+        if now - self.started_at[worker_id] < self.max_restart_backoff:
+          self.restarts[worker_id] += 1
+        else:
+          self.restarts[worker_id] = 0
+        self.next_start[worker_id] = now + min(2 ** self.restarts[worker_id] - 1, self.max_restart_backoff)
+      if now >= self.next_start[worker_id]:
+        if self.restarts[worker_id]:
+          print(f"Restarting ingest worker {worker_id} (restart {self.restarts[worker_id]})")
+        self.start_worker(worker_id)
+
+  def collect_stats(self, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        return
+      try:
+        worker_id, stats = self.stats_queue.get(timeout=remaining)
+      except queue.Empty:
+        return
+      self.worker_stats[worker_id] = stats
+
+  def stats(self) -> dict:
+    return {**aggregate_stats(self.worker_stats), "restarts": sum(self.total_restarts.values())}
+
+  def setup_db(self) -> None:
+    """Create and migrate the tables, rollups and policies once instead of in every worker at the same time."""
+    postgres = Postgres()
+    try:
+      Timescale(postgres=postgres, idempotent=idempotent_from_environment())
+    finally:
+      postgres.close()
+
+  def run(self) -> None:
+    self.setup_db()
+    self.running = True
+    signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+    last_report = time.monotonic()
+    try:
+      while self.running:
+        self.check_workers()
+        self.collect_stats(timeout=1)
+        if time.monotonic() - last_report >= self.stats_interval:
+          print(f"Ingest stats: {json.dumps(self.stats())}")
+          last_report = time.monotonic()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      self.shutdown()
+
+  def stop(self) -> None:
+    self.running = False
+
+  def shutdown(self, timeout: float = 60) -> None:
+    """Ask the workers to flush and exit, kill the ones that don't exit in time."""
+    processes = [process for process in self.processes.values() if process is not None]
+    for process in processes:
+      if process.is_alive():
+        process.terminate()
+    deadline = time.monotonic() + timeout
+    for process in processes:
+      process.join(max(deadline - time.monotonic(), 0))
+      if process.is_alive():
+        process.kill()
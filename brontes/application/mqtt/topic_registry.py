@@ -0,0 +1,109 @@
+from typing import Callable, Dict, Iterator, List, Optional, Generic, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# (timeseriesid, epoch microseconds, value)
+Reading = Tuple[str, int, float]
+
+# A parser takes the topic and raw payload of a message and returns the readings in it
+Parser = Callable[[str, bytes], List[Reading]]
+
+class TopicTrie(Generic[T]):
+  """
+  Stores values under MQTT topic filters and finds the value for a topic in O(topic depth).
+  Filters can use the single level (+) and multi level (#) wildcards.
+  When several filters match a topic the most specific one wins: an exact level beats +, and + beats #.
+  """
+  def __init__(self):
+    self.children: Dict[str, "TopicTrie[T]"] = {}
+    self.value: Optional[T] = None
+
+  def insert(self, topic_filter: str, value: T) -> None:
+    levels = topic_filter.split("/")
+    for i, level in enumerate(levels):
+      if level == "#" and i != len(levels) - 1:
+        raise ValueError(f"Invalid topic filter {topic_filter}, # must be the last level")
+    node = self
+    for level in levels:
+      node = node.children.setdefault(level, TopicTrie())
+    node.value = value
+
+  def get(self, topic_filter: str) -> Optional[T]:
+    node = self
+    for level in topic_filter.split("/"):
+      node = node.children.get(level)
+      if node is None:
+        return None
+    return node.value
+
+  def match(self, topic: str) -> Optional[T]:
+    """The value of the most specific filter that matches the topic."""
+    return next(self.matches(topic), None)
+
+  def matches(self, topic: str) -> Iterator[T]:
+    """Values of every filter that matches the topic, most specific first."""
+    return self._matches(topic.split("/"), 0)
+
+  def _matches(self, levels: List[str], i: int) -> Iterator[T]:
+    if i == len(levels):
+      if self.value is not None:
+        yield self.value
+    else:
+      for key in (levels[i], "+"):
+        child = self.children.get(key)
+        if child is not None:
+          yield from child._matches(levels, i + 1)
+    hash_node = self.children.get("#") # "a/#" also matches "a"
+    if hash_node is not None and hash_node.value is not None:
+      yield hash_node.value
+
+def device_type_of(topic: str) -> str:
+  """Devices publish under their id, eg. shellyplugus-083af2013f98/events/rpc, the device type is the part before the first dash."""
+  return topic.split("/", 1)[0].split("-", 1)[0]
+
+class ParserRegistry:
+  """
+  Maps MQTT topic filters to payload parsers, parsers are registered per device type.
+  Resolved topics are cached so repeat topics don't walk the trie again.
+  """
+  def __init__(self, cache_size: int = 100_000):
+    self.trie: TopicTrie[Dict[Optional[str], Parser]] = TopicTrie()
+    self.cache: Dict[str, Optional[Parser]] = {}
+    self.cache_size = cache_size
+
+  def register(self, topic_filter: str, device_type: str | None = None):
+    """
+    Decorator that registers a parser for a topic filter.
+    If a device type is given the parser is only used for topics published by that type of device.
+    """
+    def decorator(parser: Parser) -> Parser:
+      self.add(topic_filter, parser, device_type)
+      return parser
+    return decorator
+
+  def add(self, topic_filter: str, parser: Parser, device_type: str | None = None) -> None:
+    parsers = self.trie.get(topic_filter)
+    if parsers is None:
+      parsers = {}
+      self.trie.insert(topic_filter, parsers)
+    parsers[device_type] = parser
+    self.cache.clear()
+
+  def resolve(self, topic: str) -> Optional[Parser]:
+    """Find the parser for a topic, returns None if no parser is registered for it."""
+    try:
+      return self.cache[topic]
+    except KeyError:
+      pass
+    parser = None
+    device_type = device_type_of(topic)
+    for parsers in self.trie.matches(topic):
+      parser = parsers.get(device_type, parsers.get(None))
+      if parser is not None:
+        break
+    if len(self.cache) >= self.cache_size:
+      self.cache.clear()
+    self.cache[topic] = parser
+    return parser
+
+parser_registry = ParserRegistry()
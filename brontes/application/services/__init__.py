@@ -6,4 +6,5 @@ from .cobie_to_graph_service import CobieToGraphService
 from .device_service import DeviceService
 from .point_service import PointService
 from .bacnet_to_graph_service import BacnetToGraphService
-from .ai_assistant_service import AIAssistantService
\ No newline at end of file
+from .ai_assistant_service import AIAssistantService
+from .aggregation_service import AggregationService
\ No newline at end of file
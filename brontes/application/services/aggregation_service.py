@@ -0,0 +1,83 @@
+from collections import OrderedDict
+from dataclasses import asdict
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from typing import Hashable, List, Optional, Sequence, Tuple
+import time
+
+from brontes.application.dtos.point_dto import to_datetime
+from brontes.infrastructure.repos import PortfolioRepository, PointRepository
+from brontes.infrastructure.db.timescale import floor_to
+
+def align_window(start_time: str, end_time: str, bucket: timedelta) -> Tuple[datetime, datetime]:
+  """Widen the window to whole buckets, the start down and the end up to a bucket boundary."""
+  start = floor_to(to_datetime(start_time), bucket)
+  end = floor_to(to_datetime(end_time), bucket)
+  if end < to_datetime(end_time):
+    end += bucket
+  return start, end
+
+class StatisticsCache:
+  """
+  Results of portfolio statistics queries per (portfolio, brick class, bucket, window), least recently used entries are evicted past max_entries.
+  - windows that end before now - settle are closed, their entries expire after closed_ttl seconds (readings replayed late, eg. from a spool, show up then)
+  - windows still open expire after live_ttl seconds, so repeated dashboard loads share one query without falling behind the latest bucket
+  """
+  def __init__(self, max_entries: int = 1024, live_ttl: float = 60.0, closed_ttl: float = 24 * 3600.0, settle: timedelta = timedelta(minutes=15)):
+    self.max_entries = max_entries
+    self.live_ttl = live_ttl
+    self.closed_ttl = closed_ttl
+    self.settle = settle
+    self.entries: OrderedDict = OrderedDict() # key -> (result, expires at)
+    self.lock = Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def __len__(self) -> int:
+    return len(self.entries)
+
+  def get(self, key: Hashable) -> Optional[list]:
+    now = time.monotonic()
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None or entry[1] <= now:
+        self.misses += 1
+        return None
+      self.entries.move_to_end(key)
+      self.hits += 1
+      return entry[0]
+
+  def put(self, key: Hashable, window_end: datetime, result: list) -> None:
+    closed = window_end <= datetime.now(timezone.utc) - self.settle
+    expires = time.monotonic() + (self.closed_ttl if closed else self.live_ttl)
+    with self.lock:
+      self.entries[key] = (result, expires)
+      self.entries.move_to_end(key)
+      while len(self.entries) > self.max_entries:
+        self.entries.popitem(last=False)
+
+class AggregationService:
+  def __init__(self, portfolio_repository: PortfolioRepository, point_repository: PointRepository, cache: StatisticsCache | None = None):
+    self.portfolio_repository = portfolio_repository
+    self.point_repository = point_repository
+    self.cache = cache if cache is not None else StatisticsCache()
+
+  def get_portfolio_statistics(self, portfolio_uri: str, brick_class_uri: str, start_time: str, end_time: str, bucket: timedelta, percentiles: Sequence[float] = ()) -> List[dict]:
+    """
+    Statistics (avg, min, max, count and percentiles) of the readings of the points of a brick class per facility of a portfolio and per bucket, eg. the hourly average zone temperature of each facility.
+    The window is widened to whole buckets, the points of all facilities are resolved in one graph query and the statistics computed in one grouped timeseries query.
+    """
+    start, end = align_window(start_time, end_time, bucket)
+    key = (portfolio_uri, brick_class_uri, bucket, start, end, tuple(percentiles))
+    result = self.cache.get(key)
+    if result is not None:
+      return result
+    facilities = self.portfolio_repository.get_points_by_class(portfolio_uri, brick_class_uri)
+    groups = [timeseries_ids for _, timeseries_ids in facilities]
+    statistics = self.point_repository.timeseries_statistics(groups, start.isoformat(), end.isoformat(), bucket=bucket, percentiles=percentiles)
+    result = [
+      {'facility': asdict(facility), 'timeseries': len(timeseries_ids), 'data': data}
+      for (facility, timeseries_ids), data in zip(facilities, statistics)
+    ]
+    self.cache.put(key, end, result)
+    return result
@@ -1,4 +1,5 @@
 from typing import List, Generator
+import asyncio
 import json
 import logging
 from dataclasses import asdict
@@ -31,7 +32,7 @@ class AIAssistantService:
   
   async def chat(self, session_id: str, user: User, input: str, portfolio_uri: str, facility_uri: str | None = None, document_uri: str | None = None, verbose: bool = False) -> Generator[str, None, None]:
     # Initialize chat history manager
-    chat_history = self.ai_repository.chat_history_client(user_email=user.email, session_id=session_id)
+    chat_history = await self.ai_repository.chat_history_client_async(user_email=user.email, session_id=session_id)
 
     # Define the tools that the AI assistant can use
     @tool
@@ -68,7 +69,7 @@ class AIAssistantService:
       MessagesPlaceholder("chat_history")
     ])
     # Format the chat messages
-    chat_history.add_message(HumanMessage(input)) # Add the user input to the chat history
+    await chat_history.aadd_messages([HumanMessage(input)]) # Add the user input to the chat history
     
     while True:
       gathered_chunks = None
@@ -77,7 +78,7 @@ class AIAssistantService:
       # Fill out the chat template with the chat history
       messages = chat_template.format_messages(
         user_name=user.email,
-        chat_history=chat_history.messages
+        chat_history=await chat_history.aget_messages()
       )
 
       ai_response = ""
@@ -100,7 +101,7 @@ class AIAssistantService:
         tool_calls: List[ToolCall] = [ToolCall(name=tool_call['function']['name'], args=json.loads(tool_call['function']['arguments']), id=tool_call['id']) for tool_call in gathered_chunks.additional_kwargs["tool_calls"]]
         
         # Update the chat message history to show ai selected some tools to use
-        chat_history.add_message(AIMessage(content="", tool_calls=tool_calls))
+        await chat_history.aadd_messages([AIMessage(content="", tool_calls=tool_calls)])
 
         for tool_call in tool_calls:
           tool_name = tool_call["name"]
@@ -114,7 +115,7 @@ class AIAssistantService:
           if tool_name == "search_building_documents":
             try:
               query = tool_args["query"]
-              document_results = search_building_documents(query)
+              document_results = await asyncio.to_thread(search_building_documents, query) # The vector store is sync, keep it off the event loop
 
               logging.info(f"The search results are: {document_results[:3]}")
 
@@ -131,20 +132,20 @@ class AIAssistantService:
 
               # Yield the tool call event and add to the chat history
               yield {"event": "source", "data": [asdict(result) for result in document_results]}
-              chat_history.add_message(ToolMessage(content=document_context, tool_call_id=tool_id))
+              await chat_history.aadd_messages([ToolMessage(content=document_context, tool_call_id=tool_id)])
             except Exception as e:
-              chat_history.add_message(ToolMessage(content=f"An error occurred while trying to search the building documents: {e}", tool_call_id=tool_id))
+              await chat_history.aadd_messages([ToolMessage(content=f"An error occurred while trying to search the building documents: {e}", tool_call_id=tool_id)])
           elif tool_name == "web_search":
             try:
-              search_results = web_search(tool_args["query"])
+              search_results = await asyncio.to_thread(web_search, tool_args["query"])
               logging.info(str(search_results))
               logging.info(len(search_results))
               yield {"event": "web_search_results", "data": search_results}
 
-              chat_history.add_message(ToolMessage(content=str(search_results), tool_call_id=tool_id))
+              await chat_history.aadd_messages([ToolMessage(content=str(search_results), tool_call_id=tool_id)])
             except Exception as e:
-              chat_history.add_message(ToolMessage(content=f"An error occurred while trying to search the web: {e}", tool_call_id=tool_id))
+              await chat_history.aadd_messages([ToolMessage(content=f"An error occurred while trying to search the web: {e}", tool_call_id=tool_id)])
       else: 
         # Add final ai response to chat history and return
-        chat_history.add_message(AIMessage(ai_response))
+        await chat_history.aadd_messages([AIMessage(ai_response)])
         return
\ No newline at end of file
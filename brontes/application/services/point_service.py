@@ -1,4 +1,7 @@
-from typing import List
+from datetime import timedelta
+from typing import AsyncIterator, Iterator, List, Optional
+import csv
+import io
 import time
 from uuid import uuid4
 import threading
@@ -6,8 +9,9 @@ import json
 from dataclasses import asdict
 
 from brontes.domain.models import Point
-from brontes.application.dtos.point_dto import PointCreateParams, PointUpdates
+from brontes.application.dtos.point_dto import PointCreateParams, PointUpdates, AlignedTimeseries, Downsampling, ExportFormat, Fill, Resolution, StreamFormat
 from brontes.infrastructure.repos import PointRepository, DeviceRepository
+from brontes.infrastructure.db.arrow_export import write_record_batches
 from brontes.infrastructure import MQTTClient
 
 class PointService:
@@ -31,8 +35,37 @@ class PointService:
   def update_point(self, point_uri: str, updates: PointUpdates, new_brick_class_uri: str | None = None):
     self.point_repository.update_point(point_uri=point_uri, updates=updates, new_brick_class_uri=new_brick_class_uri)
 
-  def get_points_history(self, point_uris: List[str], start_time: str, end_time: str):
-    return self.point_repository.points_history(start_time=start_time, end_time=end_time, point_uris=point_uris)
+  def get_points_history(self, point_uris: List[str], start_time: str, end_time: str, resolution: Resolution = Resolution.RAW, max_points: Optional[int] = None, downsampling: Downsampling = Downsampling.LTTB):
+    return self.point_repository.points_history(start_time=start_time, end_time=end_time, point_uris=point_uris, resolution=resolution, max_points=max_points, downsampling=downsampling)
+
+  async def get_points_history_async(self, point_uris: List[str], start_time: str, end_time: str, resolution: Resolution = Resolution.RAW, max_points: Optional[int] = None, downsampling: Downsampling = Downsampling.LTTB):
+    return await self.point_repository.points_history_async(start_time=start_time, end_time=end_time, point_uris=point_uris, resolution=resolution, max_points=max_points, downsampling=downsampling)
+
+  async def stream_points_history(self, point_uris: List[str], start_time: str, end_time: str, format: StreamFormat = StreamFormat.NDJSON, resolution: Resolution = Resolution.RAW, max_points: Optional[int] = None, downsampling: Downsampling = Downsampling.NONE) -> AsyncIterator[str]:
+    """
+    History of the points as NDJSON or CSV lines, encoded chunk by chunk as the rows come off the cursor.
+    Without max_points at most one chunk of rows is in memory, CSV columns are the fields of the first reading (ts, value, timeseriesid and the rollup fields).
+    """
+    fieldnames = None
+    async for _, data in self.point_repository.stream_points_history_async(start_time=start_time, end_time=end_time, point_uris=point_uris, resolution=resolution, max_points=max_points, downsampling=downsampling):
+      if format == StreamFormat.NDJSON:
+        yield "".join(json.dumps(record) + "\n" for record in data)
+        continue
+      buffer = io.StringIO()
+      writer = csv.DictWriter(buffer, fieldnames=fieldnames or list(data[0]))
+      if fieldnames is None:
+        writer.writeheader()
+        fieldnames = writer.fieldnames
+      writer.writerows(data)
+      yield buffer.getvalue()
+
+  def get_aligned_points_history(self, point_uris: List[str], start_time: str, end_time: str, bucket: timedelta, fill: Fill = Fill.LOCF) -> AlignedTimeseries:
+    return self.point_repository.aligned_points_history(start_time=start_time, end_time=end_time, point_uris=point_uris, bucket=bucket, fill=fill)
+
+  def export_points_history(self, point_uris: List[str], start_time: str, end_time: str, format: ExportFormat = ExportFormat.PARQUET, resolution: Resolution = Resolution.RAW) -> Iterator[bytes]:
+    """The full history of the points as an Arrow IPC stream or Parquet file, encoded batch by batch as it's read."""
+    batches = self.point_repository.export_points_history(start_time=start_time, end_time=end_time, point_uris=point_uris, resolution=resolution)
+    return write_record_batches(batches, batches.schema, format)
   
   def get_live_reading(self, point_uri: str):
     """
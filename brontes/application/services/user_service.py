@@ -20,6 +20,9 @@ class UserService:
   def get_user(self, email: str):
     return self.user_repository.get_user(email)
 
+  async def get_user_async(self, email: str):
+    return await self.user_repository.get_user_async(email)
+
   @staticmethod
   def hash_password(password: str) -> str:
     return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
\ No newline at end of file
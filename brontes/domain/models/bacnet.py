@@ -16,6 +16,9 @@ class Point:
   object_index: Optional[str] = None
   object_units: Optional[str] = None
   collect_enabled: Optional[bool] = None
+  compression_mode: Optional[str] = None # Ingest compression: deadband, deadband_percent or swinging_door
+  compression_deviation: Optional[float] = None
+  compression_max_silence: Optional[float] = None # Seconds
   object_description: Optional[str] = None
   value: Optional[float] = None
   ts: Optional[str] = None
@@ -0,0 +1,77 @@
+from typing import Dict, Iterable, Iterator, List
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from brontes.application.dtos.point_dto import ExportFormat
+
+def history_schema(rollup: bool) -> pa.Schema:
+  """Columns of a history export, the same fields as PointReading or PointRollup with the timeseries id dictionary encoded."""
+  fields = [
+    pa.field("ts", pa.timestamp("us", tz="UTC"), nullable=False),
+    pa.field("timeseriesid", pa.dictionary(pa.int32(), pa.string()), nullable=False),
+    pa.field("value", pa.float64(), nullable=False),
+  ]
+  if rollup:
+    fields += [pa.field(name, pa.float64(), nullable=False) for name in ("min", "max", "last")] + [pa.field("count", pa.int64(), nullable=False)]
+  return pa.schema(fields)
+
+def history_record_batch(schema: pa.Schema, columns: Dict[str, np.ndarray], names: pa.Array) -> pa.RecordBatch:
+  """
+  Build a record batch from numpy columns without going through Python objects.
+  ts holds epoch microseconds and timeseriesid the index of each row's timeseries id in names.
+  """
+  arrays = []
+  for field in schema:
+    if field.name == "timeseriesid":
+      arrays.append(pa.DictionaryArray.from_arrays(pa.array(columns[field.name], type=pa.int32()), names))
+    else:
+      arrays.append(pa.array(columns[field.name], type=field.type))
+  return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+class ChunkSink:
+  """Write only file object that collects what the Arrow writers write until it's taken."""
+  def __init__(self):
+    self.chunks: List[bytes] = []
+    self.position = 0
+    self.closed = False
+
+  def write(self, data) -> int:
+    data = bytes(data)
+    self.chunks.append(data)
+    self.position += len(data)
+    return len(data)
+
+  def tell(self) -> int:
+    return self.position
+
+  def flush(self) -> None:
+    pass
+
+  def close(self) -> None:
+    self.closed = True
+
+  def writable(self) -> bool:
+    return True
+
+  def take(self) -> bytes:
+    data = b"".join(self.chunks)
+    self.chunks = []
+    return data
+
+def write_record_batches(batches: pa.RecordBatchReader | Iterable[pa.RecordBatch], schema: pa.Schema, format: ExportFormat) -> Iterator[bytes]:
+  """
+  Encode record batches as an Arrow IPC stream or a Parquet file, yielding the bytes written for each batch as soon as it's encoded.
+  Every batch becomes a Parquet row group, so only one batch is held in memory at a time.
+  """
+  sink = ChunkSink()
+  writer = pa.ipc.new_stream(sink, schema) if format == ExportFormat.ARROW else pq.ParquetWriter(sink, schema, compression="zstd")
+  try:
+    for batch in batches:
+      writer.write_batch(batch)
+      data = sink.take()
+      if data:
+        yield data
+  finally:
+    writer.close()
+  yield sink.take()
@@ -0,0 +1,158 @@
+from collections import OrderedDict
+from datetime import timedelta
+from threading import Lock, get_ident
+from typing import Hashable, Iterable, List, Optional, Tuple
+import hashlib
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+import weakref
+
+BLOCK_SUFFIX = ".block"
+
+class BlockCache:
+  """
+  Rows of closed history blocks (a fixed time span of one timeseries at one resolution), kept in memory with a size budget in front of the timeseries table, see Timescale.get_timeseries.
+  - a block is closed once it ends more than settle before now. Late readings for it (eg. a long spool replay) are seen once the writer discards it (see Timescale.insert_timeseries) or, when they're written by another process, once it expires max_age after it was cached
+  - least recently used blocks are evicted past max_bytes, to the directory if one is set (a second tier with its own budget) or dropped otherwise
+  - the disk tier isn't kept across restarts, each cache spills to its own subdirectory of the directory, removed when the process exits
+  """
+  def __init__(self, max_bytes: int = 256 * 2**20, directory: Optional[str] = None, max_disk_bytes: int = 4 * 2**30, settle: timedelta = timedelta(hours=1), max_age: timedelta = timedelta(days=1)):
+    self.max_bytes = max_bytes
+    self.directory = None
+    self.max_disk_bytes = max_disk_bytes
+    self.settle = settle
+    self.max_age = max_age
+    self.blocks: OrderedDict = OrderedDict() # key -> (rows, estimated size, expires at)
+    self.size = 0
+    self.disk: OrderedDict = OrderedDict() # key -> (file size, expires at)
+    self.disk_size = 0
+    self.lock = Lock()
+    self.hits = 0
+    self.disk_hits = 0
+    self.misses = 0
+    if directory is not None:
+      # Several processes (eg. the API workers) can share the directory, none of them touches the others' blocks
+      os.makedirs(directory, exist_ok=True)
+      self.directory = tempfile.mkdtemp(prefix=f"blocks-{os.getpid()}-", dir=directory)
+      weakref.finalize(self, shutil.rmtree, self.directory, True)
+
+  def __len__(self) -> int:
+    return len(self.blocks)
+
+  def get(self, key: Hashable) -> Optional[tuple]:
+    """The rows of a block, None if it isn't cached (or has expired)."""
+    now = time.monotonic()
+    with self.lock:
+      entry = self.blocks.get(key)
+      if entry is not None and entry[2] > now:
+        self.blocks.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+      if entry is not None:
+        self.blocks.pop(key)
+        self.size -= entry[1]
+      on_disk = self.disk.get(key)
+      if on_disk is None or on_disk[1] <= now:
+        self.misses += 1
+    if on_disk is None:
+      return None
+    if on_disk[1] <= now:
+      self.remove(key)
+      return None
+    expires = on_disk[1]
+    try:
+      with open(self.path(key), "rb") as file:
+        rows = pickle.load(file)
+    except FileNotFoundError: # Evicted from the disk tier in the meantime
+      with self.lock:
+        self.misses += 1
+      return None
+    with self.lock:
+      self.disk_hits += 1
+    self.put(key, rows, expires)
+    return rows
+
+  def put(self, key: Hashable, rows: tuple, expires: Optional[float] = None) -> None:
+    size = block_size(rows)
+    if size > self.max_bytes:
+      return
+    if expires is None:
+      expires = time.monotonic() + self.max_age.total_seconds()
+    evicted: List[Tuple[Hashable, tuple, float]] = []
+    with self.lock:
+      previous = self.blocks.pop(key, None)
+      if previous is not None:
+        self.size -= previous[1]
+      self.blocks[key] = (rows, size, expires)
+      self.size += size
+      while self.size > self.max_bytes:
+        evicted_key, (evicted_rows, evicted_size, evicted_expires) = self.blocks.popitem(last=False)
+        self.size -= evicted_size
+        evicted.append((evicted_key, evicted_rows, evicted_expires))
+    if self.directory is not None:
+      for evicted_key, evicted_rows, evicted_expires in evicted:
+        self.spill(evicted_key, evicted_rows, evicted_expires)
+
+  def discard(self, keys: Iterable[Hashable]) -> None:
+    """Drop blocks from both tiers, eg. when readings were written to them after they were cached."""
+    for key in keys:
+      with self.lock:
+        entry = self.blocks.pop(key, None)
+        if entry is not None:
+          self.size -= entry[1]
+        on_disk = key in self.disk
+      if on_disk:
+        self.remove(key)
+
+  def remove(self, key: Hashable) -> None:
+    """Remove a block from the disk tier."""
+    with self.lock:
+      entry = self.disk.pop(key, None)
+      if entry is None:
+        return
+      self.disk_size -= entry[0]
+    try:
+      os.remove(self.path(key))
+    except FileNotFoundError:
+      pass
+
+  def spill(self, key: Hashable, rows: tuple, expires: float) -> None:
+    """Write an evicted block to the disk tier, evicting the least recently spilled blocks past max_disk_bytes."""
+    with self.lock:
+      if key in self.disk:
+        self.disk.move_to_end(key)
+        return
+    path = self.path(key)
+    data = pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(data) > self.max_disk_bytes:
+      return
+    temporary = f"{path}.{get_ident()}.tmp"
+    with open(temporary, "wb") as file:
+      file.write(data)
+    os.replace(temporary, path)
+    removed: List[Hashable] = []
+    with self.lock:
+      self.disk[key] = (len(data), expires)
+      self.disk_size += len(data)
+      while self.disk_size > self.max_disk_bytes:
+        removed_key, (removed_size, _) = self.disk.popitem(last=False)
+        self.disk_size -= removed_size
+        removed.append(removed_key)
+    for removed_key in removed:
+      try:
+        os.remove(self.path(removed_key))
+      except FileNotFoundError:
+        pass
+
+  def path(self, key: Hashable) -> str:
+    return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest() + BLOCK_SUFFIX)
+
+def block_size(rows: tuple) -> int:
+  """Estimated memory of the rows of a block, all rows of a block have the same shape so the first one is measured."""
+  if not rows:
+    return sys.getsizeof(rows)
+  return sys.getsizeof(rows) + len(rows) * (sys.getsizeof(rows[0]) + sum(sys.getsizeof(value) for value in rows[0]))
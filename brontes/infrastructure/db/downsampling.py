@@ -0,0 +1,68 @@
+import numpy as np
+
+from brontes.application.dtos.point_dto import Downsampling
+
+# LTTB picks from at most this many candidates per output point, the rest are dropped by a vectorized min/max pass first (MinMaxLTTB)
+LTTB_PRESELECT_RATIO = 4
+
+def downsample(x: np.ndarray, y: np.ndarray, max_points: int, method: Downsampling) -> np.ndarray:
+  """Sorted indices of at most max_points values of the series (x ascending) to keep, always including the first and the last."""
+  if method == Downsampling.NONE or len(x) <= max_points:
+    return np.arange(len(x))
+  if max_points < 1:
+    raise ValueError(f"max_points must be at least 1, got {max_points}")
+  if max_points < 3:
+    return np.array([0, len(x) - 1][:max_points], dtype=np.int64)
+  if method == Downsampling.MINMAX:
+    return minmax_indices(y, max_points)
+  return lttb_indices(x, y, max_points)
+
+def minmax_indices(y: np.ndarray, max_points: int) -> np.ndarray:
+  """The first and last value plus the min and max of (max_points - 2) // 2 equally sized buckets in between, only the first and last below 4 points."""
+  n = len(y)
+  buckets = (max_points - 2) // 2
+  if buckets < 1 or n < 3:
+    return np.array([0, n - 1][:n], dtype=np.int64)
+  starts = np.arange(buckets) * (n - 2) // buckets + 1
+  ends = np.append(starts[1:], n - 1)
+  # Buckets differ in size by at most one, pad the shorter ones by repeating their last value
+  width = int((ends - starts).max())
+  grid = np.minimum(starts[:, None] + np.arange(width), ends[:, None] - 1)
+  values = y[grid]
+  rows = np.arange(buckets)
+  return np.unique(np.concatenate(([0, n - 1], grid[rows, values.argmin(axis=1)], grid[rows, values.argmax(axis=1)])))
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+  """
+  Largest-Triangle-Three-Buckets (Steinarsson 2013): split the values between the first and the last into max_points - 2 buckets
+  and keep the value of each bucket that forms the largest triangle with the value kept from the previous bucket and the average of the next one.
+  Long series are reduced to the min and max of LTTB_PRESELECT_RATIO * max_points buckets first, so the sequential part stays O(max_points).
+  """
+  candidates = np.arange(len(x))
+  if len(x) > LTTB_PRESELECT_RATIO * max_points:
+    candidates = minmax_indices(y, LTTB_PRESELECT_RATIO * max_points)
+  cx = x[candidates].astype(np.float64)
+  cy = y[candidates].astype(np.float64)
+  m = len(candidates)
+  if m <= max_points:
+    return candidates
+  # Bucket i holds the candidates edges[i]:edges[i + 1], the first and the last candidate are buckets of their own
+  edges = np.arange(max_points - 1) * (m - 2) // (max_points - 2) + 1
+  counts = np.diff(edges)
+  mean_x = np.add.reduceat(cx[1:m - 1], edges[:-1] - 1) / counts
+  mean_y = np.add.reduceat(cy[1:m - 1], edges[:-1] - 1) / counts
+  next_x = np.append(mean_x[1:], cx[-1]).tolist()
+  next_y = np.append(mean_y[1:], cy[-1]).tolist()
+  xs, ys, bounds = cx.tolist(), cy.tolist(), edges.tolist()
+  selected = [0]
+  a = 0
+  for i in range(max_points - 2):
+    ax, ay, bx, by = xs[a], ys[a], next_x[i], next_y[i]
+    best = -1.0
+    for j in range(bounds[i], bounds[i + 1]):
+      area = abs((ax - bx) * (ys[j] - ay) - (ax - xs[j]) * (by - ay))
+      if area > best:
+        best, a = area, j
+    selected.append(a)
+  selected.append(m - 1)
+  return candidates[selected]
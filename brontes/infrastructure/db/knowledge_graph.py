@@ -1,6 +1,6 @@
 import os
 from typing import Optional, Dict
-from neo4j import GraphDatabase
+from neo4j import AsyncGraphDatabase, GraphDatabase
 from rdflib_neo4j import Neo4jStoreConfig, Neo4jStore, HANDLE_VOCAB_URI_STRATEGY
 from rdflib import Graph, Namespace
 
@@ -25,6 +25,8 @@ class KnowledgeGraph():
     neo4j_driver = GraphDatabase.driver(neo4j_uri, auth=(neo4j_user, neo4j_password), max_connection_lifetime=200)
     neo4j_driver.verify_connectivity()
     self.neo4j_driver = neo4j_driver
+    # For code running on an event loop (the API), connects lazily on first use
+    self.async_neo4j_driver = AsyncGraphDatabase.driver(neo4j_uri, auth=(neo4j_user, neo4j_password), max_connection_lifetime=200)
 
     # Create the necessary constraints
     self.create_constraints()
@@ -74,10 +76,21 @@ class KnowledgeGraph():
     except Exception as e:
       raise e
   
+  def create_async_session(self):
+    """Creates a session for the async neo4j driver: `async with kg.create_async_session() as session:`."""
+    try:
+      return self.async_neo4j_driver.session()
+    except Exception as e:
+      raise e
+
   def close(self):
     """Closes the neo4j driver connection."""
     self.neo4j_driver.close()
 
+  async def close_async(self):
+    """Closes the async neo4j driver connections, from the event loop they were used on."""
+    await self.async_neo4j_driver.close()
+
   def __del__(self):
     """Closes the neo4j driver connection when the object is deleted."""
     self.close()
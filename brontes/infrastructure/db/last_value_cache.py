@@ -0,0 +1,63 @@
+from datetime import datetime
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple
+import time
+
+from brontes.application.dtos.point_dto import PointReadingBatch, from_epoch_us
+
+# (ts, value), None when the timeseries has no reading
+LastValue = Optional[Tuple[datetime, float]]
+
+class LastValueCache:
+  """
+  Most recent reading of each timeseries, kept in memory in front of the latest_values table.
+  - entries are updated by the batches this process inserts and by reads of the latest_values table
+  - entries expire after ttl seconds so readings inserted by another process (eg. the ingest service) show up, timeseries without a reading are cached too
+  - a newer reading always replaces an older one, never the other way around
+  """
+  def __init__(self, ttl: float = 5.0, max_entries: int = 1_000_000):
+    self.ttl = ttl
+    self.max_entries = max_entries
+    self.values: Dict[str, Tuple[LastValue, float]] = {} # timeseriesid -> (last value, expires at)
+    self.lock = Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def __len__(self) -> int:
+    return len(self.values)
+
+  def get(self, timeseriesids: Iterable[str]) -> Tuple[Dict[str, LastValue], List[str]]:
+    """Returns the cached last values and the ids that have to be read from the database."""
+    now = time.monotonic()
+    found: Dict[str, LastValue] = {}
+    missing: List[str] = []
+    with self.lock:
+      for timeseriesid in timeseriesids:
+        entry = self.values.get(timeseriesid)
+        if entry is not None and entry[1] > now:
+          found[timeseriesid] = entry[0]
+        else:
+          missing.append(timeseriesid)
+      self.hits += len(found)
+      self.misses += len(missing)
+    return found, missing
+
+  def put(self, timeseriesid: str, value: LastValue) -> None:
+    expires = time.monotonic() + self.ttl
+    with self.lock:
+      self._put(timeseriesid, value, expires)
+
+  def _put(self, timeseriesid: str, value: LastValue, expires: float) -> None:
+    current = self.values.get(timeseriesid)
+    if current is not None and current[0] is not None and value is not None and current[0][0] > value[0]:
+      value = current[0]
+    if len(self.values) >= self.max_entries and timeseriesid not in self.values:
+      self.values.clear()
+    self.values[timeseriesid] = (value, expires)
+
+  def update(self, latest: PointReadingBatch) -> None:
+    """Store the readings of a batch holding at most one reading per timeseries (see PointReadingBatch.latest)."""
+    expires = time.monotonic() + self.ttl
+    with self.lock:
+      for ts, value, series in zip(latest.ts, latest.values, latest.series):
+        self._put(latest.timeseriesids[series], (from_epoch_us(ts), value), expires)
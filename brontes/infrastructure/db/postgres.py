@@ -1,14 +1,103 @@
 import os
-import psycopg
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
+from sqlalchemy import Engine, create_engine
 
 class Postgres():
-  def __init__(self, connection_string: str | None = None) -> None:
+  """
+  Pool of connections shared by the repositories, configured from the environment:
+  - POSTGRES_POOL_MIN_SIZE, POSTGRES_POOL_MAX_SIZE: connections kept open and the most that can be open (default 1 and 10)
+  - POSTGRES_POOL_TIMEOUT: seconds to wait for a free connection before failing (default 30)
+  - POSTGRES_STATEMENT_TIMEOUT: seconds a statement may run before the server cancels it, 0 to disable (default 60)
+  Connections are checked before they are handed out, broken ones are replaced.
+  Code running on an event loop (the API) uses the async pool with the same settings instead, opened with open_async on startup.
+  """
+  def __init__(
+    self,
+    connection_string: str | None = None,
+    min_size: int | None = None,
+    max_size: int | None = None,
+    timeout: float | None = None,
+    statement_timeout: float | None = None,
+  ) -> None:
     if connection_string is None:
       connection_string = os.environ['POSTGRES_CONNECTION_STRING']
+    self.connection_string = connection_string
+    self.min_size = min_size if min_size is not None else int(os.environ.get("POSTGRES_POOL_MIN_SIZE", 1))
+    self.max_size = max(max_size if max_size is not None else int(os.environ.get("POSTGRES_POOL_MAX_SIZE", 10)), self.min_size)
+    self.timeout = timeout if timeout is not None else float(os.environ.get("POSTGRES_POOL_TIMEOUT", 30))
+    self.statement_timeout = statement_timeout if statement_timeout is not None else float(os.environ.get("POSTGRES_STATEMENT_TIMEOUT", 60))
+    self.options = f"-c statement_timeout={int(self.statement_timeout * 1000)}"
+    self.engine = None
+    self.async_pool: AsyncConnectionPool | None = None
     try:
-      self.conn = psycopg.connect(connection_string)
+      self.pool = ConnectionPool(
+        connection_string,
+        min_size=self.min_size,
+        max_size=self.max_size,
+        timeout=self.timeout,
+        kwargs={"options": self.options},
+        check=ConnectionPool.check_connection,
+        name="brontes",
+        open=True,
+      )
+      self.pool.wait(self.timeout) # Fail at startup if the database can't be reached
     except Exception as e:
       raise e
 
-  def cursor(self):
-    return self.conn.cursor()
\ No newline at end of file
+  def connection(self):
+    """
+    Borrow a connection for one request or unit of work: `with postgres.connection() as conn:`.
+    The transaction is committed when the block exits (rolled back if it raises) and the connection goes back to the pool.
+    """
+    return self.pool.connection()
+
+  async def open_async(self) -> None:
+    """Open the async pool, it binds to the running event loop so this has to be called from it (eg. on app startup)."""
+    if self.async_pool is not None:
+      return
+    try:
+      self.async_pool = AsyncConnectionPool(
+        self.connection_string,
+        min_size=self.min_size,
+        max_size=self.max_size,
+        timeout=self.timeout,
+        kwargs={"options": self.options},
+        check=AsyncConnectionPool.check_connection,
+        name="brontes-async",
+        open=False,
+      )
+      await self.async_pool.open(wait=True, timeout=self.timeout)
+    except Exception as e:
+      raise e
+
+  def async_connection(self):
+    """Borrow a connection from the async pool: `async with postgres.async_connection() as conn:`, same transaction handling as connection."""
+    if self.async_pool is None:
+      raise RuntimeError("The async pool isn't open, call open_async first")
+    return self.async_pool.connection()
+
+  async def close_async(self) -> None:
+    if self.async_pool is not None:
+      await self.async_pool.close()
+      self.async_pool = None
+
+  def sqlalchemy_engine(self) -> Engine:
+    """SQLAlchemy engine with the same pool size, health checks and statement timeout, for libraries that need one (eg. PGVector)."""
+    if self.engine is None:
+      self.engine = create_engine(
+        self.connection_string,
+        pool_size=self.min_size,
+        max_overflow=self.max_size - self.min_size,
+        pool_timeout=self.timeout,
+        pool_pre_ping=True,
+        connect_args={"options": self.options},
+      )
+    return self.engine
+
+  def stats(self) -> dict:
+    return self.pool.get_stats()
+
+  def close(self) -> None:
+    self.pool.close()
+    if self.engine is not None:
+      self.engine.dispose()
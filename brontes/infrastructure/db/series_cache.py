@@ -0,0 +1,43 @@
+from threading import Lock
+from typing import Dict, Iterable, List, Tuple
+
+class SeriesCache:
+  """
+  Integer key of each timeseries id, kept in memory in front of the series table.
+  - the timeseries hypertable stores the integer series_id, the cache saves a lookup per batch on the ingest path and per request on the query path
+  - a series row is never renamed or deleted, so entries don't expire
+  - timeseries ids without a series row aren't cached, another process (eg. the ingest service) can add them at any time
+  """
+  def __init__(self, max_entries: int = 1_000_000):
+    self.max_entries = max_entries
+    self.ids: Dict[str, int] = {} # timeseriesid -> series_id
+    self.lock = Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def __len__(self) -> int:
+    return len(self.ids)
+
+  def get(self, timeseriesids: Iterable[str]) -> Tuple[Dict[str, int], List[str]]:
+    """Returns the cached series ids and the timeseries ids that have to be looked up in the series table."""
+    found: Dict[str, int] = {}
+    missing: List[str] = []
+    with self.lock:
+      for timeseriesid in timeseriesids:
+        series_id = self.ids.get(timeseriesid)
+        if series_id is not None:
+          found[timeseriesid] = series_id
+        else:
+          missing.append(timeseriesid)
+      self.hits += len(found)
+      self.misses += len(missing)
+    return found, missing
+
+  def put(self, rows: Iterable[Tuple[str, int]]) -> Dict[str, int]:
+    """Store (timeseriesid, series_id) rows read from the series table, returns them as a dict."""
+    rows = dict(rows)
+    with self.lock:
+      if len(self.ids) + len(rows) > self.max_entries:
+        self.ids.clear()
+      self.ids.update(rows)
+    return rows
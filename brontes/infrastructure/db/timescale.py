@@ -1,70 +1,953 @@
-from typing import List
-from dataclasses import asdict
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+import os
+import re
+import struct
+import numpy as np
+import psycopg
+import pyarrow as pa
 
-from brontes.application.dtos.point_dto import PointReading # TODO: not sure if dto should be here
+from brontes.application.dtos.point_dto import AlignedTimeseries, Downsampling, Fill, PointReading, PointReadingBatch, Resolution, from_epoch_us, to_datetime, to_epoch_us # TODO: not sure if dto should be here
 from .postgres import Postgres
+from .downsampling import downsample
+from .last_value_cache import LastValueCache
+from .series_cache import SeriesCache
+from .block_cache import BlockCache
+from .arrow_export import history_record_batch, history_schema
+
+# Continuous aggregates of the timeseries table: bucket width and the refresh policy (start offset, end offset, schedule interval)
+# Readings that arrive later than the start offset (eg. a long spool replay) are only picked up by a manual refresh_continuous_aggregate
+ROLLUPS = {
+  Resolution.MINUTE: (timedelta(minutes=1), timedelta(hours=2), timedelta(minutes=1), timedelta(minutes=1)),
+  Resolution.FIFTEEN_MINUTES: (timedelta(minutes=15), timedelta(hours=6), timedelta(minutes=15), timedelta(minutes=15)),
+  Resolution.HOUR: (timedelta(hours=1), timedelta(days=2), timedelta(hours=1), timedelta(hours=1)),
+  Resolution.DAY: (timedelta(days=1), timedelta(days=7), timedelta(days=1), timedelta(days=1)),
+}
+# Span of the blocks get_timeseries caches per timeseries and resolution, aligned to TIME_BUCKET_ORIGIN so they nest the rollup buckets
+HISTORY_BLOCKS = {
+  Resolution.RAW: timedelta(hours=6),
+  Resolution.MINUTE: timedelta(days=1),
+  Resolution.FIFTEEN_MINUTES: timedelta(weeks=1),
+  Resolution.HOUR: timedelta(weeks=4),
+  Resolution.DAY: timedelta(weeks=52),
+}
+TIME_BUCKET_ORIGIN = datetime(2000, 1, 3, tzinfo=timezone.utc) # Default origin of time_bucket, a Monday so week buckets start on Mondays
+DEFAULT_MAX_POINTS = 2000
+STREAM_CHUNK_ROWS = 10_000 # Rows fetched per round trip by stream_timeseries and the most it yields at once
+EXPORT_BATCH_ROWS = 100_000 # Rows per record batch of export_timeseries
+MAX_ALIGNED_BUCKETS = 100_000 # Buckets per timeseries (or group) get_aligned_timeseries and get_grouped_statistics return at most
+
+def parse_duration(value: str) -> timedelta:
+  """Parse a duration like 30m, 12h, 7d or 4w."""
+  match = re.fullmatch(r"\s*(\d+)\s*([mhdw])\s*", value)
+  if not match:
+    raise ValueError(f"Invalid duration {value}, expected a number followed by m, h, d or w")
+  unit = {"m": "minutes", "h": "hours", "d": "days", "w": "weeks"}[match.group(2)]
+  return timedelta(**{unit: int(match.group(1))})
+
+@dataclass
+class HypertableSettings:
+  """
+  Chunking, compression and retention of the timeseries hypertable, reconciled by Timescale.setup_db.
+  Compressed chunks are segmented by series_id and ordered by ts DESC, so a query for a few series only decompresses their segments.
+  """
+  chunk_interval: timedelta = field(default_factory=lambda: timedelta(days=1))
+  compress_after: Optional[timedelta] = field(default_factory=lambda: timedelta(days=7)) # None disables compression
+  retain_for: Optional[timedelta] = None # Drop raw chunks older than this, None keeps them forever. The rollups keep their data.
+
+  @classmethod
+  def from_environment(cls) -> "HypertableSettings":
+    """Read TIMESCALE_CHUNK_INTERVAL, TIMESCALE_COMPRESS_AFTER and TIMESCALE_RETAIN_FOR (eg. 1d, 7d, 52w, "none" to disable)."""
+    settings = cls()
+    for name, attribute in (("TIMESCALE_CHUNK_INTERVAL", "chunk_interval"), ("TIMESCALE_COMPRESS_AFTER", "compress_after"), ("TIMESCALE_RETAIN_FOR", "retain_for")):
+      value = os.environ.get(name)
+      if value:
+        setattr(settings, attribute, None if value.lower() == "none" else parse_duration(value))
+    if settings.chunk_interval is None:
+      raise ValueError("TIMESCALE_CHUNK_INTERVAL can't be disabled")
+    return settings
+
+def block_cache_from_environment() -> BlockCache:
+  """
+  History block cache of TIMESCALE_HISTORY_CACHE_MB (256 by default, 0 disables it), blocks are closed TIMESCALE_HISTORY_SETTLE after they end (1h by default) and kept for TIMESCALE_HISTORY_MAX_AGE (1d by default).
+  TIMESCALE_HISTORY_CACHE_DIR adds a disk tier of TIMESCALE_HISTORY_CACHE_DISK_MB (4096 by default).
+  """
+  cache = BlockCache(
+    max_bytes=int(os.environ.get("TIMESCALE_HISTORY_CACHE_MB", 256)) * 2**20,
+    directory=os.environ.get("TIMESCALE_HISTORY_CACHE_DIR") or None,
+    max_disk_bytes=int(os.environ.get("TIMESCALE_HISTORY_CACHE_DISK_MB", 4096)) * 2**20,
+  )
+  if os.environ.get("TIMESCALE_HISTORY_SETTLE"):
+    cache.settle = parse_duration(os.environ["TIMESCALE_HISTORY_SETTLE"])
+  if os.environ.get("TIMESCALE_HISTORY_MAX_AGE"):
+    cache.max_age = parse_duration(os.environ["TIMESCALE_HISTORY_MAX_AGE"])
+  return cache
 
 class Timescale:
-  def __init__(self, postgres: Postgres) -> None:
+  write_methods = ('copy', 'executemany')
+
+  def __init__(self, postgres: Postgres, write_method: str = 'copy', idempotent: bool = False, last_values: LastValueCache | None = None, hypertable: HypertableSettings | None = None, series: SeriesCache | None = None, blocks: BlockCache | None = None, setup: bool = True) -> None:
+    """
+    :param write_method: 'copy' (binary COPY) or 'executemany'
+    :param idempotent: Enforce one reading per (timeseriesid, ts). Inserts skip readings that are already stored instead of duplicating them.
+    :param last_values: Cache in front of the latest_values table, used by get_latest_values
+    :param series: Cache in front of the series table, which maps the timeseries ids to the integer series_id stored in the hypertable
+    :param hypertable: Chunk interval, compression and retention, read from the environment by default
+    :param blocks: Cache of the closed history blocks read by get_timeseries, configured from the environment by default
+    :param setup: Run setup_db, off when another process (eg. the ingest supervisor) has already set up the database
+    """
+    if write_method not in self.write_methods:
+      raise ValueError(f"Unknown write method {write_method}, expected one of {self.write_methods}")
+    hypertable = hypertable if hypertable is not None else HypertableSettings.from_environment()
+    max_rollup_window = max(start_offset for _, start_offset, _, _ in ROLLUPS.values())
+    if hypertable.retain_for is not None and hypertable.retain_for <= max_rollup_window:
+      # Otherwise the rollup refresh would see the dropped chunks as deleted data and empty its buckets
+      raise ValueError(f"retain_for must be longer than the rollup refresh window ({max_rollup_window})")
     self.postgres = postgres
     self.collection_name = 'timeseries'
-    self.setup_db()
+    self.write_method = write_method
+    self.idempotent = idempotent
+    self.hypertable = hypertable
+    self.last_values = last_values if last_values is not None else LastValueCache()
+    self.series = series if series is not None else SeriesCache()
+    self.blocks = blocks if blocks is not None else block_cache_from_environment()
+    if setup:
+      self.setup_db()
     
   def setup_db(self):
-    """Make sure the timescaledb extension is enabled, the table and indexes are created"""
+    """Make sure the timescaledb extension is enabled, the table and indexes are created. Concurrent setups wait for each other (transaction scoped advisory lock)."""
     try:
-      with self.postgres.cursor() as cur:
+      with self.postgres.connection() as conn, conn.cursor() as cur:
+        cur.execute('SET LOCAL statement_timeout = 0') # Backfills and compression changes on existing data can take a while
+        # The API and every ingest worker set up the database when they start, one at a time so the migrations run once
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext('brontes.setup_db'))")
+
         # Create timescaledb extension
         cur.execute('CREATE EXTENSION IF NOT EXISTS timescaledb') 
 
+        # Integer key of each timeseries id, the hypertable only stores the key
+        cur.execute('CREATE TABLE IF NOT EXISTS series (id INTEGER GENERATED ALWAYS AS IDENTITY PRIMARY KEY, timeseriesid TEXT NOT NULL UNIQUE)')
+
         # Check if timeseries table exists
         cur.execute(f'SELECT EXISTS (SELECT FROM pg_tables WHERE tablename = \'{self.collection_name}\')') 
         if not cur.fetchone()[0]: 
-          cur.execute(f'CREATE TABLE {self.collection_name} (ts timestamptz NOT NULL, value FLOAT NOT NULL, timeseriesid TEXT NOT NULL)') # Create timeseries table if it doesn't exist
-          cur.execute(f'SELECT create_hypertable(\'{self.collection_name}\', \'ts\')') # Create hypertable if it doesn't exist
-          cur.execute(f'CREATE INDEX {self.collection_name}_timeseriesid_ts_idx ON {self.collection_name} (timeseriesid, ts DESC)') # Create the timeseriesid index if it doesn't exist
-          self.postgres.conn.commit()
+          self.create_table(cur)
+        else:
+          self.migrate_to_series_ids(cur)
+
+        if self.idempotent:
+          self.create_unique_index(cur)
+
+        self.reconcile_hypertable(cur)
+
+        # Replay positions of the ingest spools, written in the same transaction as the readings
+        cur.execute('CREATE TABLE IF NOT EXISTS ingest_checkpoints (name TEXT PRIMARY KEY, segment BIGINT NOT NULL, position BIGINT NOT NULL, updated_at timestamptz NOT NULL DEFAULT NOW())')
+
+        # Most recent reading of each timeseries, upserted with every insert
+        cur.execute("SELECT EXISTS (SELECT FROM pg_tables WHERE tablename = 'latest_values')")
+        if not cur.fetchone()[0]:
+          cur.execute('CREATE TABLE latest_values (timeseriesid TEXT PRIMARY KEY, ts timestamptz NOT NULL, value FLOAT NOT NULL)')
+          cur.execute(f'INSERT INTO latest_values (timeseriesid, ts, value) SELECT DISTINCT ON (t.series_id) s.timeseriesid, t.ts, t.value FROM {self.collection_name} t JOIN series s ON s.id = t.series_id ORDER BY t.series_id, t.ts DESC')
+
+        created_rollups = self.create_rollups(cur)
+      self.refresh_rollups(created_rollups)
     except Exception as e:
       raise e
+
+  def create_table(self, cur: psycopg.Cursor) -> None:
+    """Create the timeseries hypertable and its (series_id, ts) index."""
+    cur.execute(f'CREATE TABLE {self.collection_name} (ts timestamptz NOT NULL, series_id INTEGER NOT NULL, value FLOAT NOT NULL)')
+    cur.execute(f'SELECT create_hypertable(\'{self.collection_name}\', \'ts\', chunk_time_interval => %s)', (self.hypertable.chunk_interval,))
+    cur.execute(f'CREATE INDEX {self.collection_name}_series_id_ts_idx ON {self.collection_name} (series_id, ts DESC)')
+
+  def migrate_to_series_ids(self, cur: psycopg.Cursor) -> None:
+    """
+    Rewrite a timeseries table that still stores the text timeseriesid of every reading to (ts, series_id, value).
+    The rollups are dropped and rebuilt from the new table, it all happens in the setup_db transaction so a failed migration leaves the old table as it was.
+    """
+    cur.execute("SELECT EXISTS (SELECT FROM information_schema.columns WHERE table_name = %s AND column_name = 'timeseriesid')", (self.collection_name,))
+    if not cur.fetchone()[0]:
+      return
+    legacy = f"{self.collection_name}_text_ids"
+    print(f"Migrating {self.collection_name} to integer series ids, every reading is rewritten")
+    for resolution in ROLLUPS:
+      cur.execute(f"DROP MATERIALIZED VIEW IF EXISTS {self.rollup_name(resolution)}") # Recreated on series_id by create_rollups
+    cur.execute(f"ALTER TABLE {self.collection_name} RENAME TO {legacy}")
+    cur.execute(f"INSERT INTO series (timeseriesid) SELECT DISTINCT timeseriesid FROM {legacy} ORDER BY 1 ON CONFLICT (timeseriesid) DO NOTHING")
+    self.create_table(cur)
+    cur.execute(f"INSERT INTO {self.collection_name} (ts, series_id, value) SELECT t.ts, s.id, t.value FROM {legacy} t JOIN series s USING (timeseriesid)")
+    print(f"Migrated {cur.rowcount} readings")
+    cur.execute(f"DROP TABLE {legacy}") # Its compression and retention jobs go with it, reconcile_hypertable adds them to the new table
+
+  def rollup_name(self, resolution: Resolution) -> str:
+    return f"{self.collection_name}_{resolution.value}"
+
+  def create_rollups(self, cur: psycopg.Cursor) -> List[Resolution]:
+    """Create the continuous aggregates that don't exist yet and their refresh policies. Returns the ones that were created."""
+    created = []
+    for resolution, (bucket, start_offset, end_offset, schedule_interval) in ROLLUPS.items():
+      view = self.rollup_name(resolution)
+      cur.execute("SELECT EXISTS (SELECT FROM timescaledb_information.continuous_aggregates WHERE view_name = %s)", (view,))
+      if cur.fetchone()[0]:
+        continue
+      # Real time aggregation (materialized_only = false) fills in the buckets the policy hasn't materialized yet from the raw readings
+      # TimescaleDB indexes the group by columns (series_id, bucket) of the materialization
+      cur.execute(f"""
+        CREATE MATERIALIZED VIEW {view} WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+        SELECT series_id, time_bucket(INTERVAL '{int(bucket.total_seconds())} seconds', ts) AS bucket, min(value) AS min, max(value) AS max, avg(value) AS avg, last(value, ts) AS last, count(*) AS count
+        FROM {self.collection_name} GROUP BY series_id, bucket
+        WITH NO DATA
+      """)
+      cur.execute(
+        "SELECT add_continuous_aggregate_policy(%s, start_offset => %s, end_offset => %s, schedule_interval => %s, if_not_exists => true)",
+        (view, start_offset, end_offset, schedule_interval)
+      )
+      created.append(resolution)
+    return created
+
+  def refresh_rollups(self, resolutions: List[Resolution]) -> None:
+    """Materialize the existing readings into newly created rollups. refresh_continuous_aggregate can't run inside a transaction."""
+    if not resolutions:
+      return
+    with self.postgres.connection() as conn:
+      conn.autocommit = True
+      try:
+        conn.execute("SET statement_timeout = 0")
+        for resolution in resolutions:
+          print(f"Materializing {self.rollup_name(resolution)}")
+          conn.execute("CALL refresh_continuous_aggregate(%s, NULL, NULL)", (self.rollup_name(resolution),))
+      finally:
+        conn.execute("RESET statement_timeout") # Back to the pool's timeout before the connection is returned
+        conn.autocommit = False
   
-  def get_timeseries(self, timeseriesIds: List[str], start_time: str, end_time: str) -> List[dict]:
-    """Fetch timeseries data given some ids and a start and end time. Times should use ISO format string."""
-    ids = ', '.join([f'\'{id}\'' for id in timeseriesIds])
-    query = f"SELECT * FROM timeseries WHERE timeseriesid IN ({ids}) AND ts >= %s AND ts <= %s ORDER BY ts ASC"
+  def reconcile_hypertable(self, cur: psycopg.Cursor) -> None:
+    """Bring the chunk interval, compression settings and policies of an existing hypertable in line with self.hypertable. Safe to run on every start."""
+    settings = self.hypertable
+    cur.execute("SELECT time_interval FROM timescaledb_information.dimensions WHERE hypertable_name = %s AND column_name = 'ts'", (self.collection_name,))
+    if cur.fetchone()[0] != settings.chunk_interval: # Only applies to chunks created from now on
+      print(f"Setting the {self.collection_name} chunk interval to {settings.chunk_interval}")
+      cur.execute("SELECT set_chunk_time_interval(%s, %s)", (self.collection_name, settings.chunk_interval))
+
+    if settings.compress_after is not None:
+      cur.execute("SELECT attname, segmentby_column_index, orderby_column_index, orderby_asc FROM timescaledb_information.compression_settings WHERE hypertable_name = %s", (self.collection_name,))
+      current = {(row[0], row[1], row[2], row[3]) for row in cur.fetchall()}
+      if current != {("series_id", 1, None, None), ("ts", None, 1, False)}:
+        print(f"Enabling compression on {self.collection_name}")
+        try:
+          with cur.connection.transaction(): # Savepoint, the settings can't change while chunks are compressed
+            cur.execute(f"ALTER TABLE {self.collection_name} SET (timescaledb.compress, timescaledb.compress_segmentby = 'series_id', timescaledb.compress_orderby = 'ts DESC')")
+        except psycopg.errors.FeatureNotSupported as e:
+          print(f"Keeping the compression settings of {self.collection_name}, decompress its chunks to change them: {e}")
+    self.reconcile_policy(cur, "policy_compression", "compress_after", settings.compress_after, "add_compression_policy", "remove_compression_policy")
+    self.reconcile_policy(cur, "policy_retention", "drop_after", settings.retain_for, "add_retention_policy", "remove_retention_policy")
+
+  def reconcile_policy(self, cur: psycopg.Cursor, proc_name: str, config_key: str, interval: Optional[timedelta], add: str, remove: str) -> None:
+    """Add, replace or remove a hypertable policy so its interval matches."""
+    cur.execute(
+      f"SELECT (config->>'{config_key}')::interval = %s::interval FROM timescaledb_information.jobs WHERE proc_name = %s AND hypertable_name = %s",
+      (interval, proc_name, self.collection_name)
+    )
+    row = cur.fetchone()
+    if row is not None and row[0]:
+      return
+    if row is not None:
+      print(f"Removing {proc_name} from {self.collection_name}")
+      cur.execute(f"SELECT {remove}(%s, if_exists => true)", (self.collection_name,))
+    if interval is not None:
+      print(f"Adding {proc_name} to {self.collection_name} ({config_key} {interval})")
+      cur.execute(f"SELECT {add}(%s, %s)", (self.collection_name, interval))
+
+  def create_unique_index(self, cur: psycopg.Cursor):
+    """Create the unique (series_id, ts) index used to ignore duplicate readings, removing existing duplicates first."""
+    cur.execute(f"SELECT EXISTS (SELECT FROM pg_indexes WHERE tablename = '{self.collection_name}' AND indexname = '{self.collection_name}_series_id_ts_key')")
+    if cur.fetchone()[0]:
+      return
+    # Chunks are separate tables so a row is identified by (tableoid, ctid)
+    cur.execute(f"""
+      DELETE FROM {self.collection_name} WHERE (tableoid, ctid) IN (
+        SELECT tableoid, ctid FROM (
+          SELECT tableoid, ctid, ROW_NUMBER() OVER (PARTITION BY series_id, ts ORDER BY ctid) AS row_number FROM {self.collection_name}
+        ) duplicates WHERE row_number > 1
+      )
+    """)
+    if cur.rowcount:
+      print(f"Removed {cur.rowcount} duplicate readings from {self.collection_name}")
+    cur.execute(f'CREATE UNIQUE INDEX {self.collection_name}_series_id_ts_key ON {self.collection_name} (series_id, ts)')
+
+  def get_timeseries(self, timeseriesIds: List[str], start_time: str, end_time: str, resolution: Resolution = Resolution.RAW, max_points: Optional[int] = None, downsampling: Downsampling = Downsampling.LTTB) -> List[dict]:
+    """
+    Fetch timeseries data given some ids and a start and end time. Times should use ISO format string.
+    With a rollup resolution each item of data is a PointRollup (value is the bucket average), Resolution.AUTO picks the finest resolution with at most max_points buckets per timeseries.
+    Timeseries with more than max_points values are downsampled to max_points (see downsampling.downsample). By default all the raw readings are returned.
+    The closed blocks of history are served from the block cache, only the rest of the range is queried (see CachedHistory).
+    """
+    history = self.cached_history(timeseriesIds, start_time, end_time, resolution, max_points, self.series_ids(timeseriesIds))
+    if history.fetch_from:
+      try:
+        with self.postgres.connection() as conn:
+          with conn.cursor(name="timeseries_history") as cur:
+            cur.execute(self.cached_history_query(history.resolution), history.params())
+            while rows := cur.fetchmany(STREAM_CHUNK_ROWS):
+              history.add(rows)
+      except Exception as e:
+        raise e
+    return history.records(timeseriesIds, max_points, downsampling)
+
+  async def get_timeseries_async(self, timeseriesIds: List[str], start_time: str, end_time: str, resolution: Resolution = Resolution.RAW, max_points: Optional[int] = None, downsampling: Downsampling = Downsampling.LTTB) -> List[dict]:
+    """get_timeseries on the async pool, for the event loop."""
+    history = self.cached_history(timeseriesIds, start_time, end_time, resolution, max_points, await self.series_ids_async(timeseriesIds))
+    if history.fetch_from:
+      try:
+        async with self.postgres.async_connection() as conn:
+          async with conn.cursor(name="timeseries_history") as cur:
+            await cur.execute(self.cached_history_query(history.resolution), history.params())
+            while rows := await cur.fetchmany(STREAM_CHUNK_ROWS):
+              history.add(rows)
+      except Exception as e:
+        raise e
+    return history.records(timeseriesIds, max_points, downsampling)
+
+  def cached_history(self, timeseriesIds: List[str], start_time: str, end_time: str, resolution: Resolution, max_points: Optional[int], series_ids: Dict[str, int]) -> "CachedHistory":
+    start, end = to_datetime(start_time), to_datetime(end_time)
+    if resolution == Resolution.AUTO:
+      resolution = select_resolution(end - start, max_points or DEFAULT_MAX_POINTS)
+    return CachedHistory(self.blocks, resolution, series_ids, start, end, datetime.now(timezone.utc))
+
+  def cached_history_query(self, resolution: Resolution) -> str:
+    """The query of the part of get_timeseries that isn't cached, each timeseries is read from its own start (see CachedHistory.params)."""
+    if resolution == Resolution.RAW:
+      source, columns, ts_column = self.collection_name, "t.ts, t.value, t.series_id", "ts"
+    else:
+      source, columns, ts_column = self.rollup_name(resolution), "t.bucket, t.avg, t.series_id, t.min, t.max, t.last, t.count", "bucket"
+    # The constant lower bound lets the planner exclude the chunks before the earliest start
+    return f"""
+      SELECT {columns} FROM {source} t JOIN unnest(%(series_ids)s::int[], %(starts)s::timestamptz[]) AS f(series_id, start) ON f.series_id = t.series_id
+      WHERE t.series_id = ANY(%(series_ids)s::int[]) AND t.{ts_column} >= %(start)s AND t.{ts_column} >= f.start AND t.{ts_column} < %(end)s
+      ORDER BY t.series_id, t.{ts_column}
+    """
+
+  def stream_timeseries(
+    self,
+    timeseriesIds: List[str],
+    start_time: str,
+    end_time: str,
+    resolution: Resolution = Resolution.RAW,
+    max_points: Optional[int] = None,
+    downsampling: Downsampling = Downsampling.LTTB,
+    chunk_size: int = STREAM_CHUNK_ROWS,
+  ) -> Iterator[Tuple[str, List[dict]]]:
+    """
+    Like get_timeseries but yields (timeseriesid, data) chunks, all chunks of a timeseries are consecutive and timeseries without data are skipped.
+    Rows are read in a single pass from a server side cursor ordered by (series_id, ts), the pooled connection is held until the stream is exhausted or closed.
+    Without downsampling (max_points None or Downsampling.NONE) at most chunk_size rows are held in memory, otherwise one timeseries at a time.
+    """
+    series_ids = self.series_ids(timeseriesIds)
+    start, end = to_datetime(start_time), to_datetime(end_time) # Read like get_timeseries reads them, not in the session timezone
+    query, grouper = self.history_query(start, end, resolution, max_points, downsampling, chunk_size, series_ids)
     try:
-      with self.postgres.cursor() as cur:
-        cur.execute(query, (start_time, end_time))
-        rows = cur.fetchall()
-        result = []
-        for id in timeseriesIds:
-          data = [asdict(PointReading(ts=row[0].isoformat(), value=row[1], timeseriesid=row[2])) for row in rows if row[2] == id]
-          result.append({'data': data, 'timeseriesid': id})
-        return result
+      with self.postgres.connection() as conn:
+        with conn.cursor(name="timeseries_history") as cur:
+          cur.execute(query, (list(series_ids.values()), start, end))
+          while rows := cur.fetchmany(chunk_size):
+            yield from grouper.add(rows)
+          yield from grouper.finish()
     except Exception as e:
       raise e
-    
-  def get_latest_values(self, timeseriesIds: List[str]) -> List[PointReading]:
+
+  async def stream_timeseries_async(
+    self,
+    timeseriesIds: List[str],
+    start_time: str,
+    end_time: str,
+    resolution: Resolution = Resolution.RAW,
+    max_points: Optional[int] = None,
+    downsampling: Downsampling = Downsampling.LTTB,
+    chunk_size: int = STREAM_CHUNK_ROWS,
+  ) -> AsyncIterator[Tuple[str, List[dict]]]:
+    """stream_timeseries on the async pool, for the event loop."""
+    series_ids = await self.series_ids_async(timeseriesIds)
+    start, end = to_datetime(start_time), to_datetime(end_time)
+    query, grouper = self.history_query(start, end, resolution, max_points, downsampling, chunk_size, series_ids)
+    try:
+      async with self.postgres.async_connection() as conn:
+        async with conn.cursor(name="timeseries_history") as cur:
+          await cur.execute(query, (list(series_ids.values()), start, end))
+          while rows := await cur.fetchmany(chunk_size):
+            for chunk in grouper.add(rows):
+              yield chunk
+          for chunk in grouper.finish():
+            yield chunk
+    except Exception as e:
+      raise e
+
+  def history_query(self, start: datetime, end: datetime, resolution: Resolution, max_points: Optional[int], downsampling: Downsampling, chunk_size: int, series_ids: Dict[str, int]) -> Tuple[str, "HistoryGrouper"]:
+    """The query of a history stream and the grouper for its rows, params are (series ids, start, end)."""
+    if resolution == Resolution.AUTO:
+      resolution = select_resolution(end - start, max_points or DEFAULT_MAX_POINTS)
+    # One statement text per resolution whatever the number of ids, the ids are always sent as a single int[] parameter
+    if resolution == Resolution.RAW:
+      query = f"SELECT ts, value, series_id FROM {self.collection_name} WHERE series_id = ANY(%s::int[]) AND ts >= %s AND ts <= %s ORDER BY series_id, ts"
+    else:
+      query = f"SELECT bucket, avg, series_id, min, max, last, count FROM {self.rollup_name(resolution)} WHERE series_id = ANY(%s::int[]) AND bucket >= %s AND bucket <= %s ORDER BY series_id, bucket"
+    return query, HistoryGrouper(resolution, max_points, downsampling, chunk_size, {series_id: timeseriesid for timeseriesid, series_id in series_ids.items()})
+
+  def get_aligned_timeseries(self, timeseriesIds: List[str], start_time: str, end_time: str, bucket: timedelta, fill: Fill = Fill.LOCF) -> AlignedTimeseries:
+    """
+    Average of each timeseries per bucket on a common grid from start_time to end_time, the gaps filled by time_bucket_gapfill with locf or interpolate.
+    Reads the coarsest rollup whose bucket divides the requested one and lines up with start_time and end_time (weighting the rollup averages by their count), the raw readings otherwise.
+    Filling starts from the last reading before start_time (and interpolation ends at the first one after end_time) so the edges are filled too.
+    Timeseries without a reading in the range stay empty.
+    """
+    if bucket <= timedelta(0):
+      raise ValueError("The bucket must be positive")
+    # The query gets the same timezone aware bounds the rollup was picked for, not strings the session timezone could read differently
+    start, end = to_datetime(start_time), to_datetime(end_time)
+    if (end - start) / bucket > MAX_ALIGNED_BUCKETS:
+      raise ValueError(f"More than {MAX_ALIGNED_BUCKETS} buckets, use a wider bucket or a shorter range")
+    series_ids = self.series_ids(timeseriesIds)
+    rows = []
+    if series_ids:
+      try:
+        with self.postgres.connection() as conn, conn.cursor() as cur:
+          cur.execute(self.aligned_query(bucket, fill, start, end), {'bucket': bucket, 'start': start, 'end': end, 'series_ids': list(series_ids.values())})
+          rows = cur.fetchall()
+      except Exception as e:
+        raise e
+    return aligned_timeseries(rows, list(dict.fromkeys(timeseriesIds)), series_ids)
+
+  def aligned_query(self, bucket: timedelta, fill: Fill, start: datetime, end: datetime) -> str:
+    """The gap filling query of get_aligned_timeseries, rows are (bucket start in epoch microseconds, series_id, value)."""
+    source, ts_column, average = self.collection_name, "ts", "avg(value)"
+    rollup = bucket_rollup(bucket, start, end)
+    if rollup is not None:
+      source, ts_column, average = self.rollup_name(rollup), "bucket", "sum(avg * count) / sum(count)"
+    previous = f"SELECT {{}} FROM {self.collection_name} p WHERE p.series_id = t.series_id AND p.ts < %(start)s ORDER BY p.ts DESC LIMIT 1"
+    following = f"SELECT (n.ts, n.value) FROM {self.collection_name} n WHERE n.series_id = t.series_id AND n.ts >= %(end)s ORDER BY n.ts LIMIT 1"
+    if fill == Fill.LOCF:
+      value = f"locf({average}, ({previous.format('p.value')}))"
+    elif fill == Fill.INTERPOLATE:
+      value = f"interpolate({average}, ({previous.format('(p.ts, p.value)')}), ({following}))"
+    else:
+      value = average
+    # time_bucket_gapfill and the fill functions have to be top level expressions, the conversion happens outside
+    return f"""
+      SELECT (extract(epoch FROM bucket) * 1000000)::bigint, series_id, value FROM (
+        SELECT time_bucket_gapfill(%(bucket)s::interval, t.{ts_column}, %(start)s::timestamptz, %(end)s::timestamptz) AS bucket, t.series_id, {value} AS value
+        FROM {source} t WHERE t.series_id = ANY(%(series_ids)s::int[]) AND t.{ts_column} >= %(start)s AND t.{ts_column} < %(end)s
+        GROUP BY 1, t.series_id
+      ) gapfilled
+    """
+
+  def get_grouped_statistics(self, groups: List[List[str]], start_time: str, end_time: str, bucket: timedelta, percentiles: Sequence[float] = ()) -> List[List[dict]]:
+    """
+    Statistics of the readings of each group of timeseries per bucket (see BucketStatistics), computed in a single grouped statement. Returns one list of buckets per group, buckets without readings are left out.
+    Percentiles are fractions (0.95 for the 95th), they need the raw readings. Without them the coarsest rollup whose bucket divides the requested one and lines up with start_time and end_time is read instead.
+    A timeseries can be in several groups.
+    """
+    if bucket <= timedelta(0):
+      raise ValueError("The bucket must be positive")
+    start, end = to_datetime(start_time), to_datetime(end_time) # Sent as they are, see get_aligned_timeseries
+    if (end - start) / bucket > MAX_ALIGNED_BUCKETS:
+      raise ValueError(f"More than {MAX_ALIGNED_BUCKETS} buckets, use a wider bucket or a shorter range")
+    if any(not 0 <= percentile <= 1 for percentile in percentiles):
+      raise ValueError("Percentiles must be between 0 and 1")
+    series_ids = self.series_ids(list(dict.fromkeys(timeseriesid for group in groups for timeseriesid in group)))
+    # (series_id, group) pairs, joined to the readings so each reading counts once per group it's in
+    members = [(series_ids[timeseriesid], position) for position, group in enumerate(groups) for timeseriesid in dict.fromkeys(group) if timeseriesid in series_ids]
+    rows = []
+    if members:
+      params = {'bucket': bucket, 'start': start, 'end': end, 'series_ids': [series_id for series_id, _ in members], 'groups': [position for _, position in members], 'percentiles': list(percentiles)}
+      try:
+        with self.postgres.connection() as conn, conn.cursor() as cur:
+          cur.execute(self.statistics_query(bucket, bool(percentiles), start, end), params)
+          rows = cur.fetchall()
+      except Exception as e:
+        raise e
+    return grouped_statistics(rows, len(groups), percentiles)
+
+  def statistics_query(self, bucket: timedelta, percentiles: bool, start: datetime, end: datetime) -> str:
+    """The query of get_grouped_statistics, rows are (bucket start in epoch microseconds, group, avg, min, max, count, percentiles or NULL)."""
+    rollup = None if percentiles else bucket_rollup(bucket, start, end)
+    if rollup is None:
+      source, ts_column = self.collection_name, "ts"
+      aggregates = "avg(t.value), min(t.value), max(t.value), count(*)"
+      aggregates += ", percentile_cont(%(percentiles)s::float8[]) WITHIN GROUP (ORDER BY t.value)" if percentiles else ", NULL"
+    else:
+      source, ts_column = self.rollup_name(rollup), "bucket"
+      aggregates = "sum(t.avg * t.count) / sum(t.count), min(t.min), max(t.max), sum(t.count)::bigint, NULL"
+    return f"""
+      SELECT (extract(epoch FROM time_bucket(%(bucket)s::interval, t.{ts_column})) * 1000000)::bigint, g.position, {aggregates}
+      FROM {source} t JOIN unnest(%(series_ids)s::int[], %(groups)s::int[]) AS g(series_id, position) ON g.series_id = t.series_id
+      WHERE t.series_id = ANY(%(series_ids)s::int[]) AND t.{ts_column} >= %(start)s AND t.{ts_column} < %(end)s
+      GROUP BY 1, 2 ORDER BY 2, 1
+    """
+
+  def export_timeseries(self, timeseriesIds: List[str], start_time: str, end_time: str, resolution: Resolution = Resolution.RAW, batch_rows: int = EXPORT_BATCH_ROWS) -> pa.RecordBatchReader:
     """
-    Get the most recent reading for a list of timeseriesIds. Limit to the last 30 minutes.
+    Readings (or the rollups of a resolution) of the timeseries as Arrow record batches of about batch_rows rows, ordered by timeseries and time. See arrow_export.history_schema for the columns.
+    The rows are read with a binary COPY and decoded with numpy straight into the columns, no Python object is created per row.
+    The batches are read as the reader is consumed, the pooled connection is held until it is exhausted.
     """
-    ids = ', '.join([f'\'{id}\'' for id in timeseriesIds])
-    query = f"SELECT DISTINCT ON (timeseriesid) * FROM timeseries WHERE timeseriesid IN ({ids}) AND ts >= NOW() - INTERVAL '30 minutes' ORDER BY timeseriesid, ts DESC"
+    if resolution == Resolution.AUTO:
+      raise ValueError("Exports need the raw readings or a rollup resolution, not auto")
+    schema = history_schema(rollup=resolution != Resolution.RAW)
+    # Read like get_timeseries reads them, not in the session timezone
+    start, end = to_datetime(start_time), to_datetime(end_time)
+    return pa.RecordBatchReader.from_batches(schema, self._export_batches(self.series_ids(timeseriesIds), start, end, resolution, schema, batch_rows))
+
+  def _export_batches(self, series_ids: Dict[str, int], start: datetime, end: datetime, resolution: Resolution, schema: pa.Schema, batch_rows: int) -> Iterator[pa.RecordBatch]:
+    if not series_ids:
+      return
+    if resolution == Resolution.RAW:
+      query = f"COPY (SELECT ts, series_id, value FROM {self.collection_name} WHERE series_id = ANY(%s::int[]) AND ts >= %s AND ts <= %s ORDER BY series_id, ts) TO STDOUT (FORMAT BINARY)"
+      decoder = CopyBinaryDecoder(COPY_ROW)
+    else:
+      query = f"COPY (SELECT bucket, series_id, avg, min, max, last, count FROM {self.rollup_name(resolution)} WHERE series_id = ANY(%s::int[]) AND bucket >= %s AND bucket <= %s ORDER BY series_id, bucket) TO STDOUT (FORMAT BINARY)"
+      decoder = CopyBinaryDecoder(COPY_ROLLUP_ROW)
+    # Index of each series id in the dictionary of the timeseriesid column
+    names = pa.array(list(series_ids), type=pa.string())
+    positions = np.zeros(max(series_ids.values()) + 1, dtype=np.int32)
+    positions[list(series_ids.values())] = np.arange(len(series_ids), dtype=np.int32)
+    pending, pending_rows = [], 0
     try:
-      with self.postgres.cursor() as cur:
-        cur.execute(query)
-        return [PointReading(ts=row[0].isoformat(), value=row[1], timeseriesid=row[2]) for row in cur.fetchall()]
+      with self.postgres.connection() as conn, conn.cursor() as cur:
+        with cur.copy(query, (list(series_ids.values()), start, end)) as copy:
+          for data in copy:
+            rows = decoder.feed(data)
+            if len(rows):
+              pending.append(rows)
+              pending_rows += len(rows)
+            if pending_rows >= batch_rows:
+              yield history_record_batch(schema, export_columns(np.concatenate(pending), positions), names)
+              pending, pending_rows = [], 0
+          decoder.finish()
     except Exception as e:
       raise e
-    
-  def insert_timeseries(self, data: List[PointReading]) -> None:
+    if pending:
+      yield history_record_batch(schema, export_columns(np.concatenate(pending), positions), names)
+
+  def series_ids(self, timeseriesIds: List[str]) -> Dict[str, int]:
+    """Series ids of the timeseries ids, from the series cache or the series table. Timeseries ids that have never been inserted are left out."""
+    found, missing = self.series.get(timeseriesIds)
+    if missing:
+      try:
+        with self.postgres.connection() as conn, conn.cursor() as cur:
+          cur.execute(SERIES_QUERY, (missing,), prepare=True)
+          found.update(self.series.put(cur.fetchall()))
+      except Exception as e:
+        raise e
+    return found
+
+  async def series_ids_async(self, timeseriesIds: List[str]) -> Dict[str, int]:
+    """series_ids on the async pool, for the event loop."""
+    found, missing = self.series.get(timeseriesIds)
+    if missing:
+      try:
+        async with self.postgres.async_connection() as conn, conn.cursor() as cur:
+          await cur.execute(SERIES_QUERY, (missing,), prepare=True)
+          found.update(self.series.put(await cur.fetchall()))
+      except Exception as e:
+        raise e
+    return found
+
+  def create_series(self, timeseriesIds: List[str]) -> Dict[str, int]:
+    """
+    Like series_ids but adds the series rows that don't exist yet.
+    They are committed on their own before the readings, so a rolled back insert never leaves the cache holding an id that isn't in the series table.
+    """
+    found, missing = self.series.get(timeseriesIds)
+    if missing:
+      try:
+        with self.postgres.connection() as conn, conn.cursor() as cur:
+          # Sorted so concurrent writers adding the same ids take the locks in the same order
+          cur.execute("INSERT INTO series (timeseriesid) SELECT unnest(%s::text[]) ORDER BY 1 ON CONFLICT (timeseriesid) DO NOTHING", (sorted(missing),))
+          cur.execute(SERIES_QUERY, (missing,), prepare=True)
+          found.update(self.series.put(cur.fetchall()))
+      except Exception as e:
+        raise e
+    return found
+
+  def get_latest_values(self, timeseriesIds: List[str], max_age: timedelta = timedelta(minutes=30)) -> List[PointReading]:
+    """
+    Get the most recent reading for a list of timeseriesIds. Limit to readings from the last 30 minutes (max_age).
+    Served from the last value cache, ids that aren't cached are read from the latest_values table.
+    """
+    found, missing = self.last_values.get(timeseriesIds)
+    if missing:
+      try:
+        with self.postgres.connection() as conn, conn.cursor() as cur:
+          cur.execute(LATEST_VALUES_QUERY, (missing,), prepare=True)
+          self.cache_latest_values(found, missing, cur.fetchall())
+      except Exception as e:
+        raise e
+    return fresh_latest_values(found, max_age)
+
+  async def get_latest_values_async(self, timeseriesIds: List[str], max_age: timedelta = timedelta(minutes=30)) -> List[PointReading]:
+    """get_latest_values on the async pool, for the event loop."""
+    found, missing = self.last_values.get(timeseriesIds)
+    if missing:
+      try:
+        async with self.postgres.async_connection() as conn, conn.cursor() as cur:
+          await cur.execute(LATEST_VALUES_QUERY, (missing,), prepare=True)
+          self.cache_latest_values(found, missing, await cur.fetchall())
+      except Exception as e:
+        raise e
+    return fresh_latest_values(found, max_age)
+
+  def cache_latest_values(self, found: dict, missing: List[str], rows: List[tuple]) -> None:
+    """Add the (timeseriesid, ts, value) rows read for the missing ids to found and to the cache, ids without a row are cached as None."""
+    rows = {row[0]: (row[1], row[2]) for row in rows}
+    for timeseriesid in missing:
+      found[timeseriesid] = rows.get(timeseriesid)
+      self.last_values.put(timeseriesid, found[timeseriesid])
+
+  def insert_timeseries(self, data: List[PointReading] | PointReadingBatch, checkpoint: Optional[Tuple[str, int, int]] = None) -> None:
     """
-    Insert a list of timeseries data into the timeseries table.
+    Insert a list (or columnar batch) of timeseries data into the timeseries table.
+
+    Uses a binary COPY by default. If the COPY is rejected by the server (eg. a connection pooler that doesn't support it) the batch is retried with executemany.
+    If a checkpoint (name, segment, position) is given it is stored in the same transaction as the data.
     """
-    query = "INSERT INTO timeseries (ts, value, timeseriesid) VALUES (%s, %s, %s)"
-    values = [(reading.ts, reading.value, reading.timeseriesid) for reading in data]
+    if isinstance(data, list):
+      data = PointReadingBatch.from_point_readings(data)
+    if not data and checkpoint is None:
+      return
+    latest = data.latest()
+    series_ids = self.batch_series_ids(data) if data else None
     try:
-      with self.postgres.cursor() as cur:
-        cur.executemany(query, values)
-        cur.execute('COMMIT')
+      with self.postgres.connection() as conn, conn.cursor() as cur:
+        if data and self.write_method == 'copy':
+          try:
+            self._insert_copy(cur, data, series_ids)
+          except psycopg.OperationalError as e:
+            raise e
+          except psycopg.Error as e:
+            print(f"COPY insert failed, falling back to executemany: {e}")
+            conn.rollback()
+            self._insert_executemany(cur, data, series_ids)
+        elif data:
+          self._insert_executemany(cur, data, series_ids)
+        if latest:
+          self._upsert_latest_values(cur, latest)
+        if checkpoint is not None:
+          cur.execute(
+            """INSERT INTO ingest_checkpoints (name, segment, position) VALUES (%s, %s, %s)
+               ON CONFLICT (name) DO UPDATE SET segment = EXCLUDED.segment, position = EXCLUDED.position, updated_at = NOW()""",
+            checkpoint
+          )
     except Exception as e:
-      raise e
\ No newline at end of file
+      raise e
+    self.last_values.update(latest)
+    if data:
+      self.discard_history(data, series_ids)
+
+  def discard_history(self, data: PointReadingBatch, series_ids: np.ndarray) -> None:
+    """Drop the cached history blocks that were already closed when the readings were written (eg. by a spool replay), at every resolution."""
+    closed = to_epoch_us(datetime.now(timezone.utc) - self.blocks.settle)
+    ts = np.frombuffer(data.ts, dtype=np.int64)
+    late = ts < closed # Only readings before then can be in a closed block
+    if not late.any():
+      return
+    ts = ts[late]
+    series = series_ids[np.frombuffer(data.series, dtype=np.int32)[late]]
+    origin = to_epoch_us(TIME_BUCKET_ORIGIN)
+    keys = []
+    for resolution, span in HISTORY_BLOCKS.items():
+      span_us = span // timedelta(microseconds=1)
+      blocks = np.unique(np.stack([series, ts - (ts - origin) % span_us]), axis=1)
+      keys.extend((int(series_id), resolution.value, from_epoch_us(int(block))) for series_id, block in blocks.T)
+    self.blocks.discard(keys)
+
+  def batch_series_ids(self, data: PointReadingBatch) -> np.ndarray:
+    """Series id of each entry of data.timeseriesids, so data.series indexes into it."""
+    series_ids = self.create_series(data.timeseriesids)
+    return np.array([series_ids[timeseriesid] for timeseriesid in data.timeseriesids], dtype=np.int32)
+
+  def _upsert_latest_values(self, cur: psycopg.Cursor, latest: PointReadingBatch) -> None:
+    """Move latest_values forward to the newest reading of each timeseries in the batch."""
+    rows = sorted(zip((latest.timeseriesids[series] for series in latest.series), latest.ts, latest.values)) # Lock rows in the same order in every writer
+    cur.execute(
+      """INSERT INTO latest_values (timeseriesid, ts, value)
+         SELECT * FROM unnest(%s::text[], %s::timestamptz[], %s::float8[])
+         ON CONFLICT (timeseriesid) DO UPDATE SET ts = EXCLUDED.ts, value = EXCLUDED.value WHERE latest_values.ts <= EXCLUDED.ts""",
+      ([row[0] for row in rows], [from_epoch_us(row[1]) for row in rows], [row[2] for row in rows])
+    )
+
+  def _insert_copy(self, cur: psycopg.Cursor, data: PointReadingBatch, series_ids: np.ndarray) -> None:
+    """
+    Stream the readings to the server with a binary COPY ... FROM STDIN, encoded straight from the batch columns.
+    COPY can't skip conflicting rows, so in idempotent mode the readings are copied to a staging table and merged from there.
+    """
+    table = self.collection_name
+    if self.idempotent:
+      table = f"{self.collection_name}_staging"
+      cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {table} (ts timestamptz NOT NULL, series_id INTEGER NOT NULL, value FLOAT NOT NULL) ON COMMIT DELETE ROWS")
+    with cur.copy(f"COPY {table} (ts, series_id, value) FROM STDIN (FORMAT BINARY)") as copy:
+      for chunk in encode_copy_binary(data, series_ids):
+        copy.write(chunk)
+    if self.idempotent:
+      cur.execute(f"INSERT INTO {self.collection_name} (ts, series_id, value) SELECT ts, series_id, value FROM {table} ON CONFLICT (series_id, ts) DO NOTHING")
+
+  def _insert_executemany(self, cur: psycopg.Cursor, data: PointReadingBatch, series_ids: np.ndarray) -> None:
+    query = f"INSERT INTO {self.collection_name} (ts, series_id, value) VALUES (%s, %s, %s)"
+    if self.idempotent:
+      query += " ON CONFLICT (series_id, ts) DO NOTHING"
+    cur.executemany(query, [(from_epoch_us(ts), int(series_ids[series]), value) for ts, value, series in zip(data.ts, data.values, data.series)])
+
+  def get_ingest_checkpoint(self, name: str) -> Optional[Tuple[int, int]]:
+    """Get the (segment, position) an ingest spool was last replayed up to."""
+    try:
+      with self.postgres.connection() as conn, conn.cursor() as cur:
+        cur.execute('SELECT segment, position FROM ingest_checkpoints WHERE name = %s', (name,))
+        row = cur.fetchone()
+      return (row[0], row[1]) if row else None
+    except Exception as e:
+      raise e
+
+# Prepared on first use on each pooled connection, later reads of any number of ids reuse them
+SERIES_QUERY = "SELECT timeseriesid, id FROM series WHERE timeseriesid = ANY(%s::text[])"
+LATEST_VALUES_QUERY = "SELECT timeseriesid, ts, value FROM latest_values WHERE timeseriesid = ANY(%s::text[])"
+
+def fresh_latest_values(found: dict, max_age: timedelta) -> List[PointReading]:
+  since = datetime.now(timezone.utc) - max_age
+  return [
+    PointReading(ts=value[0].isoformat(), value=value[1], timeseriesid=timeseriesid)
+    for timeseriesid, value in found.items() if value is not None and value[0] >= since
+  ]
+
+class HistoryGrouper:
+  """
+  Groups the rows of a history query, ordered by (series_id, ts), into (timeseriesid, data) chunks in a single pass.
+  Shared by the sync and async streams, which feed it the rows as they are fetched.
+  """
+  def __init__(self, resolution: Resolution, max_points: Optional[int], downsampling: Downsampling, chunk_size: int, names: Dict[int, str]):
+    self.resolution = resolution
+    self.names = names # series_id -> timeseriesid
+    self.max_points = max_points
+    self.downsampling = downsampling
+    self.chunk_size = chunk_size
+    self.whole_series = max_points is not None and downsampling != Downsampling.NONE # Downsampling needs all rows of a timeseries
+    self.current = None
+    self.rows = []
+
+  def add(self, rows: List[tuple]) -> List[Tuple[str, List[dict]]]:
+    chunks = []
+    for row in rows:
+      if row[2] != self.current:
+        if self.rows:
+          chunks.append(self.chunk(self.max_points, self.downsampling))
+        self.current, self.rows = row[2], []
+      self.rows.append(row)
+      if len(self.rows) >= self.chunk_size and not self.whole_series:
+        chunks.append(self.chunk())
+        self.rows = []
+    return chunks
+
+  def finish(self) -> List[Tuple[str, List[dict]]]:
+    chunks = [self.chunk(self.max_points, self.downsampling)] if self.rows else []
+    self.rows = []
+    return chunks
+
+  def chunk(self, max_points: Optional[int] = None, downsampling: Downsampling = Downsampling.NONE) -> Tuple[str, List[dict]]:
+    timeseriesid = self.names[self.current]
+    return timeseriesid, history_records(self.rows, self.resolution, timeseriesid, max_points, downsampling)
+
+class CachedHistory:
+  """
+  Reads a get_timeseries range block by block (see HISTORY_BLOCKS) around the block cache.
+  - the cached closed blocks from the start of the range are used as they are, the rest is queried from the first block that isn't cached
+  - the queried closed blocks are cached whole (the first and last ones can stick out of the range), empty ones too. An open block isn't widened, it's queried from the start of the range
+  Shared by the sync and async reads, which feed it the rows of cached_history_query.
+  """
+  def __init__(self, blocks: BlockCache, resolution: Resolution, series_ids: Dict[str, int], start: datetime, end: datetime, now: datetime):
+    self.blocks = blocks
+    self.resolution = resolution
+    self.series_ids = series_ids
+    self.span = HISTORY_BLOCKS[resolution]
+    self.start = start
+    self.end = end
+    self.closed = now - blocks.settle # Blocks that end by then are closed
+    self.cached: Dict[int, List[tuple]] = {}
+    self.fetch_from: Dict[int, datetime] = {} # series_id -> start of the first block that has to be queried, or of the range if that block is open
+    for series_id in dict.fromkeys(series_ids.values()):
+      rows, block = [], floor_to(start, self.span)
+      while block <= end and block + self.span <= self.closed:
+        cached = blocks.get(self.key(series_id, block))
+        if cached is None:
+          break
+        rows.extend(cached)
+        block += self.span
+      self.cached[series_id] = rows
+      if block <= end:
+        self.fetch_from[series_id] = block if block + self.span <= self.closed else max(start, block)
+    last = floor_to(end, self.span) + self.span
+    # The last block is read whole if it's closed so it can be cached, otherwise up to the end of the range (timestamps have microsecond precision)
+    self.fetch_to = last if last <= self.closed else end + timedelta(microseconds=1)
+    self.fetched: Dict[int, List[tuple]] = {series_id: [] for series_id in self.fetch_from}
+
+  def key(self, series_id: int, block: datetime) -> tuple:
+    return (series_id, self.resolution.value, block)
+
+  def params(self) -> dict:
+    return {'series_ids': list(self.fetch_from), 'starts': list(self.fetch_from.values()), 'start': min(self.fetch_from.values()), 'end': self.fetch_to}
+
+  def add(self, rows: List[tuple]) -> None:
+    for row in rows:
+      self.fetched[row[2]].append(row)
+
+  def rows(self, series_id: int) -> List[tuple]:
+    """The rows of a timeseries in the range, caching the closed blocks that were queried."""
+    rows = self.cached[series_id]
+    if series_id in self.fetch_from:
+      fetched = self.fetched[series_id]
+      ts = [row[0] for row in fetched]
+      block = self.fetch_from[series_id] # Only closed blocks are queried whole, an open one doesn't get past the condition
+      while block + self.span <= min(self.closed, self.fetch_to):
+        self.blocks.put(self.key(series_id, block), tuple(fetched[bisect_left(ts, block):bisect_left(ts, block + self.span)]))
+        block += self.span
+      rows = rows + fetched
+    ts = [row[0] for row in rows]
+    return rows[bisect_left(ts, self.start):bisect_right(ts, self.end)]
+
+  def records(self, timeseriesIds: List[str], max_points: Optional[int], downsampling: Downsampling) -> List[dict]:
+    """The get_timeseries result, one item per timeseries id."""
+    data = {timeseriesid: history_records(self.rows(series_id), self.resolution, timeseriesid, max_points, downsampling) for timeseriesid, series_id in self.series_ids.items()}
+    return [{'data': data.get(id, []), 'timeseriesid': id} for id in timeseriesIds]
+
+def floor_to(ts: datetime, span: timedelta) -> datetime:
+  """Start of the span long block ts is in, in UTC."""
+  return (ts - (ts - TIME_BUCKET_ORIGIN) % span).astimezone(timezone.utc)
+
+def history_records(rows: List[tuple], resolution: Resolution, timeseriesid: str, max_points: Optional[int] = None, downsampling: Downsampling = Downsampling.NONE) -> List[dict]:
+  """Turn (ts, value, series_id[, min, max, last, count]) rows of one timeseries into PointReading or PointRollup dicts, downsampled to max_points."""
+  if max_points is not None and len(rows) > max_points and downsampling != Downsampling.NONE:
+    x = np.fromiter((row[0].timestamp() for row in rows), dtype=np.float64, count=len(rows))
+    y = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+    rows = [rows[i] for i in downsample(x, y, max_points, downsampling)]
+  # Same dicts as asdict(PointReading(...)) and asdict(PointRollup(...)), built directly since asdict deep copies every field
+  if resolution == Resolution.RAW:
+    return [{'ts': row[0].isoformat(), 'value': row[1], 'timeseriesid': timeseriesid} for row in rows]
+  return [{'ts': row[0].isoformat(), 'value': row[1], 'timeseriesid': timeseriesid, 'min': row[3], 'max': row[4], 'last': row[5], 'count': row[6]} for row in rows]
+
+def select_resolution(span: timedelta, max_points: int) -> Resolution:
+  """The finest resolution with at most max_points buckets in span. Raw readings are used when the span has at most max_points minutes."""
+  for resolution in (Resolution.MINUTE, Resolution.FIFTEEN_MINUTES, Resolution.HOUR, Resolution.DAY):
+    if span / ROLLUPS[resolution][0] <= max_points:
+      return Resolution.RAW if resolution == Resolution.MINUTE else resolution
+  return Resolution.DAY
+
+# Binary COPY format, see https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4
+COPY_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+COPY_BINARY_TRAILER = struct.pack('>h', -1)
+POSTGRES_EPOCH_US = 946_684_800_000_000 # timestamptz counts microseconds from 2000-01-01
+# Each (ts, series_id, value) tuple is fixed width
+COPY_ROW = np.dtype([('fields', '>i2'), ('ts_length', '>i4'), ('ts', '>i8'), ('series_id_length', '>i4'), ('series_id', '>i4'), ('value_length', '>i4'), ('value', '>f8')])
+# So are the (bucket, series_id, avg, min, max, last, count) tuples of a rollup, none of them can be NULL
+COPY_ROLLUP_ROW = np.dtype(
+  [('fields', '>i2'), ('ts_length', '>i4'), ('ts', '>i8'), ('series_id_length', '>i4'), ('series_id', '>i4')]
+  + [field for name in ('value', 'min', 'max', 'last') for field in ((f'{name}_length', '>i4'), (name, '>f8'))]
+  + [('count_length', '>i4'), ('count', '>i8')]
+)
+
+def encode_copy_binary(batch: PointReadingBatch, series_ids: np.ndarray, chunk_rows: int = 65_536) -> Iterator[bytes]:
+  """
+  Encode a batch as a binary COPY stream of (ts, series_id, value) tuples, laid out with numpy.
+  series_ids holds the series id of each entry of batch.timeseriesids.
+  """
+  ts = np.frombuffer(batch.ts, dtype=np.int64)
+  values = np.frombuffer(batch.values, dtype=np.float64)
+  series = np.frombuffer(batch.series, dtype=np.int32)
+  yield COPY_BINARY_HEADER
+  for start in range(0, len(batch), chunk_rows):
+    rows = np.empty(min(chunk_rows, len(batch) - start), dtype=COPY_ROW)
+    rows['fields'] = 3
+    rows['ts_length'] = 8
+    rows['ts'] = ts[start:start + chunk_rows] - POSTGRES_EPOCH_US
+    rows['series_id_length'] = 4
+    rows['series_id'] = series_ids[series[start:start + chunk_rows]]
+    rows['value_length'] = 8
+    rows['value'] = values[start:start + chunk_rows]
+    yield rows.tobytes()
+  yield COPY_BINARY_TRAILER
+
+def bucket_rollup(bucket: timedelta, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Optional[Resolution]:
+  """
+  The coarsest rollup whose bucket divides the requested one, None if the raw readings have to be read.
+  With start and end, the rollup buckets also have to line up with them, otherwise the partial rollup buckets at the edges would be dropped or counted whole.
+  """
+  for resolution in (Resolution.DAY, Resolution.HOUR, Resolution.FIFTEEN_MINUTES, Resolution.MINUTE):
+    span = ROLLUPS[resolution][0]
+    if bucket % span != timedelta(0): # Rollup buckets share the default time_bucket origin, so they nest in the requested ones
+      continue
+    if all(ts is None or floor_to(ts, span) == ts for ts in (start, end)):
+      return resolution
+  return None
+
+def grouped_statistics(rows: List[tuple], groups: int, percentiles: Sequence[float]) -> List[List[dict]]:
+  """Split the rows of the statistics query by group, as BucketStatistics dicts (built directly like history_records does)."""
+  names = [percentile_name(percentile) for percentile in percentiles]
+  data: List[List[dict]] = [[] for _ in range(groups)]
+  for row in rows:
+    data[row[1]].append({'ts': from_epoch_us(row[0]).isoformat(), 'avg': row[2], 'min': row[3], 'max': row[4], 'count': row[5], 'percentiles': dict(zip(names, row[6] or ()))})
+  return data
+
+def percentile_name(percentile: float) -> str:
+  """p50 for 0.5, p99.9 for 0.999"""
+  return f"p{round(percentile * 100, 6):g}"
+
+def aligned_timeseries(rows: List[tuple], timeseriesIds: List[str], series_ids: Dict[str, int]) -> AlignedTimeseries:
+  """Lay the (bucket epoch microseconds, series_id, value) rows of the aligned query out as a (bucket, timeseries) matrix, columns in the order of timeseriesIds."""
+  buckets = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+  series = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+  values = np.fromiter((np.nan if row[2] is None else row[2] for row in rows), dtype=np.float64, count=len(rows))
+  grid, bucket_index = np.unique(buckets, return_inverse=True)
+  columns = {series_ids[timeseriesid]: column for column, timeseriesid in enumerate(timeseriesIds) if timeseriesid in series_ids}
+  matrix = np.full((len(grid), len(timeseriesIds)), np.nan)
+  matrix[bucket_index, [columns[series_id] for series_id in series]] = values
+  return AlignedTimeseries(ts=grid.astype('datetime64[us]'), timeseriesids=timeseriesIds, values=matrix)
+
+class CopyBinaryDecoder:
+  """
+  Decodes a binary COPY ... TO STDOUT stream of fixed width tuples (see COPY_ROW) into numpy record arrays.
+  The stream can be fed in chunks of any size, a tuple split across chunks is decoded once its last chunk arrives.
+  """
+  def __init__(self, dtype: np.dtype):
+    self.dtype = dtype
+    self.fields = sum(1 for name in dtype.names if name != 'fields' and not name.endswith('_length'))
+    self.buffer = b""
+    self.header_read = False
+
+  def feed(self, data: bytes) -> np.ndarray:
+    self.buffer += data
+    if not self.header_read:
+      if len(self.buffer) < len(COPY_BINARY_HEADER):
+        return np.empty(0, dtype=self.dtype)
+      if not self.buffer.startswith(COPY_BINARY_HEADER[:11]):
+        raise ValueError("Not a binary COPY stream")
+      header_size = len(COPY_BINARY_HEADER) + struct.unpack_from('>i', self.buffer, 15)[0] # Skip the header extension
+      if len(self.buffer) < header_size:
+        return np.empty(0, dtype=self.dtype)
+      self.buffer = self.buffer[header_size:]
+      self.header_read = True
+    count = len(self.buffer) // self.dtype.itemsize # The trailer is shorter than a tuple
+    rows = np.frombuffer(self.buffer, dtype=self.dtype, count=count)
+    if (rows['fields'] != self.fields).any():
+      raise ValueError(f"Expected tuples of {self.fields} fields in the COPY stream")
+    self.buffer = self.buffer[count * self.dtype.itemsize:]
+    return rows
+
+  def finish(self) -> None:
+    if not self.header_read or self.buffer != COPY_BINARY_TRAILER:
+      raise ValueError("Truncated binary COPY stream")
+
+def export_columns(rows: np.ndarray, positions: np.ndarray) -> Dict[str, np.ndarray]:
+  """Native columns for arrow_export.history_record_batch from decoded COPY tuples, positions maps a series id to its index in the timeseriesid dictionary."""
+  columns = {'ts': rows['ts'].astype(np.int64) + POSTGRES_EPOCH_US, 'timeseriesid': positions[rows['series_id']]}
+  for name in ('value', 'min', 'max', 'last'):
+    if name in rows.dtype.names:
+      columns[name] = rows[name].astype(np.float64)
+  if 'count' in rows.dtype.names:
+    columns['count'] = rows['count'].astype(np.int64)
+  return columns
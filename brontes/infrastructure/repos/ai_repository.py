@@ -1,6 +1,43 @@
+from typing import List, Sequence
 from brontes.infrastructure import Postgres, KnowledgeGraph
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage
 from langchain_postgres import PostgresChatMessageHistory
 
+class PooledChatMessageHistory(BaseChatMessageHistory):
+  """PostgresChatMessageHistory that borrows a pooled connection for each operation instead of holding one for the whole chat, the a* methods use the async pool."""
+  def __init__(self, postgres: Postgres, table_name: str, session_id: str):
+    self.postgres = postgres
+    self.table_name = table_name
+    self.session_id = session_id
+
+  @property
+  def messages(self) -> List[BaseMessage]:
+    with self.postgres.connection() as conn:
+      return PostgresChatMessageHistory(self.table_name, self.session_id, sync_connection=conn).messages
+
+  def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+    with self.postgres.connection() as conn:
+      PostgresChatMessageHistory(self.table_name, self.session_id, sync_connection=conn).add_messages(messages)
+
+  def clear(self) -> None:
+    with self.postgres.connection() as conn:
+      PostgresChatMessageHistory(self.table_name, self.session_id, sync_connection=conn).clear()
+
+  async def aget_messages(self) -> List[BaseMessage]:
+    async with self.postgres.async_connection() as conn:
+      return await PostgresChatMessageHistory(self.table_name, self.session_id, async_connection=conn).aget_messages()
+
+  async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+    async with self.postgres.async_connection() as conn:
+      await PostgresChatMessageHistory(self.table_name, self.session_id, async_connection=conn).aadd_messages(messages)
+
+  async def aclear(self) -> None:
+    async with self.postgres.async_connection() as conn:
+      await PostgresChatMessageHistory(self.table_name, self.session_id, async_connection=conn).aclear()
+
+CHAT_SESSION_QUERY = "MATCH (u:User {email: $email}) MERGE (chat_session:ChatSession {id: $session_id}) MERGE (u)-[:hasChatSession]->(chat_session) RETURN u, chat_session"
+
 class AIRepository:
   """This class is responsible for managing any AI related data storage and retrieval."""
   def __init__(self, postgres: Postgres, kg: KnowledgeGraph):
@@ -9,25 +46,31 @@ class AIRepository:
 
     # Create the table schema (only needs to be done once)
     self.chat_history_table_name = "chat_history"
-    PostgresChatMessageHistory.create_tables(postgres.conn, self.chat_history_table_name)
+    with postgres.connection() as conn:
+      PostgresChatMessageHistory.create_tables(conn, self.chat_history_table_name)
 
   def chat_history_client(self, user_email: str, session_id: str):
     """Get the chat history client for the given session ID. If the session ID does not exist, a new chat history client will be created."""
     with self.kg.create_session() as session:
-      data = session.run("MATCH (u:User {email: $email}) MERGE (chat_session:ChatSession {id: $session_id}) MERGE (u)-[:hasChatSession]->(chat_session) RETURN u, chat_session", email=user_email, session_id=session_id).data()
+      data = session.run(CHAT_SESSION_QUERY, email=user_email, session_id=session_id).data()
       if not data:
         raise ValueError("Error storing user session ID")
-    return PostgresChatMessageHistory(
-        self.chat_history_table_name,
-        session_id,
-        sync_connection=self.postgres.conn
-    )
+    return PooledChatMessageHistory(self.postgres, self.chat_history_table_name, session_id)
+
+  async def chat_history_client_async(self, user_email: str, session_id: str):
+    """chat_history_client on the async neo4j driver, for the event loop."""
+    async with self.kg.create_async_session() as session:
+      result = await session.run(CHAT_SESSION_QUERY, email=user_email, session_id=session_id)
+      if not await result.data():
+        raise ValueError("Error storing user session ID")
+    return PooledChatMessageHistory(self.postgres, self.chat_history_table_name, session_id)
   
   def get_chat_sessions(self, user_email: str):
     """Get all chat sessions for the given user."""
     with self.kg.create_session() as session:
       result = session.run("MATCH (u:User {email: $email})-[:hasChatSession]->(chat_session:ChatSession) RETURN chat_session", email=user_email).data()
-      chat_sessions = []
+    chat_sessions = []
+    with self.postgres.connection() as conn:
       for record in result:
         chat_session = {
           "session_id": record['chat_session']['id'],
@@ -36,8 +79,8 @@ class AIRepository:
         chat_messages = PostgresChatMessageHistory(
           self.chat_history_table_name,
           record['chat_session']['id'],
-          sync_connection=self.postgres.conn
+          sync_connection=conn
         ).messages
         chat_session["messages"] = [message.dict() for message in chat_messages]
         chat_sessions.append(chat_session)
-      return chat_sessions
\ No newline at end of file
+    return chat_sessions
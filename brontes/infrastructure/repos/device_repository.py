@@ -41,6 +41,9 @@ class DeviceRepository:
               object_index=point_data.get('object_index'),
               object_units=point_data.get('object_units'),
               collect_enabled=point_data.get('collect_enabled'),
+              compression_mode=point_data.get('compression_mode'),
+              compression_deviation=point_data.get('compression_deviation'),
+              compression_max_silence=point_data.get('compression_max_silence'),
               object_description=point_data.get('object_description'),
               mqtt_topic=point_data.get('mqtt_topic'),
             ) 
@@ -76,6 +79,9 @@ class DeviceRepository:
             object_index=point_data.get('object_index'),
             object_units=point_data.get('object_units'),
             collect_enabled=point_data.get('collect_enabled'),
+            compression_mode=point_data.get('compression_mode'),
+            compression_deviation=point_data.get('compression_deviation'),
+            compression_max_silence=point_data.get('compression_max_silence'),
             object_description=point_data.get('object_description'),
             mqtt_topic=point_data.get('mqtt_topic'),
           ) for point_data in points_data
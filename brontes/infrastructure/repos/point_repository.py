@@ -1,8 +1,11 @@
 from collections import OrderedDict
 from dataclasses import asdict
-from typing import List
+from datetime import timedelta
+from typing import AsyncIterator, List, Optional, Sequence, Tuple
+import pyarrow as pa
 
 from brontes.infrastructure import KnowledgeGraph, Timescale
+from brontes.application.dtos.point_dto import AlignedTimeseries, Downsampling, Fill, Resolution
 from brontes.domain.models import Point, BrickClass, Device
 
 class PointRepository:
@@ -35,6 +38,9 @@ class PointRepository:
             object_units=record['p'].get('object_units'),
             object_index=record['p'].get('object_index'),
             collect_enabled=record['p'].get('collect_enabled'),
+            compression_mode=record['p'].get('compression_mode'),
+            compression_deviation=record['p'].get('compression_deviation'),
+            compression_max_silence=record['p'].get('compression_max_silence'),
             object_description=record['p'].get('object_description'),
             mqtt_topic=record['p'].get('mqtt_topic'),
           )
@@ -77,6 +83,9 @@ class PointRepository:
           object_index=data[0]['p'].get('object_index'),
           object_units=data[0]['p'].get('object_units'),
           collect_enabled=data[0]['p'].get('collect_enabled'),
+          compression_mode=data[0]['p'].get('compression_mode'),
+          compression_deviation=data[0]['p'].get('compression_deviation'),
+          compression_max_silence=data[0]['p'].get('compression_max_silence'),
           object_description=data[0]['p'].get('object_description'),
           mqtt_topic=data[0]['p'].get('mqtt_topic'),
         )
@@ -105,6 +114,7 @@ class PointRepository:
       MERGE (d:Device:Resource {uri: $device_uri})
         ON CREATE SET d = $device
       CREATE (p:Point:Resource $point) 
+      SET p.updated_at = timestamp()
       MERGE (p)-[:objectOf]->(d)
     """
     if brick_class_uri:
@@ -122,6 +132,9 @@ class PointRepository:
             object_index=result['p'].get('object_index'),
             object_units=result['p'].get('object_units'),
             collect_enabled=result['p'].get('collect_enabled'),
+            compression_mode=result['p'].get('compression_mode'),
+            compression_deviation=result['p'].get('compression_deviation'),
+            compression_max_silence=result['p'].get('compression_max_silence'),
             object_description=result['p'].get('object_description'),
             mqtt_topic=result['p'].get('mqtt_topic'),
           )
@@ -141,7 +154,7 @@ class PointRepository:
       with self.kg.create_session() as session:
         # Update point properties
         if updates:
-          update_props_query = "MATCH (p:Point {uri: $point_uri}) SET "
+          update_props_query = "MATCH (p:Point {uri: $point_uri}) SET p.updated_at = timestamp(), "
           update_props_query += ", ".join(f"p.{k} = ${k}" for k in updates.keys())
           session.run(update_props_query, point_uri=point_uri, **updates)
 
@@ -159,48 +172,121 @@ class PointRepository:
     except Exception as e:
       raise e
 
-  def points_history(self, start_time: str, end_time: str, point_uris: list[str]):
-    query = "MATCH (p:Point) WHERE p.uri in $point_uris RETURN p"
+  def get_ingest_points(self, updated_since: int | None = None) -> Tuple[List[Point], int]:
+    """
+    Get the points ingest needs to resolve incoming readings, optionally only the ones updated since a previous call.
+    Returns the points and the graph's clock (epoch ms) at the time of the query, pass it as updated_since on the next call.
+    """
+    query = "MATCH (p:Point) WHERE p.timeseriesId IS NOT NULL"
+    if updated_since is not None:
+      query += " AND p.updated_at >= $updated_since"
+    query += " RETURN p"
     try:
       with self.kg.create_session() as session:
-        result = session.run(query, point_uris=point_uris)
+        now = session.run("RETURN timestamp() AS now").single()['now']
+        result = session.run(query, updated_since=updated_since)
         points = [
           Point(
             uri=record['p']['uri'],
             timeseriesId=record['p']['timeseriesId'],
-            object_name=record['p']['object_name'],
-            object_type=record['p'].get('object_type'),
-            object_index=record['p'].get('object_index'),
-            object_units=record['p'].get('object_units'),
+            object_name=record['p'].get('object_name'),
             collect_enabled=record['p'].get('collect_enabled'),
-            object_description=record['p'].get('object_description'),
+            compression_mode=record['p'].get('compression_mode'),
+            compression_deviation=record['p'].get('compression_deviation'),
+            compression_max_silence=record['p'].get('compression_max_silence'),
             mqtt_topic=record['p'].get('mqtt_topic'),
           ) for record in result.data()
         ]
+        return points, now
+    except Exception as e:
+      raise e
+
+  def points_history(self, start_time: str, end_time: str, point_uris: list[str], resolution: Resolution = Resolution.RAW, max_points: Optional[int] = None, downsampling: Downsampling = Downsampling.LTTB):
+    """
+    History of the points grouped by unit, all the raw readings by default.
+    With Resolution.AUTO each point gets at most max_points values, read from the finest continuous aggregate that fits and downsampled with LTTB if there are still more.
+    """
+    try:
+      with self.kg.create_session() as session:
+        points = history_points(session.run(HISTORY_POINTS_QUERY, point_uris=point_uris).data())
+      data = self.ts.get_timeseries([point['timeseriesId'] for point in points], start_time, end_time, resolution=resolution, max_points=max_points, downsampling=downsampling)
+    except Exception as e:
+      raise e
+    return group_history_by_unit(points, data)
 
-      points = [asdict(point) for point in points]
-      ids = []
-      for point in points: 
-        point.pop('embedding', None)
-        ids.append(point['timeseriesId'])
-
-      data = self.ts.get_timeseries(ids, start_time, end_time)
-      data_dict = {item['timeseriesid']: item['data'] for item in data}
-
-      for point in points:
-        point['data'] = data_dict.get(point['timeseriesId'], [])
-
-      # Group points by object_units
-      grouped_points = {}
-      for point in points:
-        object_unit = point['object_units']
-        if object_unit not in grouped_points:
-          grouped_points[object_unit] = []
-        grouped_points[object_unit].append(point)
+  async def points_history_async(self, start_time: str, end_time: str, point_uris: list[str], resolution: Resolution = Resolution.RAW, max_points: Optional[int] = None, downsampling: Downsampling = Downsampling.LTTB):
+    """points_history on the async neo4j driver and Postgres pool, for the event loop."""
+    try:
+      async with self.kg.create_async_session() as session:
+        result = await session.run(HISTORY_POINTS_QUERY, point_uris=point_uris)
+        points = history_points(await result.data())
+      data = await self.ts.get_timeseries_async([point['timeseriesId'] for point in points], start_time, end_time, resolution=resolution, max_points=max_points, downsampling=downsampling)
+    except Exception as e:
+      raise e
+    return group_history_by_unit(points, data)
+
+  async def stream_points_history_async(self, start_time: str, end_time: str, point_uris: list[str], resolution: Resolution = Resolution.RAW, max_points: Optional[int] = None, downsampling: Downsampling = Downsampling.NONE) -> AsyncIterator[Tuple[str, List[dict]]]:
+    """History of the points as (timeseriesid, data) chunks read from a server side cursor (see Timescale.stream_timeseries), not downsampled by default."""
+    try:
+      async with self.kg.create_async_session() as session:
+        result = await session.run(HISTORY_POINTS_QUERY, point_uris=point_uris)
+        points = history_points(await result.data())
     except Exception as e:
       raise e
+    async for chunk in self.ts.stream_timeseries_async([point['timeseriesId'] for point in points], start_time, end_time, resolution=resolution, max_points=max_points, downsampling=downsampling):
+      yield chunk
+
+  def aligned_points_history(self, start_time: str, end_time: str, point_uris: list[str], bucket: timedelta, fill: Fill = Fill.LOCF) -> AlignedTimeseries:
+    """History of the points on a common time grid, one column per point (see Timescale.get_aligned_timeseries)."""
+    try:
+      with self.kg.create_session() as session:
+        points = history_points(session.run(HISTORY_POINTS_QUERY, point_uris=point_uris).data())
+      return self.ts.get_aligned_timeseries([point['timeseriesId'] for point in points], start_time, end_time, bucket=bucket, fill=fill)
+    except Exception as e:
+      raise e
+
+  def timeseries_statistics(self, groups: List[List[str]], start_time: str, end_time: str, bucket: timedelta, percentiles: Sequence[float] = ()) -> List[List[dict]]:
+    """Bucketed statistics of each group of timeseries ids (see Timescale.get_grouped_statistics)."""
+    return self.ts.get_grouped_statistics(groups, start_time, end_time, bucket=bucket, percentiles=percentiles)
+
+  def export_points_history(self, start_time: str, end_time: str, point_uris: list[str], resolution: Resolution = Resolution.RAW) -> pa.RecordBatchReader:
+    """History of the points as Arrow record batches (see Timescale.export_timeseries), the points are looked up before the batches are read."""
+    try:
+      with self.kg.create_session() as session:
+        points = history_points(session.run(HISTORY_POINTS_QUERY, point_uris=point_uris).data())
+      return self.ts.export_timeseries([point['timeseriesId'] for point in points], start_time, end_time, resolution=resolution)
+    except Exception as e:
+      raise e
+
+HISTORY_POINTS_QUERY = "MATCH (p:Point) WHERE p.uri in $point_uris RETURN p"
 
-    # Convert the dictionary to a list of groups
-    grouped_points_list = [{'object_unit': k, 'points': v} for k, v in grouped_points.items()]
+def history_points(records: List[dict]) -> List[dict]:
+  """Point dicts (without the embedding) of the records of HISTORY_POINTS_QUERY."""
+  points = []
+  for record in records:
+    point = asdict(Point(
+      uri=record['p']['uri'],
+      timeseriesId=record['p']['timeseriesId'],
+      object_name=record['p']['object_name'],
+      object_type=record['p'].get('object_type'),
+      object_index=record['p'].get('object_index'),
+      object_units=record['p'].get('object_units'),
+      collect_enabled=record['p'].get('collect_enabled'),
+      compression_mode=record['p'].get('compression_mode'),
+      compression_deviation=record['p'].get('compression_deviation'),
+      compression_max_silence=record['p'].get('compression_max_silence'),
+      object_description=record['p'].get('object_description'),
+      mqtt_topic=record['p'].get('mqtt_topic'),
+    ))
+    point.pop('embedding', None)
+    points.append(point)
+  return points
 
-    return grouped_points_list
\ No newline at end of file
+def group_history_by_unit(points: List[dict], data: List[dict]) -> List[dict]:
+  """Attach the timeseries data to the points and group them by object_units."""
+  data_dict = {item['timeseriesid']: item['data'] for item in data}
+  grouped_points = {}
+  for point in points:
+    point['data'] = data_dict.get(point['timeseriesId'], [])
+    grouped_points.setdefault(point['object_units'], []).append(point)
+  return [{'object_unit': k, 'points': v} for k, v in grouped_points.items()]
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from dataclasses import asdict
 
 from brontes.infrastructure import KnowledgeGraph
@@ -57,3 +57,20 @@ class PortfolioRepository:
         return portfolios
     except Exception as e:
       raise e
+
+  def get_points_by_class(self, portfolio_uri: str, brick_class_uri: str) -> List[Tuple[Facility, List[str]]]:
+    """Timeseries ids of the points of each facility of a portfolio whose brick class is brick_class_uri or one of its subclasses, in one query."""
+    try:
+      with self.kg.create_session() as session:
+        result = session.run("""MATCH (:Customer {uri: $portfolio_uri})-[:HAS_FACILITY]->(f:Facility)
+                                OPTIONAL MATCH (p:Point)-[:hasBrickClass]->(:Class)-[:SCO*0..]->(:Class {uri: $brick_class_uri})
+                                WHERE p.uri STARTS WITH f.uri + '/' AND p.timeseriesId IS NOT NULL
+                                WITH f, COLLECT(DISTINCT p.timeseriesId) AS timeseries_ids
+                                ORDER BY f.name
+                                RETURN f AS facility, timeseries_ids""", portfolio_uri=portfolio_uri, brick_class_uri=brick_class_uri)
+        return [
+          (Facility(uri=record['facility']['uri'], name=record['facility']['name'], latitude=record['facility'].get('latitude'), longitude=record['facility'].get('longitude'), address=record['facility'].get('address')), record['timeseries_ids'])
+          for record in result.data()
+        ]
+    except Exception as e:
+      raise e
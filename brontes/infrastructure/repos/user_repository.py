@@ -14,6 +14,14 @@ class UserRepository:
         user_record = record['u']
         return User(email=user_record['email'], full_name=user_record['fullName'], hashed_password=user_record['password'])
 
+  async def get_user_async(self, email: str) -> Optional[User]:
+    async with self.kg.create_async_session() as session:
+      result = await session.run("MATCH (u:User {email: $email}) RETURN u", email=email)
+      record = await result.single()
+      if record:
+        user_record = record['u']
+        return User(email=user_record['email'], full_name=user_record['fullName'], hashed_password=user_record['password'])
+
   def create_user(self, user: User) -> None:
     try:
       with self.kg.create_session() as session:
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+# Compare the memory use and throughput of buffering ingested readings as a list of PointReading vs a columnar PointReadingBatch.
+# Usage: poetry run python scripts/benchmarks/ingest_batch.py [--readings 1000000] [--database]
+# With --database the batches are also written with Timescale.insert_timeseries (needs POSTGRES_CONNECTION_STRING).
+
+from brontes.application.dtos.point_dto import PointReading, PointReadingBatch, to_datetime
+from brontes.infrastructure.db.timescale import encode_copy_binary
+from datetime import datetime
+from typing import List
+import argparse
+import numpy as np
+import random
+import time
+import tracemalloc
+
+SERIES_PREFIX = "benchmark-batch"
+
+def raw_readings(count: int, series: int):
+  start = time.time() - count
+  return [(f"{SERIES_PREFIX}-{i % series}", start + i, random.uniform(0, 120)) for i in range(count)]
+
+def build_point_readings(raw) -> List[PointReading]:
+  """What the ingest path used to do: one PointReading with an ISO timestamp string per reading."""
+  return [PointReading(ts=datetime.fromtimestamp(ts).isoformat(), value=value, timeseriesid=timeseriesid) for timeseriesid, ts, value in raw]
+
+def build_batch(raw) -> PointReadingBatch:
+  """What the ingest path does now: epoch microseconds, float64 values and interned ids in flat columns."""
+  batch = PointReadingBatch()
+  index = {}
+  for timeseriesid, ts, value in raw:
+    series = index.get(timeseriesid)
+    if series is None:
+      series = index[timeseriesid] = len(batch.timeseriesids)
+      batch.timeseriesids.append(timeseriesid)
+    batch.ts.append(int(ts * 1_000_000))
+    batch.values.append(value)
+    batch.series.append(series)
+  return batch
+
+def encode_point_readings(readings: List[PointReading]) -> int:
+  """Per row conversion the old binary COPY did before handing each row to psycopg."""
+  rows = [(to_datetime(r.ts), float(r.value), r.timeseriesid) for r in readings]
+  return len(rows)
+
+def encode_batch(batch: PointReadingBatch) -> int:
+  return sum(len(chunk) for chunk in encode_copy_binary(batch, np.arange(len(batch.timeseriesids), dtype=np.int32)))
+
+def measure(build, raw):
+  tracemalloc.start()
+  start = time.perf_counter()
+  result = build(raw)
+  elapsed = time.perf_counter() - start
+  size, _ = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return result, size, elapsed
+
+def timed(fn, *args):
+  start = time.perf_counter()
+  fn(*args)
+  return time.perf_counter() - start
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--readings', type=int, default=1_000_000, help='Number of readings to buffer')
+  parser.add_argument('--series', type=int, default=1_000, help='Number of distinct timeseries ids')
+  parser.add_argument('--database', action='store_true', help='Also insert both buffers into Timescale')
+  args = parser.parse_args()
+
+  raw = raw_readings(args.readings, args.series)
+  readings, list_bytes, list_build = measure(build_point_readings, raw)
+  batch, batch_bytes, batch_build = measure(build_batch, raw)
+  list_encode = timed(encode_point_readings, readings)
+  batch_encode = timed(encode_batch, batch)
+
+  n = args.readings
+  print(f"{n:,} readings, {args.series:,} series")
+  print(f"{'':>22} | {'list[PointReading]':>20} | {'PointReadingBatch':>20}")
+  print(f"{'memory':>22} | {list_bytes / 2**20:>17.1f} MB | {batch_bytes / 2**20:>17.1f} MB")
+  print(f"{'bytes/reading':>22} | {list_bytes / n:>20.1f} | {batch_bytes / n:>20.1f}")
+  print(f"{'build readings/s':>22} | {n / list_build:>20,.0f} | {n / batch_build:>20,.0f}")
+  print(f"{'COPY encode readings/s':>22} | {n / list_encode:>20,.0f} | {n / batch_encode:>20,.0f}")
+
+  if args.database:
+    from brontes.infrastructure import Postgres, Timescale
+    postgres = Postgres()
+    timescale = Timescale(postgres=postgres)
+    try:
+      # Lists are converted to a batch by insert_timeseries, time the old path's conversion plus the insert
+      list_insert = timed(timescale.insert_timeseries, readings)
+      batch_insert = timed(timescale.insert_timeseries, batch)
+      print(f"{'insert readings/s':>22} | {n / list_insert:>20,.0f} | {n / batch_insert:>20,.0f}")
+    finally:
+      with postgres.connection() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM timeseries WHERE series_id IN (SELECT id FROM series WHERE timeseriesid LIKE %s)", (f"{SERIES_PREFIX}-%",))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+# Offline load test of the MQTT2Timescale ingest path, no broker or devices needed.
+# Synthesizes Shelly events/rpc and status/switch:0 messages for N devices and feeds them to on_mqtt_message (as the MQTT network thread would),
+# the writer threads flush them to an in-memory sink or to Timescale.
+# Usage: poetry run python scripts/benchmarks/ingest_load.py --devices 1000 --rate 1 --duration 30 [--sink timescale]
+# With --sink timescale the readings are written with Timescale.insert_timeseries (needs POSTGRES_CONNECTION_STRING) and deleted afterwards.
+# --min_throughput and --max_p99 make the script exit with an error, so it can catch regressions in CI.
+
+from brontes.application.dtos.point_dto import PointReadingBatch
+from brontes.application.mqtt.mqtt2timescale import MQTT2Timescale
+from threading import Lock
+from types import SimpleNamespace
+import argparse
+import json
+import numpy as np
+import resource
+import sys
+import time
+
+DEVICE_PREFIX = "shellyplugus-benchmark"
+
+class FakeMQTTClient:
+  """Stands in for MQTTClient, messages are delivered by calling on_mqtt_message directly."""
+  def __init__(self):
+    self.client = SimpleNamespace(on_message=None)
+
+  def connect(self):
+    pass
+
+  def subscribe(self, topic: str):
+    pass
+
+  def loop_forever(self):
+    pass
+
+  def disconnect(self):
+    pass
+
+class MemorySink:
+  """Stands in for Timescale, keeps the end-to-end latency of every rpc reading it receives."""
+  def __init__(self, ts=None):
+    self.ts = ts
+    self.lock = Lock()
+    self.rows = 0
+    self.latencies = []
+
+  def insert_timeseries(self, data: PointReadingBatch, checkpoint=None):
+    if self.ts:
+      self.ts.insert_timeseries(data, checkpoint=checkpoint)
+    now_us = time.time() * 1_000_000
+    ts = np.frombuffer(data.ts, dtype=np.int64)
+    # Switch status readings carry the minute they belong to, not the time they were sent
+    rpc = ts % 60_000_000 != 0
+    with self.lock:
+      self.rows += len(data)
+      self.latencies.append((now_us - ts[rpc]) / 1_000_000)
+
+  def get_ingest_checkpoint(self, name: str):
+    return self.ts.get_ingest_checkpoint(name) if self.ts else None
+
+def rpc_message(device: str, ts: float, i: int):
+  payload = {
+    "src": device,
+    "dst": f"{device}/events",
+    "method": "NotifyStatus",
+    "params": {"ts": ts, "switch:0": {"id": 0, "current": 0.4 + (i % 100) / 1000, "voltage": 120 + (i % 7) / 10, "apower": 48.2}},
+  }
+  return SimpleNamespace(topic=f"{device}/events/rpc", payload=json.dumps(payload).encode())
+
+def status_message(device: str, ts: float, i: int):
+  payload = {
+    "id": 0,
+    "source": "timer",
+    "output": i % 2 == 0,
+    "apower": 48.2,
+    "voltage": 120.1,
+    "current": 0.41,
+    "aenergy": {"total": 1234.5 + i, "by_minute": [0, 0, 0], "minute_ts": int(ts // 60 * 60)},
+    "temperature": {"tC": 38.2, "tF": 100.8},
+  }
+  return SimpleNamespace(topic=f"{device}/status/switch:0", payload=json.dumps(payload).encode())
+
+def generate(app: MQTT2Timescale, devices: int, rate: float, duration: float, status_every: int) -> int:
+  """Send rate messages per second per device for duration seconds (as fast as possible if rate is 0). Returns the number of messages sent."""
+  names = [f"{DEVICE_PREFIX}{d:06d}-{d:012x}" for d in range(devices)]
+  interval = 1 / (rate * devices) if rate > 0 else 0
+  start = time.perf_counter()
+  sent = 0
+  while True:
+    elapsed = time.perf_counter() - start
+    if elapsed >= duration:
+      return sent
+    if interval and sent * interval > elapsed:
+      time.sleep(min(sent * interval - elapsed, 0.01))
+      continue
+    device = names[sent % devices]
+    round_ = sent // devices
+    now = time.time()
+    if status_every and round_ % status_every == status_every - 1:
+      message = status_message(device, now, round_)
+    else:
+      message = rpc_message(device, now, round_)
+    app.on_mqtt_message(None, None, message)
+    sent += 1
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--devices', type=int, default=1_000, help='Number of simulated Shelly plugs')
+  parser.add_argument('--rate', type=float, default=1, help='Messages per second per device, 0 sends as fast as possible')
+  parser.add_argument('--duration', type=float, default=10, help='Seconds to generate load for')
+  parser.add_argument('--status_every', type=int, default=10, help='Every Nth message of a device is a status/switch:0 message instead of events/rpc, 0 to disable')
+  parser.add_argument('--sink', choices=['memory', 'timescale'], default='memory')
+  parser.add_argument('--batch_size', type=int, default=1_000)
+  parser.add_argument('--flush_interval', type=float, default=1)
+  parser.add_argument('--writer_threads', type=int, default=1)
+  parser.add_argument('--queue_capacity', type=int, default=100_000)
+  parser.add_argument('--latency_slo', type=float, help='Use adaptive batching with this latency SLO (seconds) instead of --batch_size and --flush_interval')
+  parser.add_argument('--min_throughput', type=float, help='Fail if fewer messages/s than this are ingested')
+  parser.add_argument('--max_p99', type=float, help='Fail if the p99 end-to-end latency (seconds) is higher than this')
+  args = parser.parse_args()
+
+  timescale = None
+  if args.sink == 'timescale':
+    from brontes.infrastructure import Postgres, Timescale
+    timescale = Timescale(postgres=Postgres())
+  sink = MemorySink(timescale)
+  app = MQTT2Timescale(
+    mqtt_client=FakeMQTTClient(),
+    ts=sink,
+    batch_size=args.batch_size,
+    flush_interval=args.flush_interval,
+    writer_threads=args.writer_threads,
+    queue_capacity=args.queue_capacity,
+    stats_interval=3600,
+    latency_slo=args.latency_slo,
+  )
+
+  start = time.perf_counter()
+  try:
+    sent = generate(app, args.devices, args.rate, args.duration, args.status_every)
+    generated = time.perf_counter() - start
+  finally:
+    app.stop() # Drains the queue
+  elapsed = time.perf_counter() - start
+  peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # KB on Linux
+
+  if timescale:
+    with timescale.postgres.connection() as conn, conn.cursor() as cur:
+      cur.execute("DELETE FROM timeseries WHERE series_id IN (SELECT id FROM series WHERE timeseriesid LIKE %s)", (f"{DEVICE_PREFIX}%",))
+
+  latencies = np.concatenate(sink.latencies) if sink.latencies else np.zeros(1)
+  stats = app.stats()
+  throughput = sent / elapsed
+  p50, p99 = np.percentile(latencies, [50, 99])
+  batching = f"latency SLO {args.latency_slo}s" if args.latency_slo else f"batch size {args.batch_size}, flush interval {args.flush_interval}s"
+  print(f"devices {args.devices:,}, rate {args.rate}/s/device, sink {args.sink}, {batching}, writer threads {args.writer_threads}")
+  print(f"{'messages sent':>20}: {sent:,} in {generated:.2f}s")
+  print(f"{'readings stored':>20}: {sink.rows:,}")
+  print(f"{'messages/s':>20}: {throughput:,.0f}")
+  print(f"{'readings/s':>20}: {sink.rows / elapsed:,.0f}")
+  print(f"{'p50 latency':>20}: {p50 * 1000:,.1f} ms")
+  print(f"{'p99 latency':>20}: {p99 * 1000:,.1f} ms")
+  print(f"{'peak RSS':>20}: {peak_rss:,.1f} MB")
+  print(f"{'final batch size':>20}: {stats['batch_size']:,} (flush interval {stats['flush_interval']:.2f}s)")
+  print(f"{'flushes':>20}: {stats['flush_count']:,} (avg {stats['avg_flush_latency'] * 1000:.1f} ms, max {stats['max_flush_latency'] * 1000:.1f} ms, {stats['flush_errors']} errors)")
+
+  failed = False
+  if args.min_throughput is not None and throughput < args.min_throughput:
+    print(f"FAIL: throughput {throughput:,.0f} messages/s is below {args.min_throughput:,.0f}")
+    failed = True
+  if args.max_p99 is not None and p99 > args.max_p99:
+    print(f"FAIL: p99 latency {p99:.3f}s is above {args.max_p99:.3f}s")
+    failed = True
+  sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+  main()
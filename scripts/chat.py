@@ -35,7 +35,7 @@ async def main():
   embeddings = OpenAIEmbeddings()
   vector_store = PGVector(
     collection_name=os.environ.get("POSTGRES_EMBEDDINGS_TABLE"),
-    connection=os.environ.get("POSTGRES_CONNECTION_STRING"),
+    connection=postgres.sqlalchemy_engine(),
     embeddings=embeddings,
     use_jsonb=True
   )
@@ -1,8 +1,12 @@
+from datetime import datetime, timedelta, timezone
 from typing import List
-from brontes.application.dtos.point_dto import PointReading
+import pytest
+from brontes.application.dtos.point_dto import Fill, PointReading, PointReadingBatch, Resolution, to_epoch_us
+from brontes.infrastructure.db.timescale import HypertableSettings, Timescale
+from brontes.infrastructure.db.last_value_cache import LastValueCache
 
 def test_setup_db(postgres_container, timescale):
-  with timescale.postgres.cursor() as cur:
+  with timescale.postgres.connection() as conn, conn.cursor() as cur:
     cur.execute("""
       SELECT extname AS name FROM pg_extension
       UNION ALL
@@ -13,11 +17,38 @@ def test_setup_db(postgres_container, timescale):
     results = cur.fetchall()
     extensions = [row[0] for row in results if row[0] == "timescaledb"]
     table_names = [row[0] for row in results if row[0] == "timeseries"]
-    indexes = [row[0] for row in results if row[0] == 'timeseries_timeseriesid_ts_idx']
+    indexes = [row[0] for row in results if row[0] == 'timeseries_series_id_ts_idx']
+    cur.execute("SELECT view_name FROM timescaledb_information.continuous_aggregates")
+    rollups = {row[0] for row in cur.fetchall()}
 
+    assert rollups >= {"timeseries_1m", "timeseries_15m", "timeseries_1h", "timeseries_1d"}
     assert "timescaledb" in extensions
     assert "timeseries" in table_names
-    assert "timeseries_timeseriesid_ts_idx" in indexes
+    assert "timeseries_series_id_ts_idx" in indexes
+
+def test_setup_db_reconciles_hypertable_settings(timescale):
+  def policies():
+    with timescale.postgres.connection() as conn, conn.cursor() as cur:
+      cur.execute("SELECT proc_name, config FROM timescaledb_information.jobs WHERE hypertable_name = 'timeseries'")
+      return {row[0]: row[1] for row in cur.fetchall()}
+
+  assert policies()["policy_compression"]["compress_after"] == "7 days"
+  assert "policy_retention" not in policies()
+
+  settings = HypertableSettings(chunk_interval=timedelta(hours=12), compress_after=timedelta(days=3), retain_for=timedelta(weeks=52))
+  Timescale(timescale.postgres, hypertable=settings)
+  Timescale(timescale.postgres, hypertable=settings) # Reconciling again changes nothing
+  with timescale.postgres.connection() as conn, conn.cursor() as cur:
+    cur.execute("SELECT time_interval FROM timescaledb_information.dimensions WHERE hypertable_name = 'timeseries'")
+    assert cur.fetchone()[0] == timedelta(hours=12)
+    cur.execute("SELECT attname, segmentby_column_index, orderby_asc FROM timescaledb_information.compression_settings WHERE hypertable_name = 'timeseries'")
+    assert set(cur.fetchall()) == {("series_id", 1, None), ("ts", None, False)}
+  assert policies()["policy_compression"]["compress_after"] == "3 days"
+  assert policies()["policy_retention"]["drop_after"] == "364 days"
+
+  Timescale(timescale.postgres, hypertable=HypertableSettings())
+  assert "policy_retention" not in policies()
+  assert policies()["policy_compression"]["compress_after"] == "7 days"
 
 def test_insert_timeseries(timescale):
   point_readings: List[PointReading] = [
@@ -27,3 +58,123 @@ def test_insert_timeseries(timescale):
 
   points = timescale.get_timeseries(["12345678"], start_time="2024-02-15T13:41:32+00:00", end_time="2024-05-15T13:41:32+00:00")
   assert len(points) == 1
+
+def test_readings_are_stored_with_series_ids(timescale):
+  timescale.insert_timeseries([PointReading(value=1, timeseriesid="series-1", ts="2024-04-15T13:41:32+00:00")])
+  with timescale.postgres.connection() as conn, conn.cursor() as cur:
+    cur.execute("SELECT s.timeseriesid FROM timeseries t JOIN series s ON s.id = t.series_id WHERE t.series_id = %s", (timescale.series_ids(["series-1"])["series-1"],))
+    assert cur.fetchall() == [("series-1",)]
+
+  reader = Timescale(timescale.postgres) # Empty series cache, reads the series table
+  assert reader.get_timeseries(["series-1"], start_time="2024-04-15T00:00:00+00:00", end_time="2024-04-16T00:00:00+00:00")[0]['data'][0]['value'] == 1
+
+def test_insert_timeseries_executemany(timescale):
+  timescale_executemany = Timescale(timescale.postgres, write_method="executemany")
+  point_readings: List[PointReading] = [
+    PointReading(value=21, timeseriesid="executemany-1", ts="2024-04-15T13:41:32+00:00"),
+    PointReading(value=22, timeseriesid="executemany-1", ts="2024-04-15T13:42:32+00:00"),
+  ]
+  timescale_executemany.insert_timeseries(point_readings)
+
+  points = timescale.get_timeseries(["executemany-1"], start_time="2024-02-15T13:41:32+00:00", end_time="2024-05-15T13:41:32+00:00")
+  assert len(points[0]['data']) == 2
+
+def test_insert_timeseries_unknown_write_method(timescale):
+  with pytest.raises(ValueError):
+    Timescale(timescale.postgres, write_method="unknown")
+
+def test_insert_timeseries_with_checkpoint(timescale):
+  assert timescale.get_ingest_checkpoint("test-spool") is None
+  point_readings: List[PointReading] = [
+    PointReading(value=23, timeseriesid="checkpoint-1", ts="2024-04-15T13:41:32+00:00")
+  ]
+  timescale.insert_timeseries(point_readings, checkpoint=("test-spool", 3, 1024))
+  assert timescale.get_ingest_checkpoint("test-spool") == (3, 1024)
+
+def test_idempotent_insert_ignores_duplicates(timescale):
+  idempotent = Timescale(timescale.postgres, idempotent=True)
+  reading = PointReading(value=24, timeseriesid="idempotent-1", ts="2024-04-15T13:41:32+00:00")
+  idempotent.insert_timeseries([reading, reading])
+  idempotent.insert_timeseries([reading])
+  Timescale(timescale.postgres, write_method="executemany", idempotent=True).insert_timeseries([reading])
+
+  points = timescale.get_timeseries(["idempotent-1"], start_time="2024-02-15T13:41:32+00:00", end_time="2024-05-15T13:41:32+00:00")
+  assert len(points[0]['data']) == 1
+
+def test_insert_timeseries_batch(timescale):
+  batch = PointReadingBatch()
+  for i in range(5):
+    batch.append(f"batch-{i % 2}", 1713188492_000_000 + i * 1_000_000, float(i))
+  timescale.insert_timeseries(batch)
+
+  points = timescale.get_timeseries(["batch-0", "batch-1"], start_time="2024-02-15T13:41:32+00:00", end_time="2024-05-15T13:41:32+00:00")
+  assert sorted(len(point['data']) for point in points) == [2, 3]
+
+def test_get_latest_values_from_latest_values_table(timescale):
+  now = to_epoch_us(datetime.now(timezone.utc))
+  batch = PointReadingBatch()
+  batch.append("latest-1", now - 2_000_000, 1.0)
+  batch.append("latest-1", now - 1_000_000, 2.0)
+  batch.append("latest-2", now - 3_600_000_000, 3.0) # Older than 30 minutes
+  timescale.insert_timeseries(batch)
+
+  reader = Timescale(timescale.postgres, last_values=LastValueCache(ttl=0))
+  readings = reader.get_latest_values(["latest-1", "latest-2", "latest-unknown"])
+  assert [(reading.timeseriesid, reading.value) for reading in readings] == [("latest-1", 2.0)]
+  with timescale.postgres.connection() as conn, conn.cursor() as cur:
+    cur.execute("SELECT value FROM latest_values WHERE timeseriesid = 'latest-1'")
+    assert cur.fetchone()[0] == 2.0
+
+def test_get_timeseries_from_rollup(timescale):
+  point_readings: List[PointReading] = [
+    PointReading(value=value, timeseriesid="rollup-1", ts=f"2024-04-15T13:{minute:02d}:00+00:00") for minute, value in ((1, 10), (2, 20), (3, 60))
+  ]
+  timescale.insert_timeseries(point_readings)
+
+  points = timescale.get_timeseries(["rollup-1"], start_time="2024-04-15T00:00:00+00:00", end_time="2024-04-16T00:00:00+00:00", resolution=Resolution.HOUR)
+  assert points[0]['data'] == [{'ts': '2024-04-15T13:00:00+00:00', 'value': 30.0, 'timeseriesid': 'rollup-1', 'min': 10.0, 'max': 60.0, 'last': 60.0, 'count': 3}]
+
+  points = timescale.get_timeseries(["rollup-1"], start_time="2024-01-15T00:00:00+00:00", end_time="2024-04-16T00:00:00+00:00", resolution=Resolution.AUTO, max_points=100)
+  assert points[0]['data'][0]['count'] == 3 # One day bucket
+
+def test_get_aligned_timeseries_fills_gaps(timescale):
+  timescale.insert_timeseries([
+    PointReading(value=value, timeseriesid=timeseriesid, ts=f"2024-04-16T10:{minute:02d}:30+00:00")
+    for timeseriesid, minute, value in (("aligned-1", 0, 1.0), ("aligned-1", 2, 3.0), ("aligned-2", 1, 10.0))
+  ])
+  start, end = "2024-04-16T10:00:00+00:00", "2024-04-16T10:03:00+00:00"
+  locf = timescale.get_aligned_timeseries(["aligned-1", "aligned-2"], start, end, bucket=timedelta(minutes=1), fill=Fill.LOCF)
+  assert locf.values[:, 0].tolist() == [1.0, 1.0, 3.0]
+  assert locf.values[1:, 1].tolist() == [10.0, 10.0]
+  interpolated = timescale.get_aligned_timeseries(["aligned-1"], start, end, bucket=timedelta(seconds=30), fill=Fill.INTERPOLATE)
+  assert interpolated.values[3, 0] == 2.0 # 10:01:30, halfway between the readings at 10:00:30 and 10:02:30
+
+def test_get_aligned_timeseries_with_an_unaligned_start(timescale):
+  timescale.insert_timeseries([
+    PointReading(value=value, timeseriesid="aligned-edge", ts=f"2024-04-16T10:{minute:02d}:00+00:00")
+    for minute, value in ((5, 1.0), (20, 2.0))
+  ])
+  aligned = timescale.get_aligned_timeseries(["aligned-edge"], "2024-04-16T10:07:30+00:00", "2024-04-16T11:00:00+00:00", bucket=timedelta(hours=1), fill=Fill.NONE)
+  assert aligned.values[:, 0].tolist() == [2.0] # Only the readings from the start on, like the raw readings
+
+def test_get_grouped_statistics(timescale):
+  timescale.insert_timeseries([
+    PointReading(value=value, timeseriesid=timeseriesid, ts=f"2024-04-16T10:{minute:02d}:00+00:00")
+    for timeseriesid, minute, value in (("grouped-1", 0, 1.0), ("grouped-1", 30, 3.0), ("grouped-2", 10, 5.0), ("grouped-3", 20, 7.0))
+  ])
+  start, end = "2024-04-16T10:00:00+00:00", "2024-04-16T11:00:00+00:00"
+  groups = [["grouped-1", "grouped-2"], ["grouped-3", "grouped-1"], ["missing"]]
+  raw = timescale.get_grouped_statistics(groups, start, end, bucket=timedelta(minutes=30), percentiles=[0.5])
+  assert [(bucket['avg'], bucket['count'], bucket['percentiles']['p50']) for bucket in raw[0]] == [(3.0, 2, 3.0), (3.0, 1, 3.0)]
+  assert raw[2] == []
+  rollup = timescale.get_grouped_statistics(groups, start, end, bucket=timedelta(hours=1))
+  assert [(bucket['avg'], bucket['min'], bucket['max'], bucket['count']) for bucket in rollup[1]] == [(11 / 3, 1.0, 7.0, 3)]
+
+def test_get_timeseries_caches_closed_blocks(timescale):
+  timescale.insert_timeseries([PointReading(value=float(hour), timeseriesid="blocks-1", ts=f"2024-04-16T{hour:02d}:00:00+00:00") for hour in range(24)])
+  start, end = "2024-04-16T03:00:00+00:00", "2024-04-16T20:00:00+00:00"
+  first = timescale.get_timeseries(["blocks-1"], start, end, max_points=None)
+  assert [reading['value'] for reading in first[0]['data']] == [float(hour) for hour in range(3, 21)]
+  hits = timescale.blocks.hits
+  assert timescale.get_timeseries(["blocks-1"], start, end, max_points=None) == first
+  assert timescale.blocks.hits == hits + 4 # The four 6 hour blocks of the day
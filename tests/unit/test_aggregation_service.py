@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+from brontes.application.services.aggregation_service import AggregationService, StatisticsCache, align_window
+from brontes.domain.models import Facility
+
+def test_align_window_widens_to_whole_buckets():
+  start, end = align_window("2024-04-16T10:20:00+00:00", "2024-04-16T12:05:00+00:00", timedelta(hours=1))
+  assert (start, end) == (datetime(2024, 4, 16, 10, tzinfo=timezone.utc), datetime(2024, 4, 16, 13, tzinfo=timezone.utc))
+  start, _ = align_window("2024-04-18T10:00:00+00:00", "2024-04-19T00:00:00+00:00", timedelta(weeks=1))
+  assert start == datetime(2024, 4, 15, tzinfo=timezone.utc) # Week buckets start on Mondays
+
+def test_portfolio_statistics_are_grouped_by_facility_and_cached():
+  portfolio_repository, point_repository = MagicMock(), MagicMock()
+  portfolio_repository.get_points_by_class.return_value = [(Facility(uri="f1", name="One"), ["a", "b"]), (Facility(uri="f2", name="Two"), [])]
+  point_repository.timeseries_statistics.return_value = [[{'ts': "2024-04-16T10:00:00+00:00", 'avg': 21.0}], []]
+  service = AggregationService(portfolio_repository=portfolio_repository, point_repository=point_repository)
+  for end_time in ("2024-04-16T11:55:00+00:00", "2024-04-16T11:59:00+00:00"): # Same window once aligned
+    result = service.get_portfolio_statistics("portfolio", "brick:Zone_Air_Temperature_Sensor", "2024-04-16T10:00:00+00:00", end_time, bucket=timedelta(hours=1))
+  assert [(item['facility']['uri'], item['timeseries'], len(item['data'])) for item in result] == [("f1", 2, 1), ("f2", 0, 0)]
+  point_repository.timeseries_statistics.assert_called_once()
+  assert point_repository.timeseries_statistics.call_args.args[0] == [["a", "b"], []]
+  assert service.cache.hits == 1
+
+def test_statistics_cache_evicts_the_least_recently_used_window():
+  cache = StatisticsCache(max_entries=2)
+  closed = datetime(2024, 1, 1, tzinfo=timezone.utc)
+  cache.put("a", closed, [1])
+  cache.put("b", closed, [2])
+  cache.get("a")
+  cache.put("c", closed, [3])
+  assert cache.get("b") is None and cache.get("a") == [1]
+
+def test_statistics_cache_expires_live_windows_sooner():
+  cache = StatisticsCache(live_ttl=0)
+  cache.put("live", datetime.now(timezone.utc), [1])
+  cache.put("closed", datetime(2024, 1, 1, tzinfo=timezone.utc), [2])
+  assert cache.get("live") is None and cache.get("closed") == [2]
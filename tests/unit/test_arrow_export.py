@@ -0,0 +1,51 @@
+import io
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from brontes.application.dtos.point_dto import ExportFormat, PointReadingBatch, from_epoch_us
+from brontes.infrastructure.db.arrow_export import history_record_batch, history_schema, write_record_batches
+from brontes.infrastructure.db.timescale import COPY_ROW, CopyBinaryDecoder, encode_copy_binary, export_columns
+
+def copy_stream() -> bytes:
+  batch = PointReadingBatch()
+  for i in range(5):
+    batch.append("ab"[i % 2], 1713188492_000_000 + i, float(i))
+  return b"".join(encode_copy_binary(batch, np.array([7, 3], dtype=np.int32)))
+
+def test_decoder_handles_any_chunk_boundaries():
+  stream = copy_stream()
+  decoder = CopyBinaryDecoder(COPY_ROW)
+  rows = np.concatenate([decoder.feed(stream[i:i + 7]) for i in range(0, len(stream), 7)])
+  decoder.finish()
+  assert list(rows['series_id']) == [7, 3, 7, 3, 7]
+  assert list(rows['value']) == [0.0, 1.0, 2.0, 3.0, 4.0]
+
+def test_decoder_rejects_a_truncated_stream():
+  decoder = CopyBinaryDecoder(COPY_ROW)
+  decoder.feed(copy_stream()[:-5])
+  with pytest.raises(ValueError):
+    decoder.finish()
+
+def test_export_columns_to_record_batch():
+  decoder = CopyBinaryDecoder(COPY_ROW)
+  rows = decoder.feed(copy_stream())
+  positions = np.zeros(8, dtype=np.int32)
+  positions[[7, 3]] = [0, 1]
+  batch = history_record_batch(history_schema(rollup=False), export_columns(rows, positions), pa.array(["a", "b"]))
+  assert batch.column("timeseriesid").to_pylist() == ["a", "b", "a", "b", "a"]
+  assert batch.column("ts").to_pylist()[0] == from_epoch_us(1713188492_000_000)
+
+@pytest.mark.parametrize("format", list(ExportFormat))
+def test_write_record_batches_round_trip(format):
+  schema = history_schema(rollup=False)
+  batches = [
+    history_record_batch(schema, {"ts": np.arange(3, dtype=np.int64), "timeseriesid": np.zeros(3, dtype=np.int32), "value": np.ones(3)}, pa.array(["a"]))
+    for _ in range(2)
+  ]
+  chunks = list(write_record_batches(batches, schema, format))
+  assert len(chunks) >= 2 # Bytes are yielded batch by batch, not only on close
+  data = io.BytesIO(b"".join(chunks))
+  table = pa.ipc.open_stream(data).read_all() if format == ExportFormat.ARROW else pq.read_table(data)
+  assert table.num_rows == 6
+  assert table.column("value").to_pylist() == [1.0] * 6
@@ -0,0 +1,71 @@
+from brontes.application.mqtt.batch_controller import AdaptiveBatchController, BYTES_PER_READING
+
+class Counter:
+  def __init__(self):
+    self.received = 0
+    self.backlog = 0
+
+def controller(counter: Counter, **kwargs) -> AdaptiveBatchController:
+  kwargs.setdefault("smoothing", 1.0)
+  return AdaptiveBatchController(received=lambda: counter.received, backlog=lambda: counter.backlog, **kwargs)
+
+def test_quiet_period_flushes_within_the_slo():
+  counter = Counter()
+  batches = controller(counter, latency_slo=5)
+  batch_size, linger = batches.next_batch()
+  assert batch_size == 100
+  assert linger <= 5
+
+def test_fit_separates_commit_overhead_and_row_cost():
+  batches = controller(Counter(), smoothing=0.5)
+  for rows in (100, 1_000, 10_000, 100, 1_000, 10_000):
+    batches.observe_flush(rows, 0.01 + rows * 1e-5)
+  assert abs(batches.commit_overhead - 0.01) < 1e-3
+  assert abs(batches.commit_row_cost - 1e-5) < 1e-6
+
+def test_burst_grows_the_batch_until_the_overhead_is_amortized():
+  counter = Counter()
+  batches = controller(counter, latency_slo=5, smoothing=0.5)
+  for rows in (100, 10_000):
+    batches.observe_flush(rows, 0.01 + rows * 1e-5)
+  batches.last_sample -= 1
+  counter.received = 50_000 # 50k readings/s
+  batch_size, linger = batches.next_batch()
+  # 10ms overhead at 10us per row is 10% of the commit time at 9000 rows
+  assert abs(batch_size - 9_000) <= 1
+  assert linger + batches.commit_latency(batch_size) <= 5
+
+def test_slow_commits_shrink_the_linger_to_meet_the_slo():
+  counter = Counter()
+  batches = controller(counter, latency_slo=5, smoothing=0.5, overhead_share=0.01)
+  for rows in (100, 10_000):
+    batches.observe_flush(rows, 0.5 + rows * 1e-4)
+  batches.last_sample -= 1
+  counter.received = 20_000
+  batch_size, linger = batches.next_batch()
+  assert linger < 4.5
+  assert abs(linger + batches.commit_latency(batch_size) - 5) < 0.01
+
+def test_backlog_and_memory_budget():
+  counter = Counter()
+  batches = controller(counter, max_batch_bytes=1_000 * BYTES_PER_READING)
+  counter.backlog = 500
+  assert batches.next_batch()[0] == 500
+  counter.backlog = 5_000
+  assert batches.next_batch()[0] == 1_000
+  assert batches.stats()["batch_size"] == 1_000
+
+def test_adaptive_batching_is_opt_in(monkeypatch):
+  from unittest.mock import MagicMock
+  from brontes.application.mqtt import mqtt2timescale
+  for name in ("MQTTClient", "Postgres", "Timescale", "MQTT2Timescale"):
+    monkeypatch.setattr(mqtt2timescale, name, MagicMock())
+  monkeypatch.delenv("NEO4J_URI", raising=False)
+  monkeypatch.delenv("INGEST_LATENCY_SLO", raising=False)
+  monkeypatch.setenv("INGEST_BATCH_SIZE", "500")
+  mqtt2timescale.build_app()
+  kwargs = mqtt2timescale.MQTT2Timescale.call_args.kwargs
+  assert kwargs["latency_slo"] is None and kwargs["batch_size"] == 500
+  monkeypatch.setenv("INGEST_LATENCY_SLO", "2.5")
+  mqtt2timescale.build_app()
+  assert mqtt2timescale.MQTT2Timescale.call_args.kwargs["latency_slo"] == 2.5
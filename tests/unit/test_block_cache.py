@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta, timezone
+import os
+from brontes.infrastructure.db.block_cache import BlockCache, block_size
+
+def rows(count):
+  return tuple((datetime(2024, 1, 1, tzinfo=timezone.utc), float(i), 1) for i in range(count))
+
+def test_least_recently_used_blocks_are_evicted_past_the_budget():
+  cache = BlockCache(max_bytes=block_size(rows(10)) * 2)
+  cache.put("a", rows(10))
+  cache.put("b", rows(10))
+  cache.get("a") # a is now the most recent
+  cache.put("c", rows(10)) # evicts b
+  assert cache.get("b") is None
+  assert cache.get("a") == rows(10)
+  assert cache.size <= cache.max_bytes
+
+def test_blocks_larger_than_the_budget_are_not_cached():
+  cache = BlockCache(max_bytes=block_size(rows(10)))
+  cache.put("a", rows(100))
+  assert cache.get("a") is None and len(cache) == 0
+
+def test_evicted_blocks_are_read_back_from_the_disk_tier(tmp_path):
+  cache = BlockCache(max_bytes=block_size(rows(10)), directory=str(tmp_path))
+  cache.put("a", rows(10))
+  cache.put("b", rows(10)) # Spills a
+  assert len(os.listdir(cache.directory)) == 1
+  assert cache.get("a") == rows(10)
+  assert cache.disk_hits == 1
+
+def test_disk_tier_has_its_own_budget(tmp_path):
+  cache = BlockCache(max_bytes=block_size(rows(10)), directory=str(tmp_path), max_disk_bytes=1)
+  cache.put("a", rows(10))
+  cache.put("b", rows(10))
+  assert os.listdir(cache.directory) == [] and cache.get("a") is None
+
+def test_caches_sharing_a_directory_keep_their_own_blocks(tmp_path):
+  (tmp_path / "other.block").write_bytes(b"") # Eg. of another worker
+  first = BlockCache(max_bytes=block_size(rows(10)), directory=str(tmp_path))
+  second = BlockCache(max_bytes=block_size(rows(10)), directory=str(tmp_path))
+  assert (tmp_path / "other.block").exists()
+  first.put("a", rows(10))
+  first.put("b", rows(10)) # Spills a
+  second.put("a", rows(1))
+  second.put("b", rows(1)) # Spills a, without overwriting the first cache's block
+  assert first.directory != second.directory
+  assert first.get("a") == rows(10) and second.get("a") == rows(1)
+  directory = first.directory
+  del first
+  assert not os.path.exists(directory)
+
+def test_discarded_blocks_are_dropped_from_both_tiers(tmp_path):
+  cache = BlockCache(max_bytes=block_size(rows(10)), directory=str(tmp_path))
+  cache.put("a", rows(10))
+  cache.put("b", rows(10)) # Spills a
+  cache.discard(["a", "b", "c"])
+  assert cache.get("a") is None and cache.get("b") is None
+  assert os.listdir(cache.directory) == [] and cache.size == 0 and cache.disk_size == 0
+
+def test_blocks_expire_after_max_age(tmp_path):
+  cache = BlockCache(max_bytes=block_size(rows(10)), directory=str(tmp_path), max_age=timedelta(0))
+  cache.put("a", rows(10))
+  cache.put("b", rows(10)) # Spills a
+  assert cache.get("a") is None and cache.get("b") is None
+  assert os.listdir(cache.directory) == [] and cache.size == 0
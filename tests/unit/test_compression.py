@@ -0,0 +1,62 @@
+import math
+import numpy as np
+from brontes.application.mqtt.compression import Compressor, CompressionMode, CompressionSettings, SeriesCompressor
+
+def run(settings: CompressionSettings, values, step: float = 1.0):
+  compressor = SeriesCompressor(settings)
+  stored = []
+  for i, value in enumerate(values):
+    stored += compressor.offer(i * step, value, (i * step, value))
+  return stored + compressor.flush()
+
+def test_deadband():
+  stored = run(CompressionSettings(mode=CompressionMode.DEADBAND, deviation=0.5), [10, 10.2, 10.4, 10.6, 10.7, 9.9])
+  assert [value for _, value in stored] == [10, 10.6, 9.9]
+
+def test_deadband_percent():
+  stored = run(CompressionSettings(mode=CompressionMode.DEADBAND_PERCENT, deviation=10), [100, 105, 109, 111, 120])
+  assert [value for _, value in stored] == [100, 111]
+
+def test_max_silence_heartbeat():
+  stored = run(CompressionSettings(mode=CompressionMode.DEADBAND, deviation=1, max_silence=60), [5] * 10, step=15)
+  assert [t for t, _ in stored] == [0, 60, 120]
+
+def test_swinging_door_stays_within_deviation():
+  deviation = 0.2
+  values = [math.sin(i / 20) * 5 for i in range(500)]
+  stored = run(CompressionSettings(mode=CompressionMode.SWINGING_DOOR, deviation=deviation), values)
+  assert len(stored) < len(values) / 5
+  times, stored_values = zip(*stored)
+  reconstructed = np.interp(np.arange(len(values)), times, stored_values)
+  assert np.max(np.abs(reconstructed - np.array(values))) <= deviation + 1e-9
+
+def test_series_without_settings_pass_through():
+  compressor = Compressor({"compressed": CompressionSettings(mode=CompressionMode.DEADBAND, deviation=1)})
+  assert compressor.offer("raw", 0, 1, "a") == ["a"]
+  assert compressor.offer("raw", 1, 1, "b") == ["b"]
+  assert compressor.offer("compressed", 0, 1, "c") == ["c"]
+  assert compressor.offer("compressed", 1, 1, "d") == []
+
+def test_from_point_properties():
+  assert CompressionSettings.from_point_properties(None) is None
+  settings = CompressionSettings.from_point_properties("swinging_door", 0.5, 900)
+  assert settings == CompressionSettings(mode=CompressionMode.SWINGING_DOOR, deviation=0.5, max_silence=900)
+
+def test_swinging_door_keeps_working_after_flush():
+  compressor = SeriesCompressor(CompressionSettings(mode=CompressionMode.SWINGING_DOOR, deviation=0.1))
+  for t, value in ((0, 0), (1, 1), (2, 2)):
+    compressor.offer(t, value, (t, value))
+  assert compressor.flush() == [(2, 2)]
+  assert compressor.offer(3, 10, (3, 10)) == [] # Held from the flushed reading, the doors were reopened
+  assert compressor.flush() == [(3, 10)]
+
+def test_non_finite_readings_are_stored_as_they_are():
+  for mode in CompressionMode:
+    compressor = SeriesCompressor(CompressionSettings(mode=mode, deviation=0.1))
+    assert compressor.offer(0, math.nan, "nan") == ["nan"] # First reading
+    assert compressor.offer(1, 1.0, "a") == ["a"]
+    assert compressor.offer(2, 1.0, "b") == []
+    held = ["b"] if mode == CompressionMode.SWINGING_DOOR else []
+    assert compressor.offer(3, math.inf, "inf") == held + ["inf"] # In the middle of a series
+    assert compressor.offer(4, 1.0, "c") == ["c"]
+    assert compressor.offer(5, -math.inf, "-inf") == ["-inf"]
@@ -0,0 +1,17 @@
+from brontes.application.mqtt.dedup import RecentKeyFilter
+
+def test_recent_key_filter_drops_duplicates():
+  dedup = RecentKeyFilter(capacity=10)
+  assert dedup.seen(("a", "2024-04-15T13:41:32")) is False
+  assert dedup.seen(("a", "2024-04-15T13:41:32")) is True
+  assert dedup.seen(("b", "2024-04-15T13:41:32")) is False
+  assert dedup.duplicates == 1
+
+def test_recent_key_filter_evicts_least_recently_seen():
+  dedup = RecentKeyFilter(capacity=2)
+  dedup.seen("a")
+  dedup.seen("b")
+  dedup.seen("a") # a is now the most recent
+  dedup.seen("c") # evicts b
+  assert dedup.seen("a") is True
+  assert dedup.seen("b") is False
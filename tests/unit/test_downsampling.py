@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from brontes.application.dtos.point_dto import Downsampling
+from brontes.infrastructure.db.downsampling import downsample, lttb_indices, minmax_indices
+
+def reference_lttb(x, y, max_points):
+  """Straightforward LTTB without the min/max preselection."""
+  n = len(x)
+  every = (n - 2) / (max_points - 2)
+  selected = [0]
+  a = 0
+  for i in range(max_points - 2):
+    start, end = int(i * every) + 1, int((i + 1) * every) + 1
+    if i == max_points - 3:
+      bx, by = x[-1], y[-1]
+    else:
+      next_end = int((i + 2) * every) + 1
+      bx, by = np.mean(x[end:next_end]), np.mean(y[end:next_end])
+    areas = np.abs((x[a] - bx) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (by - y[a]))
+    a = start + int(np.argmax(areas))
+    selected.append(a)
+  selected.append(n - 1)
+  return np.array(selected)
+
+def test_short_series_are_not_downsampled():
+  x = np.arange(10, dtype=np.float64)
+  assert list(downsample(x, x, 10, Downsampling.LTTB)) == list(range(10))
+  assert list(downsample(x, x, 5, Downsampling.NONE)) == list(range(10))
+
+def test_lttb_matches_reference():
+  rng = np.random.default_rng(1)
+  x = np.cumsum(rng.uniform(0.5, 1.5, 300)) # Few enough that there is no min/max preselection
+  y = np.cumsum(rng.normal(size=300))
+  assert list(lttb_indices(x, y, 100)) == list(reference_lttb(x, y, 100))
+
+def test_lttb_keeps_the_ends_and_the_spike():
+  x = np.arange(100_000, dtype=np.float64)
+  y = np.sin(x / 5_000)
+  y[54_321] = 50
+  indices = downsample(x, y, 200, Downsampling.LTTB)
+  assert len(indices) == 200
+  assert indices[0] == 0 and indices[-1] == 99_999
+  assert 54_321 in indices
+  assert np.all(np.diff(indices) > 0)
+
+def test_minmax_keeps_the_extremes_of_every_bucket():
+  y = np.array([0, 5, 1, 9, 2, 3, 8, 4, 7, 6, 0], dtype=np.float64)
+  indices = minmax_indices(y, 6) # 2 buckets of the 9 inner values
+  assert list(indices) == [0, 2, 3, 5, 6, 10]
+  assert list(downsample(np.arange(11.0), y, 6, Downsampling.MINMAX)) == list(indices)
+
+def test_tiny_budgets():
+  x = np.arange(10, dtype=np.float64)
+  assert list(downsample(x, x, 2, Downsampling.LTTB)) == [0, 9]
+  with pytest.raises(ValueError):
+    downsample(x, x, 0, Downsampling.LTTB)
+
+def test_downsampling_never_exceeds_max_points():
+  x = np.arange(10, dtype=np.float64)
+  y = np.array([0, 5, 1, 9, 2, 3, 8, 4, 7, 6], dtype=np.float64)
+  for method in (Downsampling.LTTB, Downsampling.MINMAX):
+    for max_points in range(1, 12):
+      indices = downsample(x, y, max_points, method)
+      assert len(indices) <= max_points and indices[0] == 0
+  assert list(downsample(x, y, 3, Downsampling.MINMAX)) == [0, 9]
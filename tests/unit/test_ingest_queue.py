@@ -0,0 +1,108 @@
+import threading
+import pytest
+from brontes.application.mqtt import ingest_queue
+from brontes.application.mqtt.ingest_queue import IngestQueue, Backpressure
+
+def reading(i: int):
+  return ("test", 1713188460_000_000 + i * 1_000_000, float(i))
+
+def test_get_batch_returns_partial_batch_after_linger():
+  queue = IngestQueue(capacity=10)
+  for i in range(3):
+    queue.put(*reading(i))
+  batch = queue.get_batch(max_items=5, linger=0.01)
+  assert list(batch.values) == [0, 1, 2]
+  assert len(queue) == 0
+
+def test_drop_oldest():
+  queue = IngestQueue(capacity=3, backpressure=Backpressure.DROP_OLDEST)
+  for i in range(5):
+    queue.put(*reading(i))
+  assert queue.dropped == 2
+  assert list(queue.get_batch(max_items=10, linger=0).values) == [2, 3, 4]
+
+def test_block_waits_for_room():
+  queue = IngestQueue(capacity=2, backpressure=Backpressure.BLOCK)
+  queue.put(*reading(0))
+  queue.put(*reading(1))
+  producer = threading.Thread(target=queue.put, args=reading(2))
+  producer.start()
+  producer.join(timeout=0.05)
+  assert producer.is_alive() # Blocked on the full queue
+  assert len(queue.get_batch(max_items=1, linger=0)) == 1
+  producer.join(timeout=1)
+  assert not producer.is_alive()
+  assert list(queue.get_batch(max_items=10, linger=0).values) == [1, 2]
+
+def test_spill_keeps_arrival_order(tmp_path):
+  queue = IngestQueue(capacity=2, backpressure=Backpressure.SPILL, spill_path=str(tmp_path / "spill.jsonl"))
+  for i in range(5):
+    queue.put(*reading(i))
+  assert queue.spilled == 3
+  assert len(queue) == 5
+  values = list(queue.get_batch(max_items=3, linger=0).values)
+  values += list(queue.get_batch(max_items=3, linger=0).values)
+  assert values == [0, 1, 2, 3, 4]
+  assert len(queue) == 0
+
+def test_spilling_doesnt_reopen_the_file(tmp_path, monkeypatch):
+  path = tmp_path / "spill.jsonl"
+  queue = IngestQueue(capacity=1, backpressure=Backpressure.SPILL, spill_path=str(path))
+  def no_open(*args, **kwargs):
+    raise AssertionError("The spill file is opened for every reading")
+  monkeypatch.setattr(ingest_queue, "open", no_open, raising=False)
+  for i in range(4):
+    queue.put(*reading(i))
+  assert list(queue.get_batch(max_items=10, linger=0).values) == [0, 1, 2, 3] # Buffered readings are flushed before reading
+  queue.put(*reading(4))
+  queue.put(*reading(5)) # Spilled again after the file was drained
+  assert list(queue.get_batch(max_items=10, linger=0).values) == [4, 5]
+
+def test_closing_flushes_the_spill_file(tmp_path):
+  path = tmp_path / "spill.jsonl"
+  queue = IngestQueue(capacity=1, backpressure=Backpressure.SPILL, spill_path=str(path))
+  for i in range(3):
+    queue.put(*reading(i))
+  queue.close()
+  assert len(path.read_text().splitlines()) == 2
+
+def test_spill_requires_path():
+  with pytest.raises(ValueError):
+    IngestQueue(backpressure=Backpressure.SPILL)
+
+def test_close_wakes_writers():
+  queue = IngestQueue(capacity=2)
+  queue.close()
+  assert len(queue.get_batch(max_items=10, linger=5)) == 0
+  assert queue.put(*reading(0)) is False
+
+def test_batch_only_carries_its_own_timeseriesids():
+  queue = IngestQueue(capacity=10)
+  queue.put("a", 1, 1.0)
+  queue.put("b", 2, 2.0)
+  queue.put("c", 3, 3.0)
+  queue.get_batch(max_items=1, linger=0)
+  batch = queue.get_batch(max_items=10, linger=0)
+  assert batch.timeseriesids == ["b", "c"]
+  assert [(r.timeseriesid, r.value) for r in batch.to_point_readings()] == [("b", 2.0), ("c", 3.0)]
+
+def test_get_batch_wraps_around_the_ring():
+  queue = IngestQueue(capacity=3)
+  for i in range(3):
+    queue.put(*reading(i))
+  queue.get_batch(max_items=2, linger=0)
+  queue.put(*reading(3))
+  queue.put(*reading(4))
+  assert list(queue.get_batch(max_items=10, linger=0).values) == [2, 3, 4]
+
+def test_interned_timeseriesids_are_forgotten_once_the_ring_is_empty():
+  queue = IngestQueue(capacity=10, max_interned=2)
+  for name in ("a", "b", "c"):
+    queue.put(name, 1, 1.0)
+  queue.get_batch(max_items=2, linger=0)
+  assert len(queue.timeseriesids) == 3 # c is still in the ring
+  batch = queue.get_batch(max_items=10, linger=0)
+  assert batch.timeseriesids == ["c"]
+  assert queue.timeseriesids == []
+  queue.put("d", 2, 2.0)
+  assert queue.get_batch(max_items=10, linger=0).timeseriesids == ["d"]
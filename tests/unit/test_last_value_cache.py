@@ -0,0 +1,41 @@
+import time
+from brontes.application.dtos.point_dto import PointReadingBatch, from_epoch_us
+from brontes.infrastructure.db.last_value_cache import LastValueCache
+
+def batch(*readings) -> PointReadingBatch:
+  result = PointReadingBatch()
+  for timeseriesid, ts_us, value in readings:
+    result.append(timeseriesid, ts_us, value)
+  return result
+
+def test_latest_keeps_the_newest_reading_of_each_series():
+  latest = batch(("a", 3, 3.0), ("b", 1, 1.0), ("a", 5, 5.0), ("a", 4, 4.0)).latest()
+  assert sorted((r.timeseriesid, r.value) for r in latest.to_point_readings()) == [("a", 5.0), ("b", 1.0)]
+  assert len(PointReadingBatch().latest()) == 0
+
+def test_update_and_get():
+  cache = LastValueCache()
+  cache.update(batch(("a", 5, 5.0), ("b", 1, 1.0)))
+  found, missing = cache.get(["a", "b", "c"])
+  assert found == {"a": (from_epoch_us(5), 5.0), "b": (from_epoch_us(1), 1.0)}
+  assert missing == ["c"]
+  assert (cache.hits, cache.misses) == (2, 1)
+
+def test_older_reading_does_not_replace_newer():
+  cache = LastValueCache()
+  cache.update(batch(("a", 5, 5.0)))
+  cache.update(batch(("a", 3, 3.0)))
+  cache.put("a", (from_epoch_us(4), 4.0))
+  assert cache.get(["a"])[0] == {"a": (from_epoch_us(5), 5.0)}
+
+def test_entries_expire_and_missing_values_are_cached():
+  cache = LastValueCache(ttl=0.05)
+  cache.put("none", None)
+  assert cache.get(["none"]) == ({"none": None}, [])
+  time.sleep(0.06)
+  assert cache.get(["none"]) == ({}, ["none"])
+
+def test_max_entries():
+  cache = LastValueCache(max_entries=2)
+  cache.update(batch(("a", 1, 1.0), ("b", 1, 1.0), ("c", 1, 1.0)))
+  assert len(cache) <= 2
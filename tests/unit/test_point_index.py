@@ -0,0 +1,89 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+import json
+from brontes.domain.models import Point
+from brontes.application.mqtt.compression import CompressionMode
+from brontes.application.mqtt.point_index import PointIndex
+from brontes.application.mqtt.mqtt2timescale import MQTT2Timescale
+
+def point(uri: str, timeseriesid: str, collect_enabled: bool = True, **kwargs) -> Point:
+  return Point(uri=uri, timeseriesId=timeseriesid, object_name=uri, collect_enabled=collect_enabled, **kwargs)
+
+def repository(*responses):
+  point_repository = MagicMock()
+  point_repository.get_ingest_points.side_effect = list(responses)
+  return point_repository
+
+def test_resolve_by_timeseriesid_and_topic():
+  index = PointIndex(repository(([point("p1", "ts-1", mqtt_topic="plug/status/switch:0"), point("p2", "ts-2", collect_enabled=False)], 1000)))
+  index.refresh()
+  assert index.resolve("ts-1") == "ts-1"
+  assert index.resolve("plug/status/switch:0") == "ts-1"
+  assert index.resolve("ts-2") is None
+  assert index.resolve("junk") is None
+  assert (index.unknown, index.disabled) == (1, 1)
+
+def test_incremental_refresh_updates_changed_points():
+  point_repository = repository(
+    ([point("p1", "ts-1"), point("p2", "ts-2")], 1000),
+    ([point("p2", "ts-2", collect_enabled=False), point("p3", "ts-3")], 2000),
+    ([], 3000),
+  )
+  index = PointIndex(point_repository)
+  assert index.refresh()
+  assert index.refresh()
+  assert point_repository.get_ingest_points.call_args.kwargs == {"updated_since": 1000}
+  assert [index.resolve(key) for key in ("ts-1", "ts-2", "ts-3")] == ["ts-1", None, "ts-3"]
+  version = index.version
+  assert not index.refresh()
+  assert index.version == version
+
+def test_full_refresh_drops_deleted_points():
+  index = PointIndex(repository(([point("p1", "ts-1"), point("p2", "ts-2")], 1000), ([point("p1", "ts-1")], 2000)), full_refresh_interval=0)
+  index.refresh()
+  index.refresh()
+  assert index.resolve("ts-2") is None
+  assert len(index) == 1
+
+def test_compression_settings_of_enabled_points():
+  index = PointIndex(repository(([
+    point("p1", "ts-1", compression_mode="deadband", compression_deviation=0.5),
+    point("p2", "ts-2", collect_enabled=False, compression_mode="deadband"),
+    point("p3", "ts-3", compression_mode="bogus"),
+  ], 1000)))
+  index.refresh()
+  assert list(index.compression) == ["ts-1"]
+  assert index.compression["ts-1"].mode == CompressionMode.DEADBAND
+
+def test_request_refresh_wakes_the_refresh_thread():
+  point_repository = repository(([], 1000), ([point("p1", "ts-1")], 2000))
+  index = PointIndex(point_repository, refresh_interval=60)
+  index.refresh()
+  index.start()
+  index.request_refresh()
+  for _ in range(100):
+    if index.resolve("ts-1"):
+      break
+    index.stopped.wait(0.01)
+  index.stop()
+  assert index.resolve("ts-1") == "ts-1"
+
+def test_empty_index_drops_every_reading():
+  index = PointIndex(repository(([], 1000)))
+  index.refresh()
+  app = MQTT2Timescale(MagicMock(), MagicMock(), point_index=index)
+  payload = {"src": "shellyplugus-abc", "params": {"ts": 1713188492.2, "switch:0": {"id": 0, "current": 0.5}}}
+  app.on_mqtt_message(None, None, SimpleNamespace(topic="shellyplugus-abc/events/rpc", payload=json.dumps(payload).encode()))
+  app.stop()
+  assert index.unknown == 1
+  assert app.ts.insert_timeseries.call_count == 0
+
+def test_stop_disconnects_before_flushing_the_compressor():
+  index = PointIndex(repository(([], 1000)))
+  index.refresh()
+  app = MQTT2Timescale(MagicMock(), MagicMock(), point_index=index)
+  calls = []
+  app.mqtt_client.disconnect.side_effect = lambda: calls.append("disconnect")
+  app.compressor.flush = lambda: calls.append("flush") or []
+  app.stop()
+  assert calls == ["disconnect", "flush"]
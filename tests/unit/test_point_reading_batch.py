@@ -0,0 +1,45 @@
+import struct
+import numpy as np
+from brontes.application.dtos.point_dto import PointReading, PointReadingBatch, to_epoch_us, from_epoch_us
+from brontes.infrastructure.db.timescale import encode_copy_binary, COPY_BINARY_HEADER, COPY_BINARY_TRAILER, POSTGRES_EPOCH_US
+
+def test_epoch_us_round_trip():
+  ts_us = to_epoch_us("2024-04-15T13:41:32.5Z")
+  assert ts_us == 1713188492_500_000
+  assert from_epoch_us(ts_us).isoformat() == "2024-04-15T13:41:32.500000+00:00"
+
+def test_from_point_readings_interns_timeseriesids():
+  batch = PointReadingBatch.from_point_readings([
+    PointReading(ts="2024-04-15T13:41:32+00:00", value=1, timeseriesid="a"),
+    PointReading(ts="2024-04-15T13:41:33+00:00", value=2, timeseriesid="b"),
+    PointReading(ts="2024-04-15T13:41:34+00:00", value=3, timeseriesid="a"),
+  ])
+  assert batch.timeseriesids == ["a", "b"]
+  assert list(batch.series) == [0, 1, 0]
+  assert [r.timeseriesid for r in batch.to_point_readings()] == ["a", "b", "a"]
+
+def test_extend_remaps_timeseriesids():
+  batch = PointReadingBatch()
+  batch.append("a", 1, 1.0)
+  other = PointReadingBatch()
+  other.append("b", 2, 2.0)
+  other.append("a", 3, 3.0)
+  batch.extend(other)
+  assert [(r.timeseriesid, r.value) for r in batch.to_point_readings()] == [("a", 1.0), ("b", 2.0), ("a", 3.0)]
+
+def test_encode_copy_binary():
+  batch = PointReadingBatch()
+  batch.append("a", POSTGRES_EPOCH_US + 1, 1.5)
+  batch.append("bé", POSTGRES_EPOCH_US + 2, 2.5)
+  batch.append("a", POSTGRES_EPOCH_US + 3, 3.5)
+  stream = b"".join(encode_copy_binary(batch, np.array([10, 20], dtype=np.int32), chunk_rows=2))
+  assert stream.startswith(COPY_BINARY_HEADER) and stream.endswith(COPY_BINARY_TRAILER)
+  offset = len(COPY_BINARY_HEADER)
+  rows = []
+  for _ in range(3):
+    fields, ts_length, ts, series_id_length, series_id, value_length, value = struct.unpack_from(">hiqiiid", stream, offset)
+    offset += struct.calcsize(">hiqiiid")
+    assert (ts_length, series_id_length, value_length) == (8, 4, 8)
+    rows.append((fields, ts, series_id, value))
+  assert rows == [(3, 1, 10, 1.5), (3, 2, 20, 2.5), (3, 3, 10, 3.5)]
+  assert offset == len(stream) - len(COPY_BINARY_TRAILER)
@@ -0,0 +1,38 @@
+import asyncio
+import json
+from unittest.mock import MagicMock
+from brontes.application.dtos.point_dto import Resolution, StreamFormat
+from brontes.application.services.point_service import PointService
+
+CHUNKS = [
+  ("a", [{"ts": "2024-01-01T00:00:00+00:00", "value": 1.0, "timeseriesid": "a"}, {"ts": "2024-01-01T00:01:00+00:00", "value": 2.0, "timeseriesid": "a"}]),
+  ("b", [{"ts": "2024-01-01T00:00:00+00:00", "value": 3.0, "timeseriesid": "b"}]),
+]
+
+def stream(format: StreamFormat) -> list:
+  async def chunks(**kwargs):
+    for chunk in CHUNKS:
+      yield chunk
+  repository = MagicMock()
+  repository.stream_points_history_async = chunks
+  service = PointService(point_repository=repository, device_repository=MagicMock(), mqtt_client=MagicMock())
+  async def collect():
+    return [part async for part in service.stream_points_history(["uri"], "2024-01-01T00:00:00+00:00", "2024-01-02T00:00:00+00:00", format=format)]
+  return asyncio.run(collect())
+
+def test_stream_points_history_ndjson():
+  parts = stream(StreamFormat.NDJSON)
+  assert len(parts) == 2 # One part per chunk
+  assert [json.loads(line)["value"] for line in "".join(parts).splitlines()] == [1.0, 2.0, 3.0]
+
+def test_stream_points_history_csv_has_one_header():
+  lines = "".join(stream(StreamFormat.CSV)).splitlines()
+  assert lines[0] == "ts,value,timeseriesid"
+  assert lines[1:] == ["2024-01-01T00:00:00+00:00,1.0,a", "2024-01-01T00:01:00+00:00,2.0,a", "2024-01-01T00:00:00+00:00,3.0,b"]
+
+def test_points_history_defaults_to_all_raw_readings():
+  repository = MagicMock()
+  service = PointService(point_repository=repository, device_repository=MagicMock(), mqtt_client=MagicMock())
+  service.get_points_history(["uri"], "2024-01-01T00:00:00+00:00", "2024-01-02T00:00:00+00:00")
+  kwargs = repository.points_history.call_args.kwargs
+  assert (kwargs['resolution'], kwargs['max_points']) == (Resolution.RAW, None)
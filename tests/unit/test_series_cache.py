@@ -0,0 +1,21 @@
+from brontes.infrastructure.db.series_cache import SeriesCache
+
+def test_put_and_get():
+  cache = SeriesCache()
+  assert cache.put([("a", 1), ("b", 2)]) == {"a": 1, "b": 2}
+  found, missing = cache.get(["a", "b", "c"])
+  assert found == {"a": 1, "b": 2}
+  assert missing == ["c"]
+  assert (cache.hits, cache.misses) == (2, 1)
+
+def test_unknown_ids_are_not_cached():
+  cache = SeriesCache()
+  cache.put([])
+  assert cache.get(["a"]) == ({}, ["a"])
+  assert len(cache) == 0
+
+def test_full_cache_is_cleared():
+  cache = SeriesCache(max_entries=2)
+  cache.put([("a", 1), ("b", 2)])
+  cache.put([("c", 3)])
+  assert cache.get(["a", "c"]) == ({"c": 3}, ["a"])
@@ -0,0 +1,66 @@
+from unittest.mock import MagicMock
+from brontes.application.dtos.point_dto import PointReadingBatch
+from brontes.application.mqtt.spool import Spool, SpoolPosition, SpoolReplayer, encode_batch, decode_batch
+
+def batch(start: int, size: int = 3) -> PointReadingBatch:
+  readings = PointReadingBatch()
+  for i in range(start, start + size):
+    readings.append(f"test-{i % 2}", 1713188492_000_000 + i, float(i))
+  return readings
+
+def test_encode_decode_batch():
+  decoded = decode_batch(encode_batch(batch(0, 5)))
+  assert decoded.to_point_readings() == batch(0, 5).to_point_readings()
+
+def test_append_and_read_across_segments(tmp_path):
+  spool = Spool(str(tmp_path), segment_bytes=200)
+  for i in range(0, 30, 3):
+    spool.append(batch(i))
+  assert len(spool.segments()) > 1
+  readings, position = spool.read(SpoolPosition(spool.segments()[0], 0), max_rows=100)
+  assert list(readings.values) == list(range(30))
+  assert position == spool.end()
+
+def test_read_resumes_from_position(tmp_path):
+  spool = Spool(str(tmp_path))
+  spool.append(batch(0))
+  first, position = spool.read(SpoolPosition(1, 0), max_rows=1)
+  spool.append(batch(3))
+  rest, _ = spool.read(position, max_rows=100)
+  first.extend(rest)
+  assert list(first.values) == list(range(6))
+
+def test_corrupt_tail_is_skipped(tmp_path):
+  spool = Spool(str(tmp_path))
+  spool.append(batch(0))
+  spool.close()
+  with open(spool.segment_path(1), "ab") as f:
+    f.write(b"\xff\x00\x00\x00\x00\x00\x00\x00torn")
+  reopened = Spool(str(tmp_path)) # Starts a new segment
+  reopened.append(batch(3))
+  readings, _ = reopened.read(SpoolPosition(1, 0), max_rows=100)
+  assert list(readings.values) == list(range(6))
+
+def test_replayer_commits_checkpoint_with_data(tmp_path):
+  spool = Spool(str(tmp_path), segment_bytes=200)
+  for i in range(0, 30, 3):
+    spool.append(batch(i))
+  ts = MagicMock()
+  ts.get_ingest_checkpoint.return_value = None
+  replayer = SpoolReplayer(spool, ts, name="test", batch_rows=1000)
+  assert replayer.replay_once() == 30
+  readings, kwargs = ts.insert_timeseries.call_args.args[0], ts.insert_timeseries.call_args.kwargs
+  assert len(readings) == 30
+  assert kwargs["checkpoint"] == ("test", *spool.end())
+  assert spool.segments() == [spool.end().segment] # Replayed segments are removed
+  assert replayer.replay_once() == 0
+
+def test_replayer_resumes_from_database_checkpoint(tmp_path):
+  spool = Spool(str(tmp_path))
+  position = spool.append(batch(0))
+  spool.append(batch(3))
+  ts = MagicMock()
+  ts.get_ingest_checkpoint.return_value = tuple(position)
+  replayer = SpoolReplayer(spool, ts, name="test")
+  assert replayer.replay_once() == 3
+  assert list(ts.insert_timeseries.call_args.args[0].values) == [3, 4, 5]
@@ -0,0 +1,55 @@
+from unittest.mock import MagicMock
+from brontes.application.mqtt import supervisor as supervisor_module
+from brontes.application.mqtt.supervisor import IngestSupervisor, aggregate_stats, shared_topic
+
+def test_shared_topic():
+  assert shared_topic("ingest", "shellyplugus-+/#") == "$share/ingest/shellyplugus-+/#"
+
+def test_aggregate_stats():
+  stats = aggregate_stats({
+    0: {"queue_depth": 10, "flushed_rows": 100, "max_flush_latency": 0.5, "database_healthy": True},
+    1: {"queue_depth": 5, "flushed_rows": 50, "max_flush_latency": 1.5, "database_healthy": False},
+  })
+  assert stats == {"workers": 2, "queue_depth": 15, "flushed_rows": 150, "max_flush_latency": 1.5, "database_healthy": False}
+
+def test_dead_workers_are_restarted(monkeypatch):
+  monkeypatch.setattr(supervisor_module.time, "monotonic", lambda: 10_000.0) # Whatever the uptime of the host
+  supervisor = IngestSupervisor(workers=2)
+  supervisor.start_worker = MagicMock(side_effect=lambda worker_id: supervisor.processes.__setitem__(worker_id, MagicMock(is_alive=lambda: True)))
+  supervisor.check_workers()
+  assert supervisor.start_worker.call_count == 2
+
+  supervisor.processes[1].is_alive = lambda: False
+  supervisor.started_at[1] = 0 # Ran for a long time before exiting, restart right away
+  supervisor.check_workers()
+  assert supervisor.start_worker.call_count == 3
+  supervisor.start_worker.assert_called_with(1)
+
+def test_restarts_are_counted_across_replaced_workers(monkeypatch):
+  monkeypatch.setattr(supervisor_module.time, "monotonic", lambda: 10_000.0)
+  supervisor = IngestSupervisor(workers=1)
+  supervisor.start_worker = MagicMock(side_effect=lambda worker_id: supervisor.processes.__setitem__(worker_id, MagicMock(is_alive=lambda: True)))
+  supervisor.check_workers()
+  for _ in range(3):
+    supervisor.processes[0].is_alive = lambda: False
+    supervisor.started_at[0] = 0 # Long running, the backoff counter is reset
+    supervisor.check_workers()
+  assert supervisor.restarts[0] == 0
+  assert supervisor.stats()["restarts"] == 3
+
+def test_workers_that_crash_right_away_back_off(monkeypatch):
+  clock = [5.0] # Shortly after boot
+  monkeypatch.setattr(supervisor_module.time, "monotonic", lambda: clock[0])
+  supervisor = IngestSupervisor(workers=1)
+  def start_worker(worker_id):
+    supervisor.processes[worker_id] = MagicMock(is_alive=lambda: True)
+    supervisor.started_at[worker_id] = clock[0]
+  supervisor.start_worker = MagicMock(side_effect=start_worker)
+  supervisor.check_workers()
+  supervisor.processes[0].is_alive = lambda: False
+  clock[0] += 1
+  supervisor.check_workers()
+  assert supervisor.restarts[0] == 1 and supervisor.start_worker.call_count == 1 # Waits a second before restarting
+  clock[0] += 1
+  supervisor.check_workers()
+  assert supervisor.start_worker.call_count == 2
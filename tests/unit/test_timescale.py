@@ -0,0 +1,275 @@
+from dataclasses import asdict
+from datetime import datetime, timedelta, timezone
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+import numpy as np
+import pytest
+from brontes.application.dtos.point_dto import Fill, PointReading, PointReadingBatch, PointRollup, Resolution, to_datetime
+from brontes.infrastructure.db.block_cache import BlockCache
+from brontes.infrastructure.db.timescale import COPY_BINARY_HEADER, COPY_BINARY_TRAILER, CachedHistory, HypertableSettings, Timescale, aligned_timeseries, grouped_statistics, history_records, parse_duration, select_resolution
+
+def test_select_resolution_uses_raw_readings_for_short_ranges():
+  assert select_resolution(timedelta(hours=6), max_points=2000) == Resolution.RAW
+
+def test_select_resolution_picks_the_finest_rollup_within_budget():
+  assert select_resolution(timedelta(days=7), max_points=2000) == Resolution.FIFTEEN_MINUTES
+  assert select_resolution(timedelta(days=60), max_points=2000) == Resolution.HOUR
+  assert select_resolution(timedelta(days=90), max_points=2000) == Resolution.DAY
+  assert select_resolution(timedelta(days=90), max_points=5_000) == Resolution.HOUR
+
+def test_select_resolution_falls_back_to_days():
+  assert select_resolution(timedelta(days=3650), max_points=100) == Resolution.DAY
+
+def test_parse_duration():
+  assert parse_duration("30m") == timedelta(minutes=30)
+  assert parse_duration("12h") == timedelta(hours=12)
+  assert parse_duration("7d") == timedelta(days=7)
+  assert parse_duration("52w") == timedelta(weeks=52)
+  with pytest.raises(ValueError):
+    parse_duration("7 days")
+
+def test_hypertable_settings_from_environment(monkeypatch):
+  monkeypatch.setenv("TIMESCALE_CHUNK_INTERVAL", "12h")
+  monkeypatch.setenv("TIMESCALE_COMPRESS_AFTER", "none")
+  monkeypatch.setenv("TIMESCALE_RETAIN_FOR", "52w")
+  settings = HypertableSettings.from_environment()
+  assert settings == HypertableSettings(chunk_interval=timedelta(hours=12), compress_after=None, retain_for=timedelta(weeks=52))
+
+def test_hypertable_settings_defaults(monkeypatch):
+  for name in ("TIMESCALE_CHUNK_INTERVAL", "TIMESCALE_COMPRESS_AFTER", "TIMESCALE_RETAIN_FOR"):
+    monkeypatch.delenv(name, raising=False)
+  assert HypertableSettings.from_environment() == HypertableSettings(chunk_interval=timedelta(days=1), compress_after=timedelta(days=7), retain_for=None)
+
+def test_retention_shorter_than_the_rollup_window_is_rejected():
+  with pytest.raises(ValueError):
+    Timescale(MagicMock(), hypertable=HypertableSettings(retain_for=timedelta(days=3)))
+
+SERIES_IDS = {"a": 1, "b": 2}
+
+def history_timescale(rows):
+  postgres = MagicMock()
+  timescale = Timescale(postgres, hypertable=HypertableSettings())
+  timescale.series.put(SERIES_IDS.items())
+  cursor = postgres.connection.return_value.__enter__.return_value.cursor.return_value.__enter__.return_value
+  cursor.fetchall.return_value = [] # Timeseries ids that aren't cached have no series row
+  cursor.fetchmany.side_effect = fetched_in_batches(rows)
+  return timescale
+
+def async_history_timescale(rows):
+  postgres = MagicMock()
+  timescale = Timescale(postgres, hypertable=HypertableSettings())
+  timescale.series.put(SERIES_IDS.items())
+  conn = postgres.async_connection.return_value.__aenter__.return_value
+  conn.cursor = MagicMock() # AsyncConnection.cursor() is a plain method returning an async context manager
+  cursor = conn.cursor.return_value.__aenter__.return_value
+  cursor.execute = AsyncMock()
+  cursor.fetchall = AsyncMock(return_value=[])
+  cursor.fetchmany = AsyncMock(side_effect=fetched_in_batches(rows))
+  return timescale
+
+def fetched_in_batches(rows):
+  def fetchmany(size):
+    batch = rows[:size]
+    del rows[:size]
+    return batch
+  return fetchmany
+
+def raw_rows(timeseriesid, count):
+  start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+  return [(start + timedelta(minutes=i), float(i), SERIES_IDS[timeseriesid]) for i in range(count)]
+
+def test_history_records_match_the_dtos():
+  row = raw_rows("a", 1)[0]
+  assert history_records([row], Resolution.RAW, "a") == [asdict(PointReading(ts=row[0].isoformat(), value=row[1], timeseriesid="a"))]
+  rollup = (row[0], 1.5, 1, 1.0, 2.0, 2.0, 4)
+  assert history_records([rollup], Resolution.HOUR, "a") == [asdict(PointRollup(ts=row[0].isoformat(), value=1.5, timeseriesid="a", min=1.0, max=2.0, last=2.0, count=4))]
+
+def test_stream_timeseries_groups_in_one_pass():
+  timescale = history_timescale(raw_rows("a", 5) + raw_rows("b", 3))
+  chunks = list(timescale.stream_timeseries(["a", "b", "c"], "2024-01-01T00:00:00+00:00", "2024-01-02T00:00:00+00:00", max_points=None, chunk_size=2))
+  assert [(timeseriesid, len(data)) for timeseriesid, data in chunks] == [("a", 2), ("a", 2), ("a", 1), ("b", 2), ("b", 1)]
+
+def test_get_timeseries_downsamples_each_timeseries():
+  timescale = history_timescale(raw_rows("a", 50) + raw_rows("b", 3))
+  result = timescale.get_timeseries(["a", "b", "c"], "2024-01-01T00:00:00+00:00", "2024-01-02T00:00:00+00:00", max_points=10)
+  assert [(item['timeseriesid'], len(item['data'])) for item in result] == [("a", 10), ("b", 3), ("c", 0)]
+  assert result[0]['data'][-1]['value'] == 49.0
+
+def test_get_timeseries_returns_all_raw_readings_by_default():
+  timescale = history_timescale(raw_rows("a", 3000)) # 50 hours of readings, more than DEFAULT_MAX_POINTS
+  result = timescale.get_timeseries(["a"], "2024-01-01T00:00:00+00:00", "2024-01-04T00:00:00+00:00")
+  assert len(result[0]['data']) == 3000 and 'count' not in result[0]['data'][0]
+
+def test_stream_timeseries_async_groups_like_the_sync_stream():
+  async def collect(timescale):
+    return [chunk async for chunk in timescale.stream_timeseries_async(["a", "b"], "2024-01-01T00:00:00+00:00", "2024-01-02T00:00:00+00:00", max_points=None, chunk_size=2)]
+  chunks = asyncio.run(collect(async_history_timescale(raw_rows("a", 5) + raw_rows("b", 3))))
+  assert [(timeseriesid, len(data)) for timeseriesid, data in chunks] == [("a", 2), ("a", 2), ("a", 1), ("b", 2), ("b", 1)]
+
+def test_latest_values_are_read_with_one_prepared_statement():
+  postgres = MagicMock()
+  timescale = Timescale(postgres, hypertable=HypertableSettings())
+  cursor = postgres.connection.return_value.__enter__.return_value.cursor.return_value.__enter__.return_value
+  cursor.fetchall.return_value = []
+  for ids in (["a"], ["b", "c", "d"]):
+    timescale.get_latest_values(ids)
+  queries = [call.args[0] for call in cursor.execute.call_args_list[-2:]]
+  assert queries[0] == queries[1] and "ANY(%s::text[])" in queries[0]
+  assert cursor.execute.call_args_list[-1].args[1] == (["b", "c", "d"],)
+  assert cursor.execute.call_args_list[-1].kwargs == {"prepare": True}
+
+def test_history_is_queried_by_series_id():
+  timescale = history_timescale(raw_rows("a", 2))
+  list(timescale.stream_timeseries(["a", "c"], "2024-01-01T00:00:00+00:00", "2024-01-02T00:00:00+00:00"))
+  cursor = timescale.postgres.connection.return_value.__enter__.return_value.cursor.return_value.__enter__.return_value
+  series_query, history_query = cursor.execute.call_args_list[-2:]
+  assert series_query.args[1] == (["c"],) # Only the ids that aren't cached are looked up
+  assert "series_id = ANY(%s::int[])" in history_query.args[0]
+  assert history_query.args[1][0] == [1]
+
+def test_history_streams_read_naive_timestamps_like_get_timeseries():
+  timescale = history_timescale([])
+  list(timescale.stream_timeseries(["a"], "2024-01-01T00:00:00", "2024-01-02T00:00:00"))
+  cursor = timescale.postgres.connection.return_value.__enter__.return_value.cursor.return_value.__enter__.return_value
+  assert cursor.execute.call_args.args[1][1:] == (to_datetime("2024-01-01T00:00:00"), to_datetime("2024-01-02T00:00:00"))
+  history = timescale.cached_history(["a"], "2024-01-01T00:00:00", "2024-01-02T00:00:00", Resolution.RAW, None, SERIES_IDS)
+  assert (history.start, history.end) == cursor.execute.call_args.args[1][1:]
+
+def test_exports_read_naive_timestamps_like_get_timeseries():
+  timescale = history_timescale([])
+  cursor = timescale.postgres.connection.return_value.__enter__.return_value.cursor.return_value.__enter__.return_value
+  cursor.copy.return_value.__enter__.return_value.__iter__.return_value = iter([COPY_BINARY_HEADER + COPY_BINARY_TRAILER])
+  timescale.export_timeseries(["a"], "2024-01-01T00:00:00", "2024-01-02T00:00:00").read_all()
+  assert cursor.copy.call_args.args[1][1:] == (to_datetime("2024-01-01T00:00:00"), to_datetime("2024-01-02T00:00:00"))
+
+def test_new_series_are_created_before_the_readings_are_copied():
+  postgres = MagicMock()
+  timescale = Timescale(postgres, hypertable=HypertableSettings())
+  timescale.series.put([("a", 7)])
+  cursor = postgres.connection.return_value.__enter__.return_value.cursor.return_value.__enter__.return_value
+  cursor.fetchall.return_value = [("b", 8)]
+  batch = PointReadingBatch()
+  batch.append("b", 1, 1.0)
+  batch.append("a", 2, 2.0)
+  assert list(timescale.batch_series_ids(batch)) == [8, 7]
+  assert cursor.execute.call_args_list[-2].args[1] == (["b"],)
+  assert timescale.series.get(["a", "b"]) == ({"a": 7, "b": 8}, [])
+
+def test_aligned_timeseries_matrix():
+  rows = [(60_000_000, 2, 2.0), (0, 1, 1.0), (0, 2, None), (60_000_000, 1, 3.0)]
+  aligned = aligned_timeseries(rows, ["a", "b", "c"], {"a": 1, "b": 2})
+  assert list(aligned.ts.astype(np.int64)) == [0, 60_000_000]
+  assert np.array_equal(aligned.values, [[1.0, np.nan, np.nan], [3.0, 2.0, np.nan]], equal_nan=True)
+  assert aligned.to_dict()['values'] == [[1.0, None, None], [3.0, 2.0, None]]
+
+def test_aligned_query_reads_the_coarsest_rollup_that_divides_the_bucket():
+  timescale = Timescale(MagicMock(), hypertable=HypertableSettings())
+  start, end = datetime(2024, 1, 1, tzinfo=timezone.utc), datetime(2024, 1, 2, tzinfo=timezone.utc)
+  assert "FROM timeseries_1h t" in timescale.aligned_query(timedelta(hours=3), Fill.LOCF, start, end)
+  assert "FROM timeseries_15m t" in timescale.aligned_query(timedelta(minutes=45), Fill.INTERPOLATE, start, end)
+  assert "FROM timeseries t" in timescale.aligned_query(timedelta(seconds=30), Fill.NONE, start, end)
+  assert "locf(" in timescale.aligned_query(timedelta(hours=3), Fill.LOCF, start, end)
+
+def test_aligned_query_only_reads_a_rollup_that_lines_up_with_the_range():
+  timescale = Timescale(MagicMock(), hypertable=HypertableSettings())
+  end = datetime(2024, 1, 2, tzinfo=timezone.utc)
+  assert "FROM timeseries_15m t" in timescale.aligned_query(timedelta(hours=3), Fill.LOCF, datetime(2024, 1, 1, 10, 15, tzinfo=timezone.utc), end)
+  assert "FROM timeseries_1m t" in timescale.aligned_query(timedelta(hours=3), Fill.LOCF, datetime(2024, 1, 1, 10, 7, tzinfo=timezone.utc), end)
+  assert "FROM timeseries t" in timescale.aligned_query(timedelta(hours=3), Fill.LOCF, datetime(2024, 1, 1, 10, 7, 30, tzinfo=timezone.utc), end)
+
+def test_aligned_timeseries_queries_the_bounds_the_rollup_was_picked_for():
+  timescale = history_timescale([])
+  cursor = timescale.postgres.connection.return_value.__enter__.return_value.cursor.return_value.__enter__.return_value
+  timescale.get_aligned_timeseries(["a"], "2024-01-01T10:15:00", "2024-01-02T00:00:00", timedelta(hours=3))
+  params = cursor.execute.call_args.args[1]
+  assert (params['start'], params['end']) == (to_datetime("2024-01-01T10:15:00"), to_datetime("2024-01-02T00:00:00"))
+  assert params['start'].tzinfo is not None
+
+def test_grouped_statistics_splits_the_rows_by_group():
+  rows = [(0, 0, 2.0, 1.0, 3.0, 2, [2.0, 2.9]), (3_600_000_000, 0, 4.0, 4.0, 4.0, 1, [4.0, 4.0]), (0, 2, 5.0, 5.0, 5.0, 1, None)]
+  data = grouped_statistics(rows, 3, [0.5, 0.95])
+  assert [len(group) for group in data] == [2, 0, 1]
+  assert data[0][0] == {'ts': "1970-01-01T00:00:00+00:00", 'avg': 2.0, 'min': 1.0, 'max': 3.0, 'count': 2, 'percentiles': {'p50': 2.0, 'p95': 2.9}}
+  assert data[2][0]['percentiles'] == {}
+
+def test_statistics_read_a_rollup_unless_percentiles_are_requested():
+  timescale = Timescale(MagicMock(), hypertable=HypertableSettings())
+  start, end = datetime(2024, 1, 1, tzinfo=timezone.utc), datetime(2024, 1, 2, tzinfo=timezone.utc)
+  assert "FROM timeseries_1h t" in timescale.statistics_query(timedelta(hours=6), False, start, end)
+  assert "FROM timeseries t" in timescale.statistics_query(timedelta(hours=6), True, start, end)
+  assert "percentile_cont" in timescale.statistics_query(timedelta(hours=6), True, start, end)
+  # 10:07:30 to 11:07:30 doesn't line up with any rollup bucket
+  assert "FROM timeseries t" in timescale.statistics_query(timedelta(hours=1), False, datetime(2024, 1, 1, 10, 7, 30, tzinfo=timezone.utc), datetime(2024, 1, 1, 11, 7, 30, tzinfo=timezone.utc))
+  with pytest.raises(ValueError):
+    timescale.get_grouped_statistics([["a"]], "2024-01-01T00:00:00+00:00", "2024-01-02T00:00:00+00:00", bucket=timedelta(hours=1), percentiles=[95])
+
+def test_grouped_statistics_query_the_bounds_the_rollup_was_picked_for():
+  timescale = history_timescale([])
+  cursor = timescale.postgres.connection.return_value.__enter__.return_value.cursor.return_value.__enter__.return_value
+  timescale.get_grouped_statistics([["a"]], "2024-01-01T10:00:00", "2024-01-02T00:00:00", bucket=timedelta(hours=1))
+  params = cursor.execute.call_args.args[1]
+  assert (params['start'], params['end']) == (to_datetime("2024-01-01T10:00:00"), to_datetime("2024-01-02T00:00:00"))
+
+def test_get_timeseries_serves_closed_blocks_from_the_cache():
+  timescale = history_timescale(raw_rows("a", 50) + raw_rows("b", 3))
+  cursor = timescale.postgres.connection.return_value.__enter__.return_value.cursor.return_value.__enter__.return_value
+  first = timescale.get_timeseries(["a", "b"], "2024-01-01T00:10:00+00:00", "2024-01-01T12:00:00+00:00", max_points=None)
+  assert [len(item['data']) for item in first] == [40, 0] # The rows before 00:10 belong to the first block but not to the range
+  history_query = cursor.execute.call_args_list[-1]
+  assert history_query.args[1]['starts'] == [datetime(2024, 1, 1, tzinfo=timezone.utc)] * 2
+  queries = cursor.execute.call_count
+  assert timescale.get_timeseries(["a", "b"], "2024-01-01T00:10:00+00:00", "2024-01-01T12:00:00+00:00", max_points=None) == first
+  assert cursor.execute.call_count == queries
+
+def test_cached_history_only_queries_the_open_blocks():
+  now = datetime(2024, 1, 2, 14, tzinfo=timezone.utc)
+  blocks = BlockCache(settle=timedelta(hours=1))
+  for block in range(6): # Closed blocks up to 2024-01-02T12:00
+    blocks.put((1, "raw", datetime(2024, 1, 1, tzinfo=timezone.utc) + block * timedelta(hours=6)), ())
+  history = CachedHistory(blocks, Resolution.RAW, {"a": 1}, datetime(2024, 1, 1, 3, tzinfo=timezone.utc), now, now)
+  assert history.fetch_from == {1: datetime(2024, 1, 2, 12, tzinfo=timezone.utc)}
+  assert history.params()['end'] == now + timedelta(microseconds=1)
+
+def test_cached_history_doesnt_widen_an_open_block():
+  now = datetime(2024, 1, 2, 14, tzinfo=timezone.utc)
+  blocks = BlockCache(settle=timedelta(hours=1))
+  start = now - timedelta(minutes=15)
+  history = CachedHistory(blocks, Resolution.RAW, {"a": 1}, start, now, now)
+  assert history.fetch_from == {1: start}
+  history.add([(start, 1.0, 1)])
+  assert history.rows(1) == [(start, 1.0, 1)]
+  assert len(blocks) == 0
+
+def test_auto_resolution_follows_max_points():
+  timescale = history_timescale([])
+  start, end = "2024-01-01T00:00:00+00:00", "2024-01-08T00:00:00+00:00"
+  assert timescale.cached_history(["a"], start, end, Resolution.AUTO, None, SERIES_IDS).resolution == Resolution.FIFTEEN_MINUTES
+  assert timescale.cached_history(["a"], start, end, Resolution.AUTO, 100, SERIES_IDS).resolution == Resolution.DAY
+
+def test_late_readings_discard_the_cached_blocks():
+  timescale = history_timescale([])
+  block = datetime(2024, 1, 1, tzinfo=timezone.utc)
+  for key in [(1, "raw", block), (1, "1m", block), (2, "raw", block), (1, "raw", block + timedelta(hours=6))]:
+    timescale.blocks.put(key, ())
+  batch = PointReadingBatch()
+  batch.append("a", int((block + timedelta(hours=3) - datetime(1970, 1, 1, tzinfo=timezone.utc)) / timedelta(microseconds=1)), 1.0)
+  timescale.insert_timeseries(batch)
+  assert timescale.blocks.get((1, "raw", block)) is None
+  assert timescale.blocks.get((1, "1m", block)) is None
+  assert timescale.blocks.get((2, "raw", block)) == ()
+  assert timescale.blocks.get((1, "raw", block + timedelta(hours=6))) == ()
+
+def test_setup_is_serialized_with_an_advisory_lock():
+  postgres = MagicMock()
+  cursor = postgres.connection.return_value.__enter__.return_value.cursor.return_value.__enter__.return_value
+  cursor.fetchone.return_value = (True,)
+  cursor.fetchall.return_value = []
+  Timescale(postgres, hypertable=HypertableSettings())
+  statements = [call.args[0] for call in cursor.execute.call_args_list]
+  lock = next(i for i, statement in enumerate(statements) if "pg_advisory_xact_lock" in statement)
+  assert lock < next(i for i, statement in enumerate(statements) if "information_schema.columns" in statement) # Before the migration
+
+def test_setup_can_be_left_to_another_process():
+  postgres = MagicMock()
+  Timescale(postgres, hypertable=HypertableSettings(), setup=False)
+  postgres.connection.assert_not_called()
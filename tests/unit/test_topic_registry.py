@@ -0,0 +1,46 @@
+import json
+import pytest
+from brontes.application.mqtt.topic_registry import TopicTrie, ParserRegistry
+from brontes.application.mqtt.shelly_parsers import parse_shelly_plug_rpc_event
+from brontes.application.mqtt import shelly_parsers
+from brontes.application.mqtt.topic_registry import parser_registry
+
+@pytest.mark.parametrize("topic,expected", [
+  ("building/floor1/temp", "exact"),
+  ("building/floor2/temp", "single"),
+  ("building/floor2/humidity", "multi"),
+  ("building", "multi"),
+  ("other/floor1/temp", None),
+])
+def test_topic_trie_match(topic, expected):
+  trie = TopicTrie()
+  trie.insert("building/floor1/temp", "exact")
+  trie.insert("building/+/temp", "single")
+  trie.insert("building/#", "multi")
+  assert trie.match(topic) == expected
+
+def test_topic_trie_rejects_invalid_filter():
+  with pytest.raises(ValueError):
+    TopicTrie().insert("building/#/temp", "invalid")
+
+def test_registry_resolves_by_device_type():
+  registry = ParserRegistry()
+  registry.add("+/events/rpc", lambda topic, payload: "shelly", device_type="shellyplugus")
+  registry.add("#", lambda topic, payload: "fallback", device_type="tasmota")
+  assert registry.resolve("shellyplugus-abc/events/rpc")("", b"") == "shelly"
+  assert registry.resolve("tasmota-abc/events/rpc")("", b"") == "fallback"
+  assert registry.resolve("unknown-abc/events/rpc") is None
+
+def test_shelly_parsers_are_registered():
+  assert parser_registry.resolve("shellyplugus-083af2013f98/events/rpc") is parse_shelly_plug_rpc_event
+  assert parser_registry.resolve("shellyplugus-083af2013f98/status/switch:0") is shelly_parsers.parse_shelly_plug_switch_status
+
+def test_parse_shelly_plug_rpc_event():
+  payload = {"src": "shellyplugus-abc", "params": {"ts": 1713188492.2, "switch:0": {"id": 0, "current": 0.5, "voltage": 120.1, "apower": 60}}}
+  readings = parse_shelly_plug_rpc_event("shellyplugus-abc/events/rpc", json.dumps(payload).encode())
+  assert {timeseriesid: value for timeseriesid, ts_us, value in readings} == {"shellyplugus-abc-switch-0-current": 0.5, "shellyplugus-abc-switch-0-voltage": 120.1}
+
+def test_parse_shelly_plug_rpc_event_rounds_the_timestamp():
+  payload = {"src": "shellyplugus-abc", "params": {"ts": 1712345678.123456, "switch:0": {"id": 0, "current": 0.5}}}
+  readings = parse_shelly_plug_rpc_event("shellyplugus-abc/events/rpc", json.dumps(payload).encode())
+  assert readings[0][1] == 1712345678_123456